@@ -0,0 +1,385 @@
+"""
+Benchmarks the file converter on synthetic videos.
+
+Every conversion path and option combination of the FileConverter is run on videos
+generated with PyAV, recording the throughput, peak memory and output size in a json
+report that can be compared with the report of another version.
+
+Usage:
+    python benchmarks/converter_benchmark.py --output report.json
+    python benchmarks/converter_benchmark.py --quick --compare baseline.json
+"""
+
+import argparse
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from datetime import datetime, timezone
+
+import av
+import numpy as np
+
+REST_API_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rest_api")
+
+# (width, height) of the generated videos
+RESOLUTIONS = [(320, 240), (1280, 720), (1920, 1080)]
+# duration of the generated videos in seconds, the longest has enough frames
+# to be decoded in parallel segments, see PARALLEL_MIN_FRAMES of the converter
+DURATIONS = [2, 10, 30]
+# codecs the generated videos are encoded with, skipped if not available
+CODECS = ["h264", "mpeg4", "hevc"]
+FRAME_RATE = 25
+GOP_SIZE = 50
+
+# the smaller matrix used with --quick
+QUICK_RESOLUTIONS = [(320, 240)]
+QUICK_DURATIONS = [2, 24]
+QUICK_CODECS = ["h264"]
+
+# mp4 to jpeg decode options, as keyword arguments for mp4_to_jpeg
+DECODE_OPTIONS = {
+    "all": {},
+    "keyframes": {"keyframes_only": True},
+    "scenes": {"keyframes_only": True, "scene_threshold": 10.0},
+    "dedup": {"dedup_distance": 4},
+}
+
+# targeted size of the tar shards, small enough to create multiple shards
+SHARD_SIZE = 16 * 1024**2
+
+# a change in throughput, memory or size larger than this is marked in the comparison
+COMPARE_THRESHOLD = 0.1
+
+
+def load_converter_module():
+    """Load the file converter without initializing the app and its database connections."""
+    if "rest_api" not in sys.modules:
+        # register the package without running its __init__, which connects to the databases
+        package = types.ModuleType("rest_api")
+        package.__path__ = [REST_API_PATH]
+        sys.modules["rest_api"] = package
+    return importlib.import_module("rest_api.file_converter")
+
+
+def codec_available(codec):
+    """Check whether PyAV can encode with a codec."""
+    try:
+        av.codec.Codec(codec, "w")
+    except (av.error.FFmpegError, ValueError):
+        return False
+    return True
+
+
+def synthetic_frame(background, i):
+    """
+    Create a frame of a synthetic video by moving a window over a noisy background
+    and drawing a moving square on it.
+
+    :param background:  noise image twice as wide as the frames
+    :param i:           index of the frame
+    :return:            the frame as PyAV video frame
+    """
+    height, width = background.shape[0], background.shape[1] // 2
+    offset = (i * 4) % width
+    img = np.ascontiguousarray(background[:, offset : offset + width])
+    size = height // 4
+    top = (i * 3) % (height - size)
+    img[top : top + size, offset // 2 : offset // 2 + size] = (255, 0, 0)
+    return av.VideoFrame.from_ndarray(img, format="rgb24")
+
+
+def generate_video(width, height, duration, codec):
+    """
+    Generate an mp4 video with moving shapes and noise, so it does not compress to nothing.
+
+    :return:    the video as bytes
+    """
+    rng = np.random.default_rng(0)
+    # the background is reused with a moving window, so generating frames is cheap
+    background = rng.integers(0, 256, (height, width * 2, 3), dtype=np.uint8)
+
+    video = io.BytesIO()
+    with av.open(video, "w", format="mp4") as container:
+        stream = container.add_stream(codec, rate=FRAME_RATE)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = GOP_SIZE
+
+        for i in range(duration * FRAME_RATE):
+            for packet in stream.encode(synthetic_frame(background, i)):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+    return video.getvalue()
+
+
+def measure(function, trace_memory):
+    """
+    Run a function and measure its duration and the memory it allocated.
+
+    :return:    (result, seconds, peak traced bytes or None)
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+    peak_traced = None
+    if trace_memory:
+        _, peak_traced = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, seconds, peak_traced
+
+
+def output_size(output):
+    """Get the size in bytes of the output of a conversion."""
+    if isinstance(output, io.BytesIO):
+        return output.getbuffer().nbytes
+    # a list of (shard, samples), a shard is a list of the chunks of the tar file
+    return sum(memoryview(chunk).nbytes for shard, _ in output for chunk in shard)
+
+
+def run_writer(converter, file_format, jpegs, trace_memory):
+    """
+    Measure writing decoded frames to an output format.
+
+    :return:    (output size in bytes, seconds, peak traced bytes or None)
+    """
+    writers = {
+        "pickle": converter.jpeg_to_pickle,
+        "h5": converter.jpeg_to_h5,
+        "npy": converter.jpeg_to_npy,
+        "npz": converter.jpeg_to_npz,
+        "shards": lambda frames: list(converter.jpeg_to_shards(frames, SHARD_SIZE)),
+    }
+    output, seconds, peak_traced = measure(
+        lambda: writers[file_format](jpegs), trace_memory
+    )
+    return output_size(output), seconds, peak_traced
+
+
+def run_case(video, case, trace_memory, processes, results):
+    """
+    Run a single benchmark case, meant to be run in its own process so the peak RSS is its own.
+
+    :param video:       the video as bytes
+    :param case:        dict with the stage, decode option and format of the case
+    """
+    converter = load_converter_module().FileConverter(processes=processes)
+    decode_options = DECODE_OPTIONS[case["decode"]]
+
+    if case["stage"] == "decode":
+        jpegs, seconds, peak_traced = measure(
+            lambda: converter.mp4_to_jpeg(io.BytesIO(video), **decode_options),
+            trace_memory,
+        )
+        size = jpegs.nbytes
+    else:
+        # the writers are measured on their own, without the decoding
+        jpegs = converter.mp4_to_jpeg(io.BytesIO(video), **decode_options)
+        size, seconds, peak_traced = run_writer(
+            converter, case["format"], jpegs, trace_memory
+        )
+
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    results.put(
+        {
+            "frames": len(jpegs),
+            "seconds": seconds,
+            "frames_per_second": len(jpegs) / seconds if seconds else None,
+            "peak_rss_bytes": peak_rss,
+            "peak_traced_bytes": peak_traced,
+            "output_bytes": size,
+        }
+    )
+
+
+def run_isolated(video, case, trace_memory, processes):
+    """Run a benchmark case in a fresh process and return its measurements."""
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    process = context.Process(
+        target=run_case, args=(video, case, trace_memory, processes, results)
+    )
+    process.start()
+    measurements = results.get()
+    process.join()
+    return measurements
+
+
+def get_cases():
+    """Get every conversion path and option combination."""
+    cases = []
+    for decode in DECODE_OPTIONS:
+        cases.append({"stage": "decode", "decode": decode, "format": "jpeg"})
+    for file_format in ["pickle", "h5", "npy", "npz", "shards"]:
+        cases.append({"stage": "write", "decode": "all", "format": file_format})
+    return cases
+
+
+def case_key(result):
+    """Get the key that identifies the same case in reports of different versions."""
+    video = result["video"]
+    case = result["case"]
+    return (
+        f"{video['codec']} {video['width']}x{video['height']} {video['duration']}s "
+        f"{case['stage']} {case['decode']} {case['format']} p{result['processes']}"
+    )
+
+
+def get_version():
+    """Get the commit the benchmark is run on."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(__file__),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def benchmark_video(video_info, args):
+    """
+    Run all benchmark cases on a generated video.
+
+    :param video_info:  dict with the codec, width, height and duration of the video
+    :return:            list of results
+    """
+    video = generate_video(
+        video_info["width"], video_info["height"], video_info["duration"], video_info["codec"]
+    )
+    video_info["input_bytes"] = len(video)
+
+    # shorter videos are decoded in a single process, whatever the number of processes
+    parallel = (
+        video_info["duration"] * FRAME_RATE >= load_converter_module().PARALLEL_MIN_FRAMES
+    )
+    results = []
+    for case in get_cases():
+        # only decoding depends on the number of processes
+        if case["stage"] == "decode" and parallel:
+            process_counts = sorted({1, args.processes})
+        else:
+            process_counts = [1]
+        for processes in process_counts:
+            result = {"video": video_info, "case": case, "processes": processes}
+            result.update(run_isolated(video, case, args.tracemalloc, processes))
+            # keyframe modes output few frames, so also count the frames of the video
+            result["video_frames_per_second"] = (
+                video_info["duration"] * FRAME_RATE / result["seconds"]
+            )
+            results.append(result)
+            print(
+                f"{case_key(result)}: {result['video_frames_per_second']:.1f} frames/s, "
+                f"{result['peak_rss_bytes'] / 1024**2:.0f} MB RSS, "
+                f"{result['output_bytes'] / 1024**2:.1f} MB output",
+                file=sys.stderr,
+            )
+    return results
+
+
+def run_benchmarks(args):
+    """Run all benchmark cases and create the report."""
+    resolutions = QUICK_RESOLUTIONS if args.quick else RESOLUTIONS
+    durations = QUICK_DURATIONS if args.quick else DURATIONS
+    codecs = [c for c in (QUICK_CODECS if args.quick else CODECS) if codec_available(c)]
+
+    results = []
+    for codec in codecs:
+        for width, height in resolutions:
+            for duration in durations:
+                video_info = {
+                    "codec": codec,
+                    "width": width,
+                    "height": height,
+                    "duration": duration,
+                }
+                results.extend(benchmark_video(video_info, args))
+
+    return {
+        "version": args.label or get_version(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "platform": {
+            "python": platform.python_version(),
+            "av": av.__version__,
+            "numpy": np.__version__,
+            "cpus": os.cpu_count(),
+            "machine": platform.machine(),
+        },
+        "results": results,
+    }
+
+
+def relative_change(new, old):
+    """Get the relative change between two measurements, None if it can't be computed."""
+    if new is None or not old:
+        return None
+    return (new - old) / old
+
+
+def compare_reports(report, baseline):
+    """Print the changes in throughput, memory and output size compared to a baseline report."""
+    baseline_results = {case_key(result): result for result in baseline["results"]}
+    print(f"Comparing {report['version']} with {baseline['version']}")
+    for result in report["results"]:
+        key = case_key(result)
+        if key not in baseline_results:
+            print(f"{key}: new case")
+            continue
+        old = baseline_results[key]
+        changes = []
+        for metric in ["video_frames_per_second", "peak_rss_bytes", "output_bytes"]:
+            change = relative_change(result.get(metric), old.get(metric))
+            if change is None:
+                continue
+            marker = " !" if abs(change) > COMPARE_THRESHOLD else ""
+            changes.append(f"{metric} {change:+.1%}{marker}")
+        print(f"{key}: {', '.join(changes)}")
+
+
+def main():
+    """Parse the arguments, run the benchmarks and write the report."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n", 1)[0])
+    parser.add_argument("--output", default="converter_benchmark.json", help="path of the json report")
+    parser.add_argument("--quick", action="store_true", help="only benchmark a small video")
+    parser.add_argument("--label", help="version name in the report, the commit by default")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes for parallel decoding, compared with a single process",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="also record the peak of Python allocations, slows down the conversions",
+    )
+    parser.add_argument("--compare", help="path of a report of another version to compare with")
+    args = parser.parse_args()
+
+    report = run_benchmarks(args)
+    with open(args.output, "w", encoding="utf-8") as report_file:
+        json.dump(report, report_file, indent=2)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as baseline_file:
+            compare_reports(report, json.load(baseline_file))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 "use-client";
 
-import React from "react";
+import React, { useState } from "react";
 import { FaFile } from "react-icons/fa";
 import { FaFolder } from "react-icons/fa";
 import { File } from "@lib/types";
@@ -25,11 +25,27 @@ export function FileTags({ file, type }: { file: File; type: "user" | "custom" }
 }
 
 export function FileName({ file }: { file: File }) {
+    // files without a thumbnail fall back to an icon
+    const [hasThumbnail, setHasThumbnail] = useState(true);
+
     return (
         <div className="flex items-center" data-cy="file-name">
             <div className="mr-2">
-                {/* Based on the file type display an icon */}
-                {file.type == "file" ? <FaFile color="gray" size={20} /> : <FaFolder color="gray" size={20} />}
+                {/* Show a thumbnail if the file has one, otherwise an icon based on the file type */}
+                {hasThumbnail ? (
+                    <img
+                        src={`/api/files/${file.id}/thumbnail`}
+                        alt=""
+                        loading="lazy"
+                        className="h-8 w-8 object-cover rounded"
+                        onError={() => setHasThumbnail(false)}
+                        data-cy="file-thumbnail"
+                    />
+                ) : file.type == "file" ? (
+                    <FaFile color="gray" size={20} />
+                ) : (
+                    <FaFolder color="gray" size={20} />
+                )}
             </div>
             <div>{file.index}</div>
         </div>
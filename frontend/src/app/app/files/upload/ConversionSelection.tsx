@@ -5,17 +5,24 @@
 import React, { ChangeEvent } from "react";
 
 // Required for the dropdown for Pickle conversion
-import { Radio, RadioGroup, Tooltip } from "@nextui-org/react";
+import { Checkbox, Radio, RadioGroup, Tooltip } from "@nextui-org/react";
 
 interface Props {
     setSelectedConversion: (input: string) => void;
     selectedOption: string;
+    setKeyframesOnly: (input: boolean) => void;
+    keyframesOnly: boolean;
 }
 
 // Pickle conversion dropdown menu
-export default function ConversionSelection({ setSelectedConversion, selectedOption }: Props) {
+export default function ConversionSelection({
+    setSelectedConversion,
+    selectedOption,
+    setKeyframesOnly,
+    keyframesOnly,
+}: Props) {
     // Create a constant for the pickle convesion selection menu
-    // Either No conversion, Pickle conversion, H5 conversion or JPEG conversion
+    // Either No conversion, Pickle conversion, H5 conversion, NumPy conversion or JPEG conversion
 
     const handleChange = (e: ChangeEvent<HTMLInputElement>) => {
         setSelectedConversion(e.target.value);
@@ -27,6 +34,7 @@ export default function ConversionSelection({ setSelectedConversion, selectedOpt
             <h1 className="text-lg font-bold">Store mp4 frames in pickle files.</h1>
             <div>Very fast to load.</div>
             <div>Requires large storage space.</div>
+            <div>Legacy format, prefer NPY or NPZ.</div>
         </div>
     );
 
@@ -39,6 +47,33 @@ export default function ConversionSelection({ setSelectedConversion, selectedOpt
         </div>
     );
 
+    // tooltip for npy conversion
+    const npyTip = (
+        <div>
+            <h1 className="text-lg font-bold">Store decoded mp4 frames in a NumPy npy file.</h1>
+            <div>Can be memory mapped to read single frames.</div>
+            <div>Requires large storage space.</div>
+        </div>
+    );
+
+    // tooltip for npz conversion
+    const npzTip = (
+        <div>
+            <h1 className="text-lg font-bold">Store mp4 frames as jpegs in a NumPy npz file.</h1>
+            <div>Contains an offsets index to read single frames.</div>
+            <div>Compact storage.</div>
+        </div>
+    );
+
+    // tooltip for tar shards conversion
+    const shardsTip = (
+        <div>
+            <h1 className="text-lg font-bold">Store mp4 frames in tar shards of 1 GB.</h1>
+            <div>Fast sequential reads for streaming training.</div>
+            <div>Shards can be split over multiple nodes.</div>
+        </div>
+    );
+
     // how long to delay tooltip
     const hoverDelay = 1000;
 
@@ -64,6 +99,24 @@ export default function ConversionSelection({ setSelectedConversion, selectedOpt
                         H5
                     </Radio>
                 </Tooltip>
+                {/* option for npy conversion */}
+                <Tooltip placement="right" delay={hoverDelay} content={npyTip}>
+                    <Radio key="npy" value="npy">
+                        NPY
+                    </Radio>
+                </Tooltip>
+                {/* option for npz conversion */}
+                <Tooltip placement="right" delay={hoverDelay} content={npzTip}>
+                    <Radio key="npz" value="npz">
+                        NPZ
+                    </Radio>
+                </Tooltip>
+                {/* option for tar shards conversion */}
+                <Tooltip placement="right" delay={hoverDelay} content={shardsTip}>
+                    <Radio key="shards" value="shards">
+                        Tar Shards
+                    </Radio>
+                </Tooltip>
                 {/* option for jpeg conversion */}
                 <Tooltip
                     placement="right"
@@ -75,6 +128,21 @@ export default function ConversionSelection({ setSelectedConversion, selectedOpt
                     </Radio>
                 </Tooltip>
             </RadioGroup>
+            {/* option to only convert the keyframes */}
+            <Tooltip
+                placement="right"
+                delay={hoverDelay}
+                content="Only convert the keyframes of the mp4, much faster for previews and coarse sampling."
+            >
+                <Checkbox
+                    className="mt-2"
+                    isSelected={keyframesOnly}
+                    onValueChange={setKeyframesOnly}
+                    isDisabled={selectedOption === "none"}
+                >
+                    Keyframes only
+                </Checkbox>
+            </Tooltip>
         </div>
     );
 }
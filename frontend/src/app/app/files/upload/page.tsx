@@ -60,6 +60,8 @@ export default function UploadPage() {
     const [selectedEntries, setSelectedEntries] = useState<FileKey[]>([]);
     // File conversion option that is currently selected
     const [selectedOption, setSelectedOption] = useState<string>("none");
+    // Whether only the keyframes of the videos should be converted
+    const [keyframesOnly, setKeyframesOnly] = useState(false);
     // File entries that should be displayed to be uploaded
     const [entriesToDisplay, setEntriesToDisplay] = useState<FileDisplay[]>([]);
     // Whether an upload process has started
@@ -116,6 +118,7 @@ export default function UploadPage() {
         console.log(selectedCustomTags.concat(selectedUserTags));
         console.log(user.email);
         formData.append("format", selectedOption);
+        formData.append("frames", keyframesOnly ? "keyframes" : "all");
 
         // Send the files
         await postFile(formData);
@@ -179,6 +182,8 @@ export default function UploadPage() {
                             <ConversionSelection
                                 selectedOption={selectedOption}
                                 setSelectedConversion={setSelectedOption}
+                                keyframesOnly={keyframesOnly}
+                                setKeyframesOnly={setKeyframesOnly}
                             />
                         </div>
                     </div>
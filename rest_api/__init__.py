@@ -6,15 +6,33 @@
 from datetime import timedelta, datetime
 from flask import Flask, request, abort
 from .routes import blueprint, health
+from .routes.files.file_upload_endpoint import progress
 from .middleware.authorization import AuthorizationMiddleware
 
 # pylint: disable=unused-import
-from .models import db, SQL_CNN_URI, file, user, image, role, tag, task, session
+from .models import (
+    db,
+    SQL_CNN_URI,
+    file,
+    user,
+    image,
+    role,
+    tag,
+    task,
+    session,
+    conversion_cache,
+    upload_progress,
+)
+from .models.migrations import add_missing_columns
+from .lib.resumable_upload_utils import check_shared_dir
 from .couch_init import couch_db
 
 
 def create_app():
     """This function initializes all the components, needed to create the application"""
+    # replicas that do not share the resumable uploads would lose their chunks
+    check_shared_dir()
+
     app = Flask(__name__)
 
     # set the database connection string
@@ -23,9 +41,13 @@ def create_app():
 
     db.init_app(app)
 
-    # create all of the db tables, if they don't exist
+    # create all of the db tables, if they don't exist,
+    # and add the columns that are missing from tables created by an earlier version
     with app.app_context():
         db.create_all()
+        add_missing_columns()
+        # the jobs of a process that stopped are gone with their spooled files
+        progress.fail_lost()
 
     # initialize the authorization middleware
     app.wsgi_app = AuthorizationMiddleware(app.wsgi_app, app)
@@ -0,0 +1,151 @@
+"""
+Defines fair sharing of the CPU heavy conversion work between users.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import threading
+
+# number of conversions that decode videos at the same time, over all users
+CONVERSION_WORKERS = int(os.environ.get("CONVERSION_WORKERS", 2))
+
+# share of the conversion workers of a user with a role, relative to other users,
+# a user with multiple roles gets the largest weight of them
+ROLE_WEIGHTS = json.loads(
+    os.environ.get(
+        "CONVERSION_ROLE_WEIGHTS",
+        '{"Admin": 1, "Maintainer": 1, "Data Engineer": 1, "AI Researcher": 1}',
+    )
+)
+DEFAULT_WEIGHT = 1
+
+# size of a video that counts as one unit of work, 1 MB
+COST_UNIT_BYTES = 1024**2
+
+# numbers conversions in the order they are submitted, over all schedulers,
+# so conversions with the same finish time run in that order
+submission_order = itertools.count()
+
+
+def get_weight(roles):
+    """
+    Get the weight of a user in the fair share of the conversion workers.
+
+    :param roles:   names of the roles of the user
+    :return:        the largest weight of the roles
+    """
+    return max((ROLE_WEIGHTS.get(role, DEFAULT_WEIGHT) for role in roles), default=DEFAULT_WEIGHT)
+
+
+def get_cost(input_file):
+    """
+    Estimate the work of converting a video from its size, at least one unit.
+
+    :param input_file:  the video as seekable file-like object
+    :return:            the cost in units of COST_UNIT_BYTES
+    """
+    position = input_file.tell()
+    size = input_file.seek(0, os.SEEK_END)
+    input_file.seek(position)
+    return max(1.0, size / COST_UNIT_BYTES)
+
+
+class ConversionScheduler:
+    """
+    Runs conversions with weighted fair queuing over per-user queues.
+
+    Every conversion gets a virtual finish time: the later of the current virtual time and the
+    finish time of the previous conversion of the same user, plus its cost divided by the weight
+    of the user. Waiting conversions run in order of their finish time, at most `workers` at once.
+    The conversions of one user run in the order they were submitted, while a small conversion of
+    another user is not queued behind all of them, so small uploads start soon even while a bulk
+    import is running.
+
+    Conversions run on the thread that submits them, which waits until it is their turn.
+    The optional on_change function is called without arguments whenever the waiting
+    conversions changed, so their positions can be reported.
+    """
+
+    def __init__(self, workers=CONVERSION_WORKERS, on_change=None):
+        self.workers = workers
+        self.on_change = on_change
+        self.running = 0
+        self.virtual_time = 0.0
+        # user mapped to the virtual finish time of their last submitted conversion
+        self.finish_times = {}
+        # heap of waiting conversions as [finish time, sequence number, user, label]
+        self.waiting = []
+        self.condition = threading.Condition()
+
+    def run(self, user, weight, cost, convert, label=None):
+        """
+        Run a conversion once it is its turn.
+
+        :param user:    identifies the queue of the conversion, like the id of the user
+        :param weight:  share of the user, from get_weight
+        :param cost:    estimated work of the conversion, from get_cost
+        :param convert: function without arguments doing the conversion
+        :param label:   name of the conversion reported by get_positions, like the uploaded path
+        :return:        the result of convert
+        """
+        with self.condition:
+            start = max(self.virtual_time, self.finish_times.get(user, 0.0))
+            finish = start + cost / weight
+            self.finish_times[user] = finish
+            entry = [finish, next(submission_order), user, label]
+            heapq.heappush(self.waiting, entry)
+        self.changed()
+        with self.condition:
+            while self.running >= self.workers or self.waiting[0] is not entry:
+                self.condition.wait()
+            heapq.heappop(self.waiting)
+            self.running += 1
+            # the virtual time follows the conversions that are started
+            self.virtual_time = max(self.virtual_time, start)
+            # the position of every other waiting conversion changed
+            self.condition.notify_all()
+        self.changed()
+
+        try:
+            return convert()
+        finally:
+            with self.condition:
+                self.running -= 1
+                if not self.waiting and not self.running:
+                    # nothing is queued, so earlier finish times do not matter anymore
+                    self.finish_times.clear()
+                self.condition.notify_all()
+
+    def changed(self):
+        """Report that the waiting conversions changed, outside of the lock of the scheduler."""
+        if self.on_change is not None:
+            self.on_change()
+
+    def get_positions(self, user):
+        """
+        Get the positions of the waiting conversions of a user.
+
+        :param user:    identifies the queue, like the id of the user
+        :return:        label mapped to the number of conversions that start before it plus one
+        """
+        return {
+            label: position
+            for (entry_user, label), position in self.get_all_positions().items()
+            if entry_user == user
+        }
+
+    def get_all_positions(self):
+        """
+        Get the positions of the waiting conversions of all users.
+
+        :return:        (user, label) mapped to the number of conversions that start before it
+                        plus one
+        """
+        with self.condition:
+            ordered = sorted(self.waiting)
+        return {
+            (user, label): position
+            for position, (_, _, user, label) in enumerate(ordered, start=1)
+        }
@@ -0,0 +1,146 @@
+"""
+Read-only file-like access to files in dCache through ranged reads
+"""
+
+import io
+from collections import OrderedDict
+
+# size of the blocks a file is fetched in, 1 MB
+BLOCK_SIZE = 1024**2
+# number of blocks that are kept in memory per file
+MAX_BLOCKS = 64
+
+
+class DCacheFile(io.RawIOBase):
+    """
+    A read-only, seekable file-like object over a file in dCache.
+
+    The file is fetched in blocks with ranged reads when they are first read, and the most
+    recently used blocks are kept in memory, so libraries that seek around in a file, like
+    PyAV and h5py, only fetch the parts of the file they touch.
+    Like other files, it has a single position and should not be shared between threads.
+    """
+
+    # number of blocks that are kept in memory
+    max_blocks = MAX_BLOCKS
+
+    def __init__(self, interactor, path, block_size=BLOCK_SIZE):
+        """
+        Open a file in dCache.
+
+        :param interactor:  the dCache interactor to read with
+        :param path:        path to the file
+        :param block_size:  size of the blocks the file is fetched in
+        :raises FileNotFoundError: if the file does not exist
+        """
+        super().__init__()
+        self.interactor = interactor
+        self.path = path
+        self.size = interactor.get_file_size(path)
+        if self.size is None:
+            raise FileNotFoundError(path)
+        self.block_size = block_size
+        self.position = 0
+        # block index mapped to its content, the least recently used block first
+        self.blocks = OrderedDict()
+        # number of bytes fetched from dCache, to see how much of the file was needed
+        self.fetched_bytes = 0
+
+    def readable(self):
+        """The file can be read."""
+        return True
+
+    def seekable(self):
+        """The file supports random access."""
+        return True
+
+    def tell(self):
+        """Get the current position in the file."""
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        """
+        Move to a position in the file.
+
+        :param offset:  the offset relative to whence
+        :param whence:  io.SEEK_SET, io.SEEK_CUR or io.SEEK_END
+        :return:        the new position
+        """
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self.position + offset
+        elif whence == io.SEEK_END:
+            position = self.size + offset
+        else:
+            raise ValueError(f"invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("negative seek position")
+        self.position = position
+        return self.position
+
+    def get_blocks(self, first, last):
+        """
+        Get the blocks in a range, fetching the blocks that are not in memory with one request
+        per run of contiguous missing blocks.
+
+        :param first:   index of the first block
+        :param last:    index of the last block
+        :return:        dict of block index to content
+        """
+        blocks = {i: self.blocks[i] for i in range(first, last + 1) if i in self.blocks}
+
+        runs = []
+        for i in range(first, last + 1):
+            if i in blocks:
+                continue
+            if runs and runs[-1][1] == i - 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+
+        for run_first, run_last in runs:
+            start = run_first * self.block_size
+            end = min((run_last + 1) * self.block_size, self.size)
+            data = self.interactor.get_file_range(self.path, start, end)
+            self.fetched_bytes += len(data)
+            for i in range(run_first, run_last + 1):
+                offset = (i - run_first) * self.block_size
+                blocks[i] = data[offset : offset + self.block_size]
+
+        # mark the blocks as recently used and evict the least recently used blocks
+        for i in range(first, last + 1):
+            self.blocks[i] = blocks[i]
+            self.blocks.move_to_end(i)
+        while len(self.blocks) > self.max_blocks:
+            self.blocks.popitem(last=False)
+
+        return blocks
+
+    def readinto(self, buffer):
+        """
+        Read bytes from the current position into a buffer.
+
+        :param buffer:  writable bytes-like object
+        :return:        the number of bytes read, 0 at the end of the file
+        """
+        end = min(self.position + len(buffer), self.size)
+        if end <= self.position:
+            return 0
+
+        first = self.position // self.block_size
+        last = (end - 1) // self.block_size
+        blocks = self.get_blocks(first, last)
+
+        view = memoryview(buffer).cast("B")
+        written = 0
+        for i in range(first, last + 1):
+            block = blocks[i]
+            block_start = i * self.block_size
+            start = max(self.position, block_start) - block_start
+            stop = min(end, block_start + len(block)) - block_start
+            view[written : written + stop - start] = block[start:stop]
+            written += stop - start
+
+        self.position += written
+        return written
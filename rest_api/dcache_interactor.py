@@ -137,6 +137,38 @@ class DCacheInteractor:
         )
         return file
 
+    def get_file_size(self, path):
+        """
+        Gets the size of a file in dCache without downloading it
+
+        :param dir:     Path to the file
+        :return:        The size in bytes, None if the file does not exist
+        """
+        # make a HEAD request to only get the headers of the file
+        response = requests.head(self.url + path, headers=self.get_headers(), timeout=5)
+        if not response.ok:
+            return None
+        return int(response.headers["Content-Length"])
+
+    def get_file_range(self, path, start, end):
+        """
+        Gets a byte range of a file from dCache
+
+        :param dir:     Path to the file
+        :param start:   Offset of the first byte of the range
+        :param end:     Offset after the last byte of the range
+        :return:        The bytes in the range
+        """
+        # make a ranged GET request, the end of an HTTP range is inclusive
+        headers = self.get_headers()
+        headers["Range"] = f"bytes={start}-{end - 1}"
+        response = requests.get(self.url + path, headers=headers, timeout=5)
+        response.raise_for_status()
+        # a server that does not support ranges sends the whole file
+        if response.status_code != 206:
+            return response.content[start:end]
+        return response.content
+
     def delete_file(self, path):
         """
         Deletes a file from dCache
@@ -155,12 +187,28 @@ class DCacheInteractor:
         Uploads a file to dCache
 
         :param dir:     Path to place the file
-        :param file:    The file to upload
+        :param file:    The file to upload, or its content as a bytes-like object
         :return:        The response from dCache
         """
+        # bytes-like content, like a memoryview of a frame, is sent without copying it
+        data = file.read() if hasattr(file, "read") else file
         # make a PUT request to upload a file to dcache
         resp = requests.put(
-            self.url + path, data=file.read(), headers=self.get_headers(), timeout=5
+            self.url + path, data=data, headers=self.get_headers(), timeout=5
+        )
+        return resp
+
+    def upload_stream(self, path, chunks):
+        """
+        Uploads a file to dCache while its content is received, without holding it in memory
+
+        :param dir:     Path to place the file
+        :param chunks:  Iterator over the content of the file as bytes
+        :return:        The response from dCache
+        """
+        # an iterator as data is sent with chunked transfer encoding as it is read
+        resp = requests.put(
+            self.url + path, data=chunks, headers=self.get_headers(), timeout=5
         )
         return resp
 
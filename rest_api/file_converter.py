@@ -1,23 +1,454 @@
 """Defines utility for doing file conversions."""
 
 import io
+import json
+import os
 import pickle
+import tarfile
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 import cv2
 import h5py
 import numpy as np
 import av
 
+from .frame_batch import FrameBatch
+
+
+# width and height of the frames compared for scene change detection
+SCENE_THUMBNAIL_SIZE = 64
+
+# width and height of the frames a perceptual hash is computed from, and of its DCT
+DCT_SIZE = 32
+# width and height of the low frequency DCT coefficients that make up the 64 bit hash
+HASH_SIZE = 8
+
+# number of processes decoding segments of a video in parallel
+CONVERTER_PROCESSES = int(os.environ.get("CONVERTER_PROCESSES", os.cpu_count() or 1))
+
+# videos with fewer frames are decoded in a single process
+PARALLEL_MIN_FRAMES = 500
+
+# number of segments a video is split into per process, so uneven segments are balanced out
+SEGMENTS_PER_PROCESS = 4
+
+# size of a tar header block and the padding unit of the tar members
+TAR_BLOCK_SIZE = 512
+
+
+def tar_member_size(size):
+    """
+    Size a member with the given content size takes up in a tar archive.
+
+    :param size:    size of the member content in bytes
+    :return:        size of the header and padded content in bytes
+    """
+    padded_size = -(-size // TAR_BLOCK_SIZE) * TAR_BLOCK_SIZE
+    return TAR_BLOCK_SIZE + padded_size
+
+
+def tar_member(name, content):
+    """
+    Blocks of a member of a tar archive, as tarfile writes them.
+
+    :param name:    name of the member
+    :param content: content of the member as bytes-like object, which is not copied
+    :return:        list of the header, the content and the padding after it
+    """
+    member = tarfile.TarInfo(name)
+    member.size = len(content)
+    padding = tar_member_size(len(content)) - TAR_BLOCK_SIZE - len(content)
+    return [member.tobuf(), content, b"\0" * padding]
+
+
+def tar_end(size):
+    """
+    End of a tar archive, as tarfile writes it: two empty blocks, padded to a full record.
+
+    :param size:    size of the members of the archive in bytes
+    :return:        the end of the archive as bytes
+    """
+    end_size = 2 * TAR_BLOCK_SIZE
+    return b"\0" * (end_size + -(size + end_size) % tarfile.RECORDSIZE)
+
+
+def scene_thumbnail(frame):
+    """
+    Create the small grayscale version of a frame that is compared for scene change detection.
+
+    :param frame:   PyAV video frame
+    :return:        the thumbnail as int16 NumPy array, so differences can be taken
+    """
+    thumbnail = frame.reformat(
+        width=SCENE_THUMBNAIL_SIZE, height=SCENE_THUMBNAIL_SIZE, format="gray"
+    ).to_ndarray()
+    return thumbnail.astype("int16")
+
+
+def dct_matrix(size):
+    """
+    Create the orthonormal DCT-II matrix, the DCT of a square image x is D @ x @ D.T.
+
+    :param size:    width and height of the image
+    :return:        the matrix as NumPy array
+    """
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix.astype("float32")
+
+
+DCT_MATRIX = dct_matrix(DCT_SIZE)
+
+
+def perceptual_hash(frame):
+    """
+    Compute a 64 bit DCT perceptual hash of a frame, similar frames have hashes
+    with a small Hamming distance.
+
+    :param frame:   PyAV video frame
+    :return:        the hash as integer
+    """
+    pixels = frame.reformat(width=DCT_SIZE, height=DCT_SIZE, format="gray").to_ndarray()
+    coefficients = (DCT_MATRIX @ pixels.astype("float32") @ DCT_MATRIX.T)[
+        :HASH_SIZE, :HASH_SIZE
+    ]
+    bits = coefficients > np.median(coefficients)
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def is_near_duplicate(frame_hash, previous_hash, dedup_distance):
+    """
+    Check whether a frame is a near duplicate of the previous kept frame.
+
+    :param frame_hash:      perceptual hash of the frame
+    :param previous_hash:   perceptual hash of the previous kept frame, None if there is none
+    :param dedup_distance:  largest Hamming distance between near duplicates
+    :return:                whether the frame should be dropped
+    """
+    return (
+        previous_hash is not None
+        and (frame_hash ^ previous_hash).bit_count() <= dedup_distance
+    )
+
+
+def drop_near_duplicates(video_frames, dedup_distance):
+    """
+    Drop the frames of a batch that are near duplicates of the previous kept frame.
+
+    :param video_frames:    FrameBatch with the perceptual hash of every frame as "phash" metadata
+    :param dedup_distance:  largest Hamming distance between near duplicates
+    :return:                FrameBatch without the near duplicates
+    """
+    kept = []
+    previous_hash = None
+    for i, metadata in enumerate(video_frames.metadata):
+        # the hash is only needed here, so the metadata matches serial decoding
+        frame_hash = metadata.pop("phash")
+        if not is_near_duplicate(frame_hash, previous_hash, dedup_distance):
+            kept.append(i)
+            previous_hash = frame_hash
+    return video_frames.select(kept)
+
+
+def encode_jpeg(frame):
+    """
+    Encode a decoded video frame as JPEG.
+
+    :param frame:   PyAV video frame
+    :return:        JPEG file as byte array, None if encoding failed
+    """
+    # Convert PyAV frame to PIL Image then to NumPy array for cv2 compatibility
+    img = frame.to_image()  # Converts frame to PIL Image
+    img_array = np.array(img)  # Converts PIL Image to NumPy array
+
+    # Encode the NumPy array as a JPEG
+    # pylint: disable=no-member
+    # This should be ignored because pylint insists that imencode doesn't exist yet it does.
+    is_success, buffer = cv2.imencode(".jpg", img_array)
+    if not is_success:
+        return None
+    # Convert the buffer (numpy array) to bytes
+    return buffer.tobytes()
+
+
+def append_frame(video_frames, frame, **metadata):
+    """
+    Encode a decoded video frame as JPEG and append it to a batch with its timestamps.
+
+    :param video_frames:    FrameBatch to append to
+    :param frame:           PyAV video frame
+    :param metadata:        additional metadata of the frame
+    """
+    frame_bytes = encode_jpeg(frame)
+    if frame_bytes is not None:
+        video_frames.append(
+            frame_bytes,
+            pts=frame.pts,
+            time=frame.time,
+            keyframe=frame.key_frame,
+            **metadata,
+        )
+
+
+def find_segments(video_stream, processes):
+    """
+    Split a video into keyframe aligned segments that can be decoded independently.
+
+    Only the packets are read, no frame is decoded.
+
+    :param video_stream:    MP4 file as BytesIO
+    :param processes:       number of processes the segments are decoded by
+    :return:                list of (start pts, end pts) where start is None for the first
+                            and end is None for the last segment, empty if the video
+                            should not be split
+    """
+    video_stream.seek(0)
+    with av.open(video_stream) as container:
+        stream = container.streams.video[0]
+        keyframes = []
+        packets = 0
+        for packet in container.demux(stream):
+            # the flushing packet at the end has no data
+            if packet.size == 0:
+                continue
+            # segments are cut on timestamps, so they need to be known
+            if packet.pts is None:
+                return []
+            packets += 1
+            if packet.is_keyframe:
+                keyframes.append(packet.pts)
+    video_stream.seek(0)
+
+    if packets < PARALLEL_MIN_FRAMES or len(keyframes) < 2:
+        return []
+
+    # spread the keyframes evenly over the segments
+    keyframes.sort()
+    segment_count = min(len(keyframes), processes * SEGMENTS_PER_PROCESS)
+    starts = [keyframes[i * len(keyframes) // segment_count] for i in range(segment_count)]
+    ends = starts[1:] + [None]
+    starts[0] = None
+
+    return list(zip(starts, ends))
+
+
+def decode_segment(path, start_pts, end_pts, with_hashes=False):
+    """
+    Decode the frames of a segment of a video and encode them as JPEGs.
+
+    Runs in a separate process, so the video is passed as path instead of its content.
+
+    :param path:        path to the MP4 file
+    :param start_pts:   timestamp of the keyframe the segment starts at, None to start at the beginning
+    :param end_pts:     timestamp the segment ends before, None to decode until the end
+    :param with_hashes: add the perceptual hash of every frame as "phash" metadata
+    :return:            FrameBatch of JPEG files
+    """
+    video_frames = FrameBatch()
+    with av.open(path) as container:
+        stream = container.streams.video[0]
+        if start_pts is not None:
+            # jump to the keyframe the segment starts at
+            container.seek(start_pts, stream=stream)
+
+        for frame in container.decode(stream):
+            # frames before the keyframe belong to the previous segment
+            if start_pts is not None and frame.pts < start_pts:
+                continue
+            # frames are returned in presentation order, so the segment is done
+            if end_pts is not None and frame.pts >= end_pts:
+                break
+
+            if with_hashes:
+                append_frame(video_frames, frame, phash=perceptual_hash(frame))
+            else:
+                append_frame(video_frames, frame)
+
+    return video_frames
+
+
+def probe_video(input_file):
+    """
+    Read the metadata of a video from its container headers, without decoding any frames.
+
+    :param input_file:  MP4 file as file-like object
+    :return:            dict with the width, height, duration in seconds, codec, frame count
+                        and frame rate of the first video stream, unknown values are None
+    :raises ValueError: if the file is not a readable video
+    """
+    input_file.seek(0)
+    try:
+        with av.open(input_file) as container:
+            if not container.streams.video:
+                raise ValueError("the file has no video stream")
+            stream = container.streams.video[0]
+            if stream.duration is not None:
+                duration = float(stream.duration * stream.time_base)
+            elif container.duration is not None:
+                duration = container.duration / av.time_base
+            else:
+                duration = None
+            metadata = {
+                "width": stream.codec_context.width or None,
+                "height": stream.codec_context.height or None,
+                "duration": duration,
+                "codec": stream.codec_context.name,
+                # the number of frames is only known if the container stores it
+                "frame_count": stream.frames or None,
+                "frame_rate": float(stream.average_rate) if stream.average_rate else None,
+            }
+    except av.error.FFmpegError as error:
+        raise ValueError(f"the file is not a readable video: {error}") from error
+    finally:
+        input_file.seek(0)
+
+    if metadata["width"] is None or metadata["height"] is None:
+        raise ValueError("the video stream has no resolution")
+    return metadata
+
 
 class FileConverter:
     """Utility for doing file conversions."""
 
-    def mp4_to_jpeg(self, input_file):
+    def __init__(self, processes=CONVERTER_PROCESSES):
+        """
+        :param processes:   number of processes decoding segments of a long video in parallel
+        """
+        self.processes = processes
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def get_pool(self):
+        """
+        Get the process pool for decoding video segments, created on first use.
+
+        :return:    the process pool
+        """
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.processes)
+            return self.pool
+
+    def decode_segments(
+        self, video_stream, segments, dedup_distance=None, on_frame=None
+    ):
+        """
+        Decode the segments of a video in parallel and stitch the frames back in order.
+
+        :param video_stream:    MP4 file as BytesIO
+        :param segments:        list of (start pts, end pts) from find_segments
+        :param dedup_distance:  drop frames within this Hamming distance of the previous kept frame
+        :param on_frame:        called with every kept JPEG and its metadata in order, as soon as
+                                its segment is done, or once all are done when near duplicates
+                                are dropped
+        :return:                FrameBatch of JPEG files
+        """
+        with_hashes = dedup_distance is not None
+        # the processes read the video from a temporary file
+        with tempfile.NamedTemporaryFile(suffix=".mp4") as video_file:
+            video_file.write(video_stream.getbuffer())
+            video_file.flush()
+
+            pool = self.get_pool()
+            futures = [
+                pool.submit(
+                    decode_segment, video_file.name, start_pts, end_pts, with_hashes
+                )
+                for start_pts, end_pts in segments
+            ]
+            video_frames = FrameBatch()
+            for future in futures:
+                segment_frames = future.result()
+                video_frames.extend(segment_frames)
+                if on_frame is not None and not with_hashes:
+                    for jpeg, metadata in zip(segment_frames, segment_frames.metadata):
+                        on_frame(jpeg, metadata)
+
+        # near duplicates depend on the previous kept frame, so they are dropped in order
+        if with_hashes:
+            video_frames = drop_near_duplicates(video_frames, dedup_distance)
+            if on_frame is not None:
+                for jpeg, metadata in zip(video_frames, video_frames.metadata):
+                    on_frame(jpeg, metadata)
+        return video_frames
+
+    def decode_serial(
+        self,
+        video_stream,
+        keyframes_only,
+        scene_threshold,
+        dedup_distance,
+        on_frame=None,
+    ):  # pylint: disable=too-many-arguments
+        """
+        Decode a video in a single process.
+
+        :param video_stream:    MP4 file as BytesIO
+        :param on_frame:        called with every kept JPEG and its metadata as soon as it is encoded
+        :return:                FrameBatch of JPEG files
+        """
+        # Open the video stream using PyAV
+        container = av.open(video_stream)
+        stream = container.streams.video[0]
+        if keyframes_only:
+            # let the decoder skip every frame that is not a keyframe
+            stream.codec_context.skip_frame = "NONKEY"
+        video_frames = FrameBatch()
+        previous_thumbnail = None
+        previous_hash = None
+
+        # Process each frame in the video
+        for frame in container.decode(stream):
+            if keyframes_only and scene_threshold is not None:
+                # compare a small grayscale version of the frame to the previous kept one
+                thumbnail = scene_thumbnail(frame)
+                if (
+                    previous_thumbnail is not None
+                    and np.mean(np.abs(thumbnail - previous_thumbnail)) < scene_threshold
+                ):
+                    continue
+                previous_thumbnail = thumbnail
+
+            if dedup_distance is not None:
+                # drop the frame before spending time on encoding it
+                frame_hash = perceptual_hash(frame)
+                if is_near_duplicate(frame_hash, previous_hash, dedup_distance):
+                    video_frames.dropped_frames += 1
+                    continue
+                previous_hash = frame_hash
+
+            append_frame(video_frames, frame)
+            if on_frame is not None:
+                on_frame(video_frames[-1], video_frames.metadata[-1])
+
+        # Return the batch of JPEGs
+        return video_frames
+
+    def mp4_to_jpeg(
+        self,
+        input_file,
+        keyframes_only=False,
+        scene_threshold=None,
+        dedup_distance=None,
+        on_frame=None,
+    ):  # pylint: disable=too-many-arguments
         """
         Convert input MP4 file to list of JPEGs.
 
-        :param input:   input MP4 file as Flask FileStorage object
-        :retrun:        list of JPEG files as byte array
+        :param input:           input MP4 file as Flask FileStorage object
+        :param keyframes_only:  only decode the keyframes of the video
+        :param scene_threshold: only keep keyframes whose mean absolute difference to the
+                                previous kept keyframe is at least this value (0 to 255)
+        :param dedup_distance:  drop frames whose perceptual hash is within this Hamming
+                                distance (0 to 64) of the previous kept frame, None to keep them
+        :param on_frame:        called with every kept JPEG and its metadata in order while the
+                                video is decoded, like the append method of a StagingH5Writer
+        :retrun:                FrameBatch of JPEG files, with the number of dropped
+                                near duplicates as dropped_frames
         """
         # Ensure the file pointer is at the start
         input_file.seek(0)
@@ -25,46 +456,38 @@ class FileConverter:
         # Read the MP4 file content into a BytesIO stream
         video_stream = io.BytesIO(input_file.read())
 
-        # Open the video stream using PyAV
-        container = av.open(video_stream)
-        video_frames = []
+        # Decode long videos in keyframe aligned segments over multiple processes
+        if not keyframes_only and self.processes > 1:
+            segments = find_segments(video_stream, self.processes)
+            if segments:
+                return self.decode_segments(
+                    video_stream, segments, dedup_distance, on_frame
+                )
 
-        # Process each frame in the video
-        for frame in container.decode(video=0):
-            # Convert PyAV frame to PIL Image then to NumPy array for cv2 compatibility
-            img = frame.to_image()  # Converts frame to PIL Image
-            img_array = np.array(img)  # Converts PIL Image to NumPy array
-
-            # Encode the NumPy array as a JPEG
-            # pylint: disable=no-member
-            # This should be ignored because pylint insists that imencode doesn't exist yet it does.
-            is_success, buffer = cv2.imencode(".jpg", img_array)
-            if is_success:
-                # Convert the buffer (numpy array) to bytes
-                frame_bytes = buffer.tobytes()
-                video_frames.append(frame_bytes)
-
-        # Return the list of JPEG byte arrays
-        return video_frames
+        return self.decode_serial(
+            video_stream, keyframes_only, scene_threshold, dedup_distance, on_frame
+        )
 
     def jpeg_to_pickle(self, input_files):
         """
-        Convert a list of jpeg files to a pickle file.
+        Convert a batch of jpeg files to a pickle file.
+        Legacy format, prefer npy or npz for random access to the frames.
 
-        :param input:   list of input JPEGs as byte arrays
+        :param input:   FrameBatch of input JPEGs
         :retrun:        pickle file as BytesIO
         """
         pickle_buffer = io.BytesIO()
-        pickle.dump(input_files, pickle_buffer)
+        # the format is a pickled list of bytes, so the frames are copied out of the batch
+        pickle.dump([bytes(jpeg_data) for jpeg_data in input_files], pickle_buffer)
         pickle_buffer.seek(0)
 
         return pickle_buffer
 
     def jpeg_to_h5(self, input_files):
         """
-        Convert a list of jpeg files to a h5 file.
+        Convert a batch of jpeg files to a h5 file.
 
-        :param input:   list of input JPEGs as byte arrays
+        :param input:   FrameBatch of input JPEGs
         :retrun:        h5 file as BytesIO
         """
         hdf5_buffer = io.BytesIO()
@@ -78,3 +501,119 @@ class FileConverter:
         hdf5_buffer.seek(0)
 
         return hdf5_buffer
+
+    def jpeg_to_npy(self, input_files):
+        """
+        Convert a batch of jpeg files to a npy file of decoded frames.
+
+        The frames are stored as one (frames, height, width, channels) uint8 array,
+        so the file can be opened with np.load(..., mmap_mode="r").
+
+        :param input:   FrameBatch of input JPEGs
+        :retrun:        npy file as BytesIO
+        """
+        npy_buffer = io.BytesIO()
+        # pylint: disable=no-member
+        # This should be ignored because pylint insists that imdecode doesn't exist yet it does.
+        decoded = (
+            cv2.imdecode(np.frombuffer(jpeg_data, dtype="uint8"), cv2.IMREAD_COLOR)
+            for jpeg_data in input_files
+        )
+        first_frame = next(decoded, None)
+        if first_frame is None:
+            np.save(npy_buffer, np.empty((0, 0, 0, 3), dtype="uint8"))
+            npy_buffer.seek(0)
+            return npy_buffer
+
+        # write the header up front so the frames can be appended one by one
+        # instead of stacking the whole video in memory first
+        header = {
+            "descr": np.lib.format.dtype_to_descr(first_frame.dtype),
+            "fortran_order": False,
+            "shape": (len(input_files),) + first_frame.shape,
+        }
+        np.lib.format.write_array_header_1_0(npy_buffer, header)
+        npy_buffer.write(first_frame.data)
+        for frame in decoded:
+            npy_buffer.write(frame.data)
+        npy_buffer.seek(0)
+
+        return npy_buffer
+
+    def jpeg_to_npz(self, input_files):
+        """
+        Convert a batch of jpeg files to a npz file with an offsets index.
+
+        The archive holds "frames", all JPEGs packed into one uint8 array, and
+        "offsets", where frame i is frames[offsets[i]:offsets[i + 1]].
+        The archive is not compressed, so the members can be read without inflating.
+
+        :param input:   FrameBatch of input JPEGs
+        :retrun:        npz file as BytesIO
+        """
+        npz_buffer = io.BytesIO()
+        # the packed buffer and offsets of the batch already have the layout of the archive
+        np.savez(
+            npz_buffer,
+            frames=input_files.as_array(),
+            offsets=input_files.offsets_array(),
+        )
+        npz_buffer.seek(0)
+
+        return npz_buffer
+
+    def jpeg_to_shards(self, input_files, shard_size):
+        """
+        Convert a list of jpeg files to size targeted tar shards.
+
+        Every frame is stored as "frame_<i>.jpg" next to a "frame_<i>.json" with
+        its metadata, so the shards can be read sequentially in WebDataset style.
+        The shards are generated one at a time, so each can be uploaded as soon as it is complete,
+        see ShardWriter for writing them while the video is decoded.
+
+        :param input:       FrameBatch of input JPEGs
+        :param shard_size:  targeted size of a shard in bytes, a shard only
+                            exceeds it if a single frame is larger
+        :return:            generator of (tar file as list of bytes-like objects,
+                            number of frames in the shard)
+        """
+        shard_samples = []
+        current_size = 0
+
+        for i, jpeg_data in enumerate(input_files):
+            metadata = json.dumps({"frame": i, **input_files.metadata[i]}).encode()
+            sample_size = tar_member_size(len(jpeg_data)) + tar_member_size(
+                len(metadata)
+            )
+
+            # finish the shard if the frame would push it over the targeted size
+            if shard_samples and current_size + sample_size > shard_size:
+                yield self.write_shard(shard_samples), len(shard_samples)
+                shard_samples = []
+                current_size = 0
+
+            shard_samples.append((i, jpeg_data, metadata))
+            current_size += sample_size
+
+        if shard_samples:
+            yield self.write_shard(shard_samples), len(shard_samples)
+
+    def write_shard(self, samples):
+        """
+        Write frames and their metadata to a tar shard, without copying the frames.
+
+        :param samples: list of (frame index, JPEG as bytes-like object, metadata as json bytes)
+        :return:        tar file as list of bytes-like objects, to be written in order
+        """
+        chunks = []
+        size = 0
+        for i, jpeg_data, metadata in samples:
+            for name, content in (
+                (f"frame_{i:06d}.jpg", jpeg_data),
+                (f"frame_{i:06d}.json", metadata),
+            ):
+                chunks.extend(tar_member(name, content))
+                size += tar_member_size(len(content))
+        chunks.append(tar_end(size))
+
+        return chunks
@@ -0,0 +1,111 @@
+"""Defines a compact container for the encoded frames of a video."""
+
+from array import array
+
+import numpy as np
+
+
+class FrameBatch:
+    """
+    Encoded frames packed into one contiguous buffer.
+
+    Frame i is stored in buffer[offsets[i]:offsets[i + 1]], and its metadata, like the
+    timestamp, in metadata[i]. Frames are handed out as memoryviews into the buffer, so
+    writers can pass them to h5py, NumPy or HTTP bodies without copying them.
+    Frames can not be appended while memoryviews of the batch are still in use.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # 64 bit offsets of the frames in the buffer, with the end of the buffer as last offset
+        self.offsets = array("q", [0])
+        self.metadata = []
+        # number of decoded frames that were left out of the batch, like near duplicates
+        self.dropped_frames = 0
+
+    def append(self, data, **metadata):
+        """
+        Append an encoded frame to the batch.
+
+        :param data:        the encoded frame as bytes-like object
+        :param metadata:    metadata of the frame, like its timestamp
+        """
+        self.buffer += data
+        self.offsets.append(len(self.buffer))
+        self.metadata.append(metadata)
+
+    def extend(self, other):
+        """
+        Append all frames of another batch to the batch.
+
+        :param other:   the batch to append
+        """
+        start = len(self.buffer)
+        self.buffer += other.buffer
+        self.offsets.extend(start + offset for offset in other.offsets[1:])
+        self.metadata.extend(other.metadata)
+        self.dropped_frames += other.dropped_frames
+
+    def select(self, indices):
+        """
+        Create a new batch with a subset of the frames, the others are counted as dropped.
+
+        :param indices: increasing indices of the frames to keep
+        :return:        the new FrameBatch
+        """
+        selected = FrameBatch()
+        for i in indices:
+            selected.append(self[i], **self.metadata[i])
+        selected.dropped_frames = self.dropped_frames + len(self) - len(selected)
+        return selected
+
+    def __len__(self):
+        """Number of frames in the batch."""
+        return len(self.metadata)
+
+    def __getitem__(self, i):
+        """
+        Get a frame of the batch without copying it.
+
+        :param i:   index of the frame
+        :return:    memoryview of the encoded frame
+        """
+        if not -len(self) <= i < len(self):
+            raise IndexError("frame index out of range")
+        i %= len(self)
+        return memoryview(self.buffer)[self.offsets[i] : self.offsets[i + 1]]
+
+    def __iter__(self):
+        """Iterate over memoryviews of the frames."""
+        view = memoryview(self.buffer)
+        for start, end in zip(self.offsets, self.offsets[1:]):
+            yield view[start:end]
+
+    @property
+    def nbytes(self):
+        """Size of all encoded frames in bytes."""
+        return len(self.buffer)
+
+    def as_array(self):
+        """
+        Get all encoded frames as one uint8 array, without copying them.
+
+        :return:    NumPy array backed by the buffer
+        """
+        return np.frombuffer(self.buffer, dtype="uint8")
+
+    def offsets_array(self):
+        """
+        Get the offsets of the frames, frame i is as_array()[offsets[i]:offsets[i + 1]].
+
+        :return:    int64 NumPy array backed by the offsets
+        """
+        return np.frombuffer(self.offsets, dtype="int64")
+
+    def lengths_array(self):
+        """
+        Get the length of every frame in bytes.
+
+        :return:    int64 NumPy array
+        """
+        return np.diff(self.offsets_array())
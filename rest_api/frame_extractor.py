@@ -0,0 +1,199 @@
+"""
+Defines random access to single frames of stored videos.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import av
+
+from .file_converter import append_frame
+from .frame_batch import FrameBatch
+
+# number of decoded groups of pictures that are kept in memory, over all videos
+FRAME_CACHE_GOPS = int(os.environ.get("FRAME_CACHE_GOPS", 64))
+
+# largest relative difference of the average frame rate of a video from the rate of its
+# timestamps, for which the frame rate counts as constant
+CONSTANT_RATE_TOLERANCE = 0.01
+
+
+def get_timing(stream):
+    """
+    Get the timing needed to find a frame by its index in a video stream.
+
+    :param stream:  PyAV video stream
+    :return:        (timestamp of the first frame, duration of a frame in timestamp units)
+    """
+    rate = stream.average_rate or stream.guessed_rate
+    start_pts = stream.start_time or 0
+    return start_pts, float(1 / (rate * stream.time_base))
+
+
+def has_constant_rate(stream):
+    """
+    Whether a video stream has a constant frame rate, so the timestamp of a frame follows from
+    its index. With a variable frame rate the average rate differs from the rate the timestamps
+    are based on.
+
+    :param stream:  PyAV video stream
+    """
+    if not stream.average_rate or not stream.base_rate:
+        # nothing to compare, the timestamps are all there is
+        return True
+    difference = abs(stream.average_rate - stream.base_rate) / stream.base_rate
+    return difference <= CONSTANT_RATE_TOLERANCE
+
+
+def get_video_info(stream):
+    """
+    Get what is needed to find frames by their index in a video stream.
+
+    :param stream:  PyAV video stream
+    :return:        (timestamp of the first frame, duration of a frame in timestamp units,
+                    number of frames or None if it is not known, whether the rate is constant)
+    """
+    return (*get_timing(stream), stream.frames or None, has_constant_rate(stream))
+
+
+class FrameExtractor:
+    """
+    Extracts frames from videos as JPEGs without decoding the whole video.
+
+    A frame is found by seeking to the keyframe before it and decoding the group of pictures
+    (GOP) that contains it. Decoded GOPs are kept in a LRU cache, so nearby frames, like when
+    scrubbing through a video, are served without opening the video again.
+    Frames are found by their timestamp, which is only exact for videos with a constant frame
+    rate, so exact frames of videos with a variable frame rate are refused.
+    """
+
+    def __init__(self, max_gops=FRAME_CACHE_GOPS):
+        self.max_gops = max_gops
+        # (video key, start pts) mapped to (end pts or None for the last GOP, FrameBatch),
+        # the least recently used first
+        self.gops = OrderedDict()
+        # video key mapped to the info of the video from get_video_info
+        self.videos = OrderedDict()
+        self.cache_lock = threading.Lock()
+
+    def find_cached(self, video_key, pts):
+        """
+        Find the cached GOP containing a timestamp.
+
+        :return:    (end pts, FrameBatch) of the GOP, None if it is not cached
+        """
+        with self.cache_lock:
+            for (key, start_pts), (end_pts, frames) in self.gops.items():
+                if key == video_key and start_pts <= pts and (end_pts is None or pts < end_pts):
+                    break
+            else:
+                return None
+            self.gops.move_to_end((key, start_pts))
+            return end_pts, frames
+
+    def add_cached(self, video_key, start_pts, end_pts, frames):
+        """Cache a decoded GOP and evict the least recently used GOPs."""
+        with self.cache_lock:
+            self.gops[(video_key, start_pts)] = (end_pts, frames)
+            self.gops.move_to_end((video_key, start_pts))
+            while len(self.gops) > self.max_gops:
+                self.gops.popitem(last=False)
+
+    def decode_gops(self, video_key, container, stream, pts):
+        """
+        Decode the GOPs from the keyframe before a timestamp until the GOP containing it,
+        caching every decoded GOP.
+
+        :return:    (end pts, FrameBatch) of the GOP containing the timestamp,
+                    the FrameBatch is empty if nothing was decoded after the seek
+        """
+        container.seek(int(pts), stream=stream, backward=True, any_frame=False)
+        frames = FrameBatch()
+        start_pts = None
+        for frame in container.decode(stream):
+            if frame.pts is None:
+                continue
+            if frame.key_frame and frames:
+                self.add_cached(video_key, start_pts, frame.pts, frames)
+                if pts < frame.pts:
+                    return frame.pts, frames
+                frames = FrameBatch()
+            if not frames:
+                start_pts = frame.pts
+            append_frame(frames, frame)
+
+        # the last GOP of the video, nothing is cached if no frame was decoded,
+        # like after seeking past the end
+        if frames:
+            self.add_cached(video_key, start_pts, None, frames)
+        return None, frames
+
+    def get_frames(self, video_key, open_video, indices, exact=True):
+        """
+        Get frames of a video as JPEGs.
+
+        :param video_key:   identifies the video in the cache, it should change when the video does
+        :param open_video:  function that opens the video as seekable file-like object,
+                            only called if a frame is not cached
+        :param indices:     indices of the frames
+        :param exact:       whether the frames have to be the frames at the indices, otherwise
+                            a video with a variable frame rate gives the frames at the timestamps
+                            the indices would have with its average frame rate
+        :return:            list of JPEG files as bytes, in the order of the indices
+        :raises IndexError: if a frame is beyond the end of the video
+        :raises ValueError: if exact frames are requested from a video with a variable frame rate
+        """
+        container = None
+        try:
+            with self.cache_lock:
+                video = self.videos.get(video_key)
+            jpegs = []
+            for index in indices:
+                if video is None:
+                    container = av.open(open_video())
+                    video = get_video_info(container.streams.video[0])
+                    with self.cache_lock:
+                        self.videos[video_key] = video
+                        while len(self.videos) > self.max_gops:
+                            self.videos.popitem(last=False)
+
+                start_pts, frame_duration, frame_count, constant_rate = video
+                if exact and not constant_rate:
+                    raise ValueError("the video has a variable frame rate")
+                if index < 0 or (frame_count is not None and index >= frame_count):
+                    raise IndexError(f"frame {index} is not in the video")
+                # the middle of the frame, so rounding of timestamps does not matter
+                pts = start_pts + (index + 0.5) * frame_duration
+
+                gop = self.find_cached(video_key, pts)
+                if gop is None:
+                    if container is None:
+                        container = av.open(open_video())
+                    gop = self.decode_gops(
+                        video_key, container, container.streams.video[0], pts
+                    )
+                jpegs.append(self.select_frame(gop, pts, frame_duration))
+            return jpegs
+        finally:
+            if container is not None:
+                container.close()
+
+    def select_frame(self, gop, pts, frame_duration):
+        """
+        Select the frame shown at a timestamp from a GOP.
+
+        :return:    the JPEG file as bytes
+        :raises IndexError: if the timestamp is after the end of the video
+        """
+        end_pts, frames = gop
+        if not frames or (
+            end_pts is None and pts > frames.metadata[-1]["pts"] + frame_duration
+        ):
+            raise IndexError("the frame is not in the video")
+        # the last frame starting before the timestamp
+        selected = 0
+        for i, metadata in enumerate(frames.metadata):
+            if metadata["pts"] <= pts:
+                selected = i
+        return bytes(frames[selected])
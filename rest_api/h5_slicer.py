@@ -0,0 +1,193 @@
+"""
+Defines reading slices of datasets of h5 files, without reading the rest of the file.
+"""
+
+import h5py
+import numpy as np
+
+# size of the blocks an h5 file is fetched in, small so reads stay close to the chunks touched
+H5_BLOCK_SIZE = 256 * 1024
+# the largest number of JPEG frames in one slice
+MAX_SLICE_FRAMES = 1024
+# the largest size of a slice of a numeric dataset in bytes, 256 MB
+MAX_SLICE_BYTES = 256 * 1024**2
+
+
+def parse_selection(text):
+    """
+    Parse a NumPy style selection, like "10:20", "5" or "0:100:10,0:3".
+
+    :param text:        comma separated indices or start:stop:step slices, one per axis
+    :return:            tuple of integers and slices
+    :raises ValueError: if the text is not a valid selection
+    """
+    if not text:
+        return (slice(None),)
+    selection = []
+    for part in text.split(","):
+        part = part.strip()
+        if ":" not in part:
+            selection.append(int(part))
+            continue
+        bounds = part.split(":")
+        if len(bounds) > 3:
+            raise ValueError(f"invalid slice: {part}")
+        start, stop, step = [int(b) if b.strip() else None for b in bounds] + [None] * (
+            3 - len(bounds)
+        )
+        if step is not None and step < 1:
+            raise ValueError("the step of a slice must be positive")
+        selection.append(slice(start, stop, step))
+    return tuple(selection)
+
+
+def is_jpeg_dataset(dataset):
+    """
+    Check whether a dataset holds encoded frames, like the dataset of the h5 conversion.
+
+    :param dataset: h5py dataset
+    :return:        whether the elements are variable length byte arrays
+    """
+    return h5py.check_vlen_dtype(dataset.dtype) == np.dtype("uint8")
+
+
+def selection_shape(dataset, selection):
+    """
+    Get the shape of a selection of a dataset without reading it.
+
+    :raises IndexError: if the selection does not fit the dataset
+    """
+    # a read-only view with zero strides has the shape of the dataset without allocating it
+    return np.broadcast_to(np.empty((), dtype=bool), dataset.shape)[selection].shape
+
+
+def to_output(dataset, data):
+    """
+    Get the output of read_slice from the data read from a dataset.
+    """
+    if is_jpeg_dataset(dataset):
+        # a single element is read as the array of its bytes
+        frames = [data] if data.dtype != object else list(data.reshape(-1))
+        return [frame.tobytes() for frame in frames], None
+    return None, data
+
+
+def source_slice(source, indices):
+    """
+    Get the slice of a source of a virtual dataset holding the selected indices.
+
+    :param source:  VDSmap of the source, mapping it to a range of the first axis
+    :param indices: range of selected indices of the first axis of the virtual dataset
+    :return:        the slice of the first axis of the source, None if no index is in it
+    """
+    # the first and last index of the virtual dataset mapped to the source
+    bounds = source.vspace.get_select_bounds()
+    start, end = bounds[0][0], bounds[1][0]
+    selected = [i - start for i in indices if start <= i <= end]
+    if not selected:
+        return None
+    # the selected indices within the source have the step of the selection
+    return slice(selected[0], selected[-1] + 1, indices.step)
+
+
+def read_virtual(dataset, selection, open_source):
+    """
+    Read a selection of a virtual dataset that concatenates datasets along their first axis,
+    like the ones of build_virtual_dataset, by reading the selected parts of its sources.
+
+    :param dataset:     the virtual h5py dataset
+    :param selection:   tuple of integers and slices, from parse_selection
+    :param open_source: function that opens a source by its file name as file-like object
+    :return:            the same as read_slice
+    """
+    first, rest = selection[0], selection[1:]
+    indices = range(dataset.shape[0])[first]
+    if isinstance(indices, int):
+        indices = range(indices, indices + 1)
+
+    frames, arrays = [], []
+    for source in dataset.virtual_sources():
+        first_axis = source_slice(source, indices)
+        if first_axis is None:
+            continue
+        source_frames, source_data = read_slice(
+            open_source(source.file_name), source.dset_name, (first_axis,) + rest
+        )
+        if source_frames is not None:
+            frames.extend(source_frames)
+        else:
+            arrays.append(source_data)
+
+    if is_jpeg_dataset(dataset):
+        return frames, None
+    shape = selection_shape(dataset, (slice(0, 0),) + rest)
+    data = np.concatenate(arrays) if arrays else np.empty(shape, dtype=dataset.dtype)
+    # an integer selects a single element of the first axis
+    return None, data[0] if isinstance(first, int) else data
+
+
+def is_packed_group(group):
+    """
+    Check whether a group holds packed frames, like the ones of StagingH5Writer.
+    """
+    return isinstance(group, h5py.Group) and "data" in group and "offsets" in group
+
+
+def read_packed(group, selection):
+    """
+    Read a selection of packed frames, only reading the bytes of the selected frames.
+
+    :param group:       h5py group with the "data" and "offsets" datasets
+    :param selection:   tuple of one integer or slice
+    :return:            the same as read_slice
+    :raises IndexError: if the selection does not fit the frames
+    """
+    if len(selection) != 1:
+        raise IndexError("packed frames only have one axis")
+    # the offsets are read first, so they only refer to bytes that were flushed before them
+    offsets = group["offsets"][()]
+    indices = range(len(offsets) - 1)[selection[0]]
+    if isinstance(indices, int):
+        indices = range(indices, indices + 1)
+    if len(indices) > MAX_SLICE_FRAMES:
+        raise ValueError(f"at most {MAX_SLICE_FRAMES} frames can be read at once")
+    data = group["data"]
+    return [data[offsets[i] : offsets[i + 1]].tobytes() for i in indices], None
+
+
+def read_slice(h5_file, dataset_name, selection, open_source=None, swmr=False):
+    """
+    Read a slice of a dataset of an h5 file.
+
+    Only the parts of the file holding the metadata and the selected elements are read, so with a
+    file-like object that fetches blocks on demand only the touched chunks are fetched.
+
+    :param h5_file:         the h5 file as path or seekable file-like object
+    :param dataset_name:    path of the dataset in the file
+    :param selection:       tuple of integers and slices, from parse_selection
+    :param open_source:     function that opens a source of a virtual dataset by its file name,
+                            if None the sources are opened by HDF5 from the local file system
+    :param swmr:            open the file as reader of a file that is being written in SWMR mode
+    :return:                (list of JPEG frames, None) for datasets of encoded frames,
+                            (None, NumPy array) for other datasets
+    :raises KeyError:       if the dataset does not exist
+    :raises ValueError:     if the selection is too large
+    :raises IndexError:     if the selection does not fit the dataset
+    """
+    with h5py.File(h5_file, "r", swmr=swmr) as h5:
+        dataset = h5.get(dataset_name)
+        if is_packed_group(dataset):
+            return read_packed(dataset, selection)
+        if not isinstance(dataset, h5py.Dataset):
+            raise KeyError(dataset_name)
+
+        shape = selection_shape(dataset, selection)
+        if is_jpeg_dataset(dataset):
+            if int(np.prod(shape)) > MAX_SLICE_FRAMES:
+                raise ValueError(f"at most {MAX_SLICE_FRAMES} frames can be read at once")
+        elif int(np.prod(shape)) * dataset.dtype.itemsize > MAX_SLICE_BYTES:
+            raise ValueError(f"at most {MAX_SLICE_BYTES} bytes can be read at once")
+
+        if dataset.is_virtual and open_source is not None:
+            return read_virtual(dataset, selection, open_source)
+        return to_output(dataset, dataset[selection])
@@ -0,0 +1,156 @@
+"""
+Defines writing h5 conversions to a local staging file that can be read while it is written.
+"""
+
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+import h5py
+import numpy as np
+
+# number of frames written to the staging file at once, readers see frames in steps of this
+H5_FLUSH_FRAMES = int(os.environ.get("H5_FLUSH_FRAMES", 32))
+# folder the staging files are written to
+H5_STAGING_DIR = os.environ.get("H5_STAGING_DIR", tempfile.gettempdir())
+# size of the chunks of the frame bytes in the staging file, 1 MB
+DATA_CHUNK_BYTES = 1024**2
+
+
+
+class StagingRegistry:
+    """
+    The staging files of the h5 conversions running in this process, by the index of their output.
+
+    A staging file is only removed once the reads of it are done, so a slice that is read while
+    its conversion finishes is read to the end. The registry and the staging files are local to
+    the process converting the video, other processes or replicas of the API do not know them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # index of an h5 output mapped to (id of the uploading user, staging path)
+        self.files = {}
+        # staging path mapped to the number of reads of it
+        self.readers = {}
+        # staging paths of finished conversions that are removed once they are not read anymore
+        self.removed = set()
+
+    def add(self, index, user_id, path):
+        """Register the staging file of the h5 output at an index, converted for a user."""
+        with self.lock:
+            self.files[index] = (user_id, path)
+
+    def remove(self, index):
+        """Unregister the staging file of an index and remove it once it is not read anymore."""
+        with self.lock:
+            _, path = self.files.pop(index)
+            if self.readers.get(path):
+                # the last reader removes it
+                self.removed.add(path)
+                return
+        os.remove(path)
+
+    @contextmanager
+    def read(self, index, user_id):
+        """
+        Keep the staging file of an index while it is read.
+
+        :param index:   index of the h5 output
+        :param user_id: id of the reading user, only the uploading user can read the file
+        :return:        context with the path of the staging file, None if the user is not
+                        converting the output
+        """
+        with self.lock:
+            staged = self.files.get(index)
+            if staged is None or staged[0] != user_id:
+                path = None
+            else:
+                path = staged[1]
+                self.readers[path] = self.readers.get(path, 0) + 1
+        if path is None:
+            yield None
+            return
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def release(self, path):
+        """End a read of a staging file, removing it if its conversion finished."""
+        with self.lock:
+            self.readers[path] -= 1
+            if self.readers[path]:
+                return
+            del self.readers[path]
+            if path not in self.removed:
+                return
+            self.removed.discard(path)
+        os.remove(path)
+
+
+# the staging files of the h5 conversions of this process
+staging_files = StagingRegistry()
+
+
+class StagingH5Writer:
+    """
+    Writes JPEG frames to an h5 file in single-writer/multiple-reader (SWMR) mode,
+    so readers opening it with swmr=True see the frames flushed so far.
+
+    Variable length data is not safe to read during SWMR writes, so the frames are stored
+    packed in a "jpeg_images" group: the bytes of all frames in the "data" dataset,
+    and where every frame starts and the last one ends in the "offsets" dataset.
+    The frame bytes are always flushed before the offsets that refer to them.
+    """
+
+    def __init__(self, path, flush_frames=H5_FLUSH_FRAMES):
+        self.flush_frames = flush_frames
+        self.h5 = h5py.File(path, "w", libver="latest")
+        group = self.h5.create_group("jpeg_images")
+        self.data = group.create_dataset(
+            "data", (0,), maxshape=(None,), dtype="uint8", chunks=(DATA_CHUNK_BYTES,)
+        )
+        self.offsets = group.create_dataset(
+            "offsets", (1,), maxshape=(None,), dtype="int64", chunks=(flush_frames,)
+        )
+        # objects can not be created anymore once SWMR mode is on
+        self.h5.swmr_mode = True
+        self.pending = []
+
+    def append(self, jpeg, metadata=None):  # pylint: disable=unused-argument
+        """
+        Add a frame, writing the pending frames once there are enough of them.
+        The metadata of the frame, like its timestamp, is not stored.
+        """
+        self.pending.append(bytes(jpeg))
+        if len(self.pending) >= self.flush_frames:
+            self.flush()
+
+    def flush(self):
+        """Write the pending frames and make them visible to readers."""
+        if not self.pending:
+            return
+        start = self.data.shape[0]
+        ends = start + np.cumsum([len(jpeg) for jpeg in self.pending])
+        self.data.resize((ends[-1],))
+        self.data[start:] = np.frombuffer(b"".join(self.pending), dtype="uint8")
+        self.data.flush()
+
+        count = self.offsets.shape[0]
+        self.offsets.resize((count + len(ends),))
+        self.offsets[count:] = ends
+        self.offsets.flush()
+        self.pending = []
+
+    def close(self):
+        """Write the pending frames and close the file."""
+        self.flush()
+        self.h5.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
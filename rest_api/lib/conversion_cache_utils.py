@@ -0,0 +1,135 @@
+"""
+Helper functions for reusing the results of earlier conversions of the same input file.
+"""
+
+import hashlib
+import json
+
+from ..models import db
+from ..models.conversion_cache import ConversionCache
+from ..routes.files.interactor import interactor
+from .metrics import increment
+
+# size of the chunks the input is hashed in, 1 MB
+HASH_CHUNK_SIZE = 1024**2
+
+# the conversion options that change the output of every format
+COMMON_OPTIONS = ["frames", "scene_threshold", "dedup_distance"]
+
+# the conversion options that change the output, per format
+FORMAT_OPTIONS = {
+    "jpeg": ["jpeg_layout"],
+    "shards": ["shard_size"],
+}
+
+
+def hash_input(input_file):
+    """
+    Helper function to get the sha256 hex digest of a file, reading it in chunks.
+    """
+    input_file.seek(0)
+    digest = hashlib.sha256()
+    while chunk := input_file.read(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    input_file.seek(0)
+
+    return digest.hexdigest()
+
+
+def write_hashed(chunks, output_file):
+    """
+    Helper function to write chunks to a file while they are hashed,
+    so the input does not have to be read again to look up its conversions.
+    Returns the sha256 hex digest of the written data.
+    """
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+        output_file.write(chunk)
+
+    return digest.hexdigest()
+
+
+def get_cache_options(file_format, options):
+    """
+    Helper function to get the options that influence the output of a format as a json string.
+    """
+    relevant_options = {
+        name: options[name]
+        for name in COMMON_OPTIONS + FORMAT_OPTIONS.get(file_format, [])
+    }
+    return json.dumps(relevant_options, sort_keys=True)
+
+
+def copy_cached_conversion(input_hash, file_format, options, target_path):
+    """
+    Helper function to copy the output of an earlier conversion to the target path in dCache.
+    Returns the cache entry if a cached output was found and copied, None otherwise.
+    """
+    cached = ConversionCache.query.filter_by(
+        input_hash=input_hash,
+        format=file_format,
+        options=get_cache_options(file_format, options),
+    ).first()
+
+    if cached is None:
+        increment("conversion_cache_misses")
+        return None
+
+    # the output is already in place
+    if cached.path == target_path:
+        increment("conversion_cache_hits")
+        return cached
+
+    # the entries of the output at the target path are dropped, as it is overwritten
+    forget_cached_conversions(target_path)
+    db.session.commit()
+    # copy the earlier output on the server side
+    response = interactor.copy_or_move(cached.path, target_path, command="COPY")
+    if not response.ok:
+        # the cached output does not exist anymore
+        db.session.delete(cached)
+        db.session.commit()
+        increment("conversion_cache_misses")
+        return None
+
+    increment("conversion_cache_hits")
+    return cached
+
+
+def store_cached_conversion(
+    input_hash, file_format, options, output_path, dropped_frames=0
+):
+    """
+    Helper function to remember where the output of a conversion is stored in dCache,
+    with the number of near duplicate frames the conversion dropped.
+    The entries of other conversions that were stored at the same path are dropped,
+    as their output was overwritten.
+    """
+    cache_options = get_cache_options(file_format, options)
+    ConversionCache.query.filter(
+        ConversionCache.path == output_path,
+        (ConversionCache.input_hash != input_hash)
+        | (ConversionCache.format != file_format)
+        | (ConversionCache.options != cache_options),
+    ).delete()
+    cached = ConversionCache.query.filter_by(
+        input_hash=input_hash, format=file_format, options=cache_options
+    ).first()
+
+    if cached is None:
+        cached = ConversionCache(
+            input_hash=input_hash, format=file_format, options=cache_options
+        )
+        db.session.add(cached)
+    cached.path = output_path
+    cached.dropped_frames = dropped_frames
+    db.session.commit()
+
+
+def forget_cached_conversions(*paths):
+    """
+    Helper function to remove the cache entries pointing to paths that are deleted from dCache
+    or overwritten, the caller commits the session.
+    """
+    ConversionCache.query.filter(ConversionCache.path.in_(paths)).delete()
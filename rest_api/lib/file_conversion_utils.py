@@ -0,0 +1,167 @@
+"""
+Helper functions for converting mp4 files that are already stored in dCache.
+"""
+
+import tempfile
+from contextlib import closing
+
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from ..dcache_file import DCacheFile
+from ..file_converter import probe_video
+from ..models import db
+from ..models.file import File
+from ..routes.files.interactor import interactor
+from ..routes.files.file_upload_endpoint import (
+    FileClass,
+    SpooledFile,
+    UploadJob,
+    get_conversion_options,
+    get_output_path,
+    handle_conversions,
+)
+from .conversion_cache_utils import write_hashed
+
+# size of the chunks a source file is streamed from dCache in, 1 MB
+DOWNLOAD_CHUNK_SIZE = 1024**2
+
+# size up to which a source file is kept in memory instead of a temporary file, 100 MB
+SPOOL_MAX_SIZE = 100 * 1024**2
+
+
+def is_convertible(source):
+    """
+    Helper function to check whether a stored file is an mp4 file that can be converted.
+    """
+    return source.type == "file" and source.index.endswith(".mp4")
+
+
+def get_source_file_class(source):
+    """
+    Helper function to get the paths of a stored file in the form the upload uses them.
+    """
+    path = source.index[1:]
+    return FileClass(file_data=FileStorage(filename=path.rsplit("/", 1)[-1]), path=path)
+
+
+def get_output_index(source_file, file_format):
+    """
+    Helper function to get the index of the output of a conversion in the database.
+    """
+    return f"/{get_output_path(source_file, file_format)}"
+
+
+def download_source(path):
+    """
+    Helper function to stream a file from dCache into a temporary file,
+    that is kept in memory while it is small.
+    The file is hashed while it is downloaded, to look up its earlier conversions.
+    Raises FileNotFoundError if dCache does not return the file.
+    """
+    with interactor.get_file(path) as response:
+        if not response.ok:
+            raise FileNotFoundError(path)
+        # the caller closes the file once it is converted
+        spooled = tempfile.SpooledTemporaryFile(  # pylint: disable=consider-using-with
+            max_size=SPOOL_MAX_SIZE
+        )
+        digest = write_hashed(
+            response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE), spooled
+        )
+    spooled.seek(0)
+    return SpooledFile(spooled, path.rsplit("/", 1)[-1], path, digest)
+
+
+def get_output_rows(entries, media):
+    """
+    Helper function to get the database rows of the outputs of a stored file that do not exist yet.
+    The outputs that already have a row get the metadata of the video they were converted from.
+    """
+    indices = [index for index, _ in entries]
+    existing = File.query.filter(File.index.in_(indices))
+    existing.update(media)
+    existing_indices = {row.index for row in existing}
+    return [
+        {"index": index, "type": file_type, **media}
+        for index, file_type in entries
+        if index not in existing_indices
+    ]
+
+
+class ConversionJob(UploadJob):
+    """
+    The conversion of an mp4 file stored in dCache, run in the background like an upload.
+    The source is downloaded once the job runs, and its outputs are stored next to it,
+    at the paths an upload would store them at, with the tags of the source.
+    """
+
+    def __init__(self, source, form, user):
+        """
+        Raises FileNotFoundError if the source does not exist in dCache.
+        """
+        path = source.index[1:]
+        # read with ranged reads until the job runs, to probe the video for its metadata
+        stream = DCacheFile(interactor, path)
+        super().__init__(
+            [(path, FileStorage(stream=stream, filename=path.rsplit("/", 1)[-1], name=path))],
+            form,
+            user,
+        )
+        # the outputs get the tags of the source instead of the tags of the request
+        self.tag_ids = [t.id for t in source.tags]
+
+    def process(self):
+        """
+        Download and hash the source once, then convert and register it like an upload.
+        """
+        for i, (path, file_data) in enumerate(self.files):
+            file_data.close()
+            self.files[i] = (path, download_source(path))
+        super().process()
+
+    def get_rows(self, uploaded_file: FileClass, entries: list):
+        """Get the database rows of the outputs that do not exist yet, see get_output_rows."""
+        return get_output_rows(entries, self.media[uploaded_file.path])
+
+
+def convert_stored_file(source, formats, options):
+    """
+    Helper function to convert an mp4 file stored in dCache to formats while the caller waits.
+    An earlier output is only reused through the conversion cache, if it was converted from the
+    same video with the same options, see ConversionJob for the stored outputs.
+    Returns the file of the output of every format.
+    Raises ValueError if the source is not a readable video.
+    """
+    source_file = get_source_file_class(source)
+
+    with closing(download_source(source_file.path)) as file_data:
+        media = probe_video(file_data)
+        entries, _ = handle_conversions(
+            uploaded_file=source_file,
+            formats=formats,
+            file_data=file_data,
+            options=options,
+        )
+    for row in get_output_rows(entries, media):
+        db.session.add(File(tags=list(source.tags), **row))
+    db.session.commit()
+
+    return [
+        File.query.filter_by(index=get_output_index(source_file, file_format)).first()
+        for file_format in formats
+    ]
+
+
+def resolve_input_format(input_index, input_format):
+    """
+    Helper function to get the index of the input a task is staged with, in the requested format.
+    Mp4 files are converted with the default options, reusing an earlier conversion with them,
+    other inputs are staged as they are.
+    """
+    source = File.query.filter_by(index=input_index).first()
+    if source is None or not is_convertible(source):
+        return input_index
+
+    options = get_conversion_options(MultiDict())
+    output = convert_stored_file(source, [input_format], options)[0]
+    return output.index
@@ -0,0 +1,69 @@
+"""
+Helper functions for the layouts of the directories of the jpeg conversion.
+"""
+
+import json
+
+from ..routes.files.interactor import interactor
+
+# name of the file listing the frames of a sharded jpeg conversion, relative to its directory
+MANIFEST_NAME = "manifest.json"
+
+# number of frames in every subdirectory of a sharded jpeg conversion
+FRAMES_PER_DIR = 1000
+
+
+def get_sharded_frame_path(index):
+    """
+    Helper function to get the path of a frame in a sharded jpeg conversion,
+    relative to its directory, like frames/000/frame_000123.jpeg.
+    Zero padded names keep the frames sorted by name.
+    """
+    return f"frames/{index // FRAMES_PER_DIR:03d}/frame_{index:06d}.jpeg"
+
+
+def create_manifest(frame_count):
+    """
+    Helper function to create the manifest of a sharded jpeg conversion as json bytes.
+    """
+    manifest = {
+        "layout": "sharded",
+        "frame_count": frame_count,
+        "files": [get_sharded_frame_path(i) for i in range(frame_count)],
+    }
+    return json.dumps(manifest).encode()
+
+
+def read_manifest(directory):
+    """
+    Helper function to get the paths of the files listed in the manifest of a directory,
+    in the form PROPFIND returns them, with the manifest itself last.
+    Returns None if the directory has no manifest of a sharded jpeg conversion, like when a
+    dataset folder ships a manifest.json of its own.
+    """
+    directory = directory.strip("/")
+    with interactor.get_file(f"{directory}/{MANIFEST_NAME}") as response:
+        if not response.ok:
+            return None
+        try:
+            manifest = json.loads(response.content)
+        except ValueError:
+            return None
+    if not isinstance(manifest, dict) or manifest.get("layout") != "sharded":
+        return None
+    files = manifest.get("files")
+    if not isinstance(files, list) or not all(isinstance(path, str) for path in files):
+        return None
+    return [f"/{directory}/{path}" for path in files + [MANIFEST_NAME]]
+
+
+def list_files(directory):
+    """
+    Helper function to get the paths of all files in a directory in dCache.
+    Directories with a manifest are listed from it, without walking their subdirectories,
+    other directories are walked recursively.
+    """
+    paths = read_manifest(directory)
+    if paths is None:
+        paths = interactor.get_dir_content_recursive(directory)
+    return paths
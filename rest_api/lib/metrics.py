@@ -0,0 +1,35 @@
+"""
+This class contains helper functions to keep track of metrics of the application.
+"""
+
+import threading
+from collections import Counter
+
+# the counters of the metrics, shared between the request threads
+counters = Counter()
+counters_lock = threading.Lock()
+
+
+def increment(name, amount=1):
+    """
+    Helper function to increment a counter.
+    """
+    with counters_lock:
+        counters[name] += amount
+
+
+def get_metrics():
+    """
+    Helper function to get all counters and the metrics derived from them.
+    """
+    with counters_lock:
+        metrics = dict(counters)
+
+    # the share of conversions that were served from the conversion cache
+    cache_lookups = metrics.get("conversion_cache_hits", 0) + metrics.get(
+        "conversion_cache_misses", 0
+    )
+    metrics["conversion_cache_hit_rate"] = (
+        metrics.get("conversion_cache_hits", 0) / cache_lookups if cache_lookups else 0.0
+    )
+    return metrics
@@ -0,0 +1,215 @@
+"""
+Helper functions to stage the chunks of resumable uploads in a local spool until they are committed.
+
+Every upload is a data file the chunks are appended to and a json file with its path, size, user
+and the number of confirmed bytes, which is only updated once a chunk is verified and stored.
+An interrupted upload resumes at the confirmed bytes, anything after them is dropped.
+To resume an upload on any replica of the API, the folder has to be shared between them.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+
+# folder the uploads are staged in until they are committed
+RESUMABLE_UPLOAD_DIR = os.environ.get(
+    "RESUMABLE_UPLOAD_DIR",
+    os.path.join(os.environ.get("UPLOAD_SPOOL_DIR", tempfile.gettempdir()), "resumable"),
+)
+# whether the folder is configured, the default is a local folder of every replica
+UPLOAD_DIR_CONFIGURED = "RESUMABLE_UPLOAD_DIR" in os.environ
+# number of replicas of the API, more of them need a folder that is shared between them
+API_REPLICAS = int(os.environ.get("API_REPLICAS", 1))
+# largest chunk that is accepted at once, 64 MB
+RESUMABLE_CHUNK_BYTES = int(os.environ.get("RESUMABLE_CHUNK_BYTES", 64 * 1024**2))
+# seconds after which an upload that did not get a chunk is dropped
+RESUMABLE_UPLOAD_TTL = float(os.environ.get("RESUMABLE_UPLOAD_TTL", 24 * 3600))
+
+# size of the blocks a chunk is read from the request in, 1 MB
+COPY_BLOCK_SIZE = 1024**2
+
+
+class ChunkError(ValueError):
+    """A chunk that can not be appended, with the offset the upload continues at."""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+def check_shared_dir():
+    """
+    Refuse to run several replicas of the API that stage the uploads in local folders,
+    as the chunks of an upload sent to different replicas would end up in different files.
+    With more than one replica, RESUMABLE_UPLOAD_DIR has to be set to a shared volume.
+    Raises RuntimeError otherwise.
+    """
+    if API_REPLICAS > 1 and not UPLOAD_DIR_CONFIGURED:
+        raise RuntimeError(
+            f"{API_REPLICAS} replicas of the API need RESUMABLE_UPLOAD_DIR on a shared volume"
+        )
+
+
+def get_paths(upload_id):
+    """
+    Get the paths of the data and json file of an upload, None for an invalid id.
+    """
+    try:
+        upload_id = uuid.UUID(hex=upload_id).hex
+    except ValueError:
+        return None
+    path = os.path.join(RESUMABLE_UPLOAD_DIR, upload_id)
+    return f"{path}.part", f"{path}.json"
+
+
+def expire_uploads():
+    """
+    Drop the uploads that did not get a chunk within the TTL.
+    """
+    now = time.time()
+    for name in os.listdir(RESUMABLE_UPLOAD_DIR):
+        if not name.endswith(".part"):
+            continue
+        try:
+            # the data file changes with every chunk
+            modified = os.path.getmtime(os.path.join(RESUMABLE_UPLOAD_DIR, name))
+            if now - modified > RESUMABLE_UPLOAD_TTL:
+                remove_upload(name[: -len(".part")])
+        except FileNotFoundError:
+            # removed by another request in between
+            pass
+
+
+def create_upload(user_id, path, size):
+    """
+    Create an empty upload.
+
+    :param user_id: id of the user uploading the file
+    :param path:    path the file is stored at, like for a normal upload
+    :param size:    size of the whole file in bytes
+    :return:        the id of the upload
+    """
+    os.makedirs(RESUMABLE_UPLOAD_DIR, exist_ok=True)
+    expire_uploads()
+    upload_id = uuid.uuid4().hex
+    data_path, info_path = get_paths(upload_id)
+    with open(data_path, "xb"):
+        pass
+    write_info(info_path, {"user_id": user_id, "path": path, "size": size, "received": 0})
+    return upload_id
+
+
+def write_info(info_path, info):
+    """
+    Replace the json file of an upload at once, so it is never read half written.
+    """
+    with open(f"{info_path}.tmp", "w", encoding="utf-8") as info_file:
+        json.dump(info, info_file)
+        info_file.flush()
+        os.fsync(info_file.fileno())
+    os.replace(f"{info_path}.tmp", info_path)
+
+
+def get_upload(upload_id, user_id):
+    """
+    Get an upload of a user.
+
+    :param upload_id:   the id of the upload
+    :param user_id:     id of the user, the uploads of other users are not found
+    :return:            dict with the path, size and confirmed bytes as received of the upload,
+                        None if it does not exist
+    """
+    paths = get_paths(upload_id)
+    if paths is None:
+        return None
+    try:
+        with open(paths[1], encoding="utf-8") as info_file:
+            info = json.load(info_file)
+    except FileNotFoundError:
+        return None
+    if info["user_id"] != user_id:
+        return None
+    return info
+
+
+def append_chunk(upload_id, offset, stream, checksum):
+    """
+    Append a chunk to an upload, if it starts at the confirmed bytes and matches its checksum.
+
+    :param upload_id:   the id of the upload, from get_upload
+    :param offset:      the position of the chunk in the file
+    :param stream:      file-like object with the chunk, like the request stream
+    :param checksum:    sha256 hex digest of the chunk
+    :return:            the number of confirmed bytes after the chunk
+    :raises ChunkError: if the chunk does not start at the confirmed bytes, is too large,
+                        or does not match its checksum
+    """
+    data_path, info_path = get_paths(upload_id)
+    with open(data_path, "r+b") as data_file:
+        # chunks of the same upload are appended one after the other
+        fcntl.flock(data_file, fcntl.LOCK_EX)
+        with open(info_path, encoding="utf-8") as info_file:
+            upload = json.load(info_file)
+        received = upload["received"]
+        # drop what an interrupted request wrote after the confirmed bytes
+        data_file.truncate(received)
+        data_file.seek(received)
+        if offset != received:
+            raise ChunkError("The chunk does not start at the received bytes.", received)
+
+        digest = hashlib.sha256()
+        while block := stream.read(COPY_BLOCK_SIZE):
+            digest.update(block)
+            data_file.write(block)
+            if data_file.tell() - offset > RESUMABLE_CHUNK_BYTES:
+                data_file.truncate(offset)
+                raise ChunkError("The chunk is too large.", offset)
+            if data_file.tell() > upload["size"]:
+                data_file.truncate(offset)
+                raise ChunkError("The chunk is beyond the size of the file.", offset)
+
+        if digest.hexdigest() != checksum.lower():
+            # drop the chunk, so it can be sent again
+            data_file.truncate(offset)
+            raise ChunkError("The checksum of the chunk does not match.", offset)
+
+        # the bytes are only confirmed once they are stored
+        data_file.flush()
+        os.fsync(data_file.fileno())
+        upload["received"] = data_file.tell()
+        write_info(info_path, upload)
+        return upload["received"]
+
+
+def open_upload(upload_id):
+    """
+    Open the data of a complete upload to commit it. The upload stays until it is removed
+    once its job is started, so a commit that is rejected can be retried.
+    The file is locked while it is open, so the upload can only be committed once at a time.
+
+    :raises BlockingIOError:    if the upload is being committed by another request
+    """
+    data_path, _ = get_paths(upload_id)
+    # closed by the upload job once it is done, or when the commit is rejected
+    data_file = open(data_path, "rb")  # pylint: disable=consider-using-with
+    try:
+        fcntl.flock(data_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        data_file.close()
+        raise
+    return data_file
+
+
+def remove_upload(upload_id):
+    """
+    Drop an upload and its received bytes.
+    """
+    for path in get_paths(upload_id):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
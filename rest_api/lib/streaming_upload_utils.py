@@ -0,0 +1,83 @@
+"""
+Helper functions to read the parts of a multipart upload one after the other while it is received,
+without spooling the whole request first.
+"""
+
+from werkzeug.sansio.multipart import (
+    NEED_DATA,
+    Data,
+    Epilogue,
+    Field,
+    File,
+    MultipartDecoder,
+)
+
+# size of the blocks the request is read in, 1 MB
+STREAM_BLOCK_SIZE = 1024**2
+# largest value of a form field that is kept in memory, 64 KB
+MAX_FIELD_SIZE = 64 * 1024
+
+
+def read_events(stream, boundary):
+    """
+    Read the events of the multipart decoder from a stream, as the data is received.
+
+    :param stream:      file-like object with the body of the request
+    :param boundary:    the boundary of the parts from the content type
+    :raises ValueError: if the body ends before the last part
+    """
+    decoder = MultipartDecoder(boundary.encode())
+    while True:
+        event = decoder.next_event()
+        if event is NEED_DATA:
+            data = stream.read(STREAM_BLOCK_SIZE)
+            if not data and decoder.complete:
+                return
+            decoder.receive_data(data or None)
+        elif isinstance(event, Epilogue):
+            return
+        else:
+            yield event
+
+
+def read_data(events):
+    """
+    Yield the data of the current part, until its last chunk.
+    """
+    for event in events:
+        if not isinstance(event, Data):
+            raise ValueError("the part has no data")
+        if event.data:
+            yield event.data
+        if not event.more_data:
+            return
+    raise ValueError("the request ended in the middle of a part")
+
+
+def iter_parts(stream, boundary):
+    """
+    Yield the parts of a multipart body in the order they are received.
+    The data of a file part has to be read before the next part is yielded, what is not read of it
+    is skipped. The value of a field is read completely.
+
+    :param stream:      file-like object with the body of the request
+    :param boundary:    the boundary of the parts from the content type
+    :return:            generator of (name, filename, data) with the value of a field as a string
+                        and the filename None, or an iterator over the chunks of a file
+    :raises ValueError: if the body is malformed or a field is too large
+    """
+    events = read_events(stream, boundary)
+    for event in events:
+        if isinstance(event, File):
+            data = read_data(events)
+            yield event.name, event.filename, data
+            # skip what was not read of the file
+            for _ in data:
+                pass
+        elif isinstance(event, Field):
+            value = b""
+            for chunk in read_data(events):
+                value += chunk
+                if len(value) > MAX_FIELD_SIZE:
+                    raise ValueError("a form field is too large")
+            yield event.name, None, value.decode(event.headers.get("charset", "utf-8"))
@@ -2,9 +2,15 @@
 
 from ..routes.files.interactor import interactor
 from ..couch_init import couch_db
+from .file_conversion_utils import resolve_input_format
+from .jpeg_layout_utils import list_files
 
-def prepare_input_directory_and_token(input_files):
-    """Helper function to create a token with its own folder in dCache and copy all input files to it."""
+def prepare_input_directory_and_token(input_files, input_format=None):
+    """
+    Helper function to create a token with its own folder in dCache and copy all input files to it.
+    With an input format, mp4 inputs are staged as their conversion to the format,
+    which is created first if it does not exist yet.
+    """
     # create empty document on CouchDB to get the token id
     token_id = couch_db.save({})[0]
     input_folder_dir = "projects/imagen/input_data_" + token_id + "/"
@@ -12,7 +18,10 @@ def prepare_input_directory_and_token(input_files):
     interactor.make_dir(input_folder_dir)
     # for every file or folder in the input get all files in the directory
     for input_dir in input_files:
-        files_in_dir = interactor.get_dir_content_recursive(input_dir[1:])
+        if input_format:
+            input_dir = resolve_input_format(input_dir, input_format)
+        # directories with a manifest are listed from it instead of walking them
+        files_in_dir = list_files(input_dir[1:])
         # for all files in the directory, copy them to the directory for the task
         for file in files_in_dir:
             # remove all directories before the file when creating the copy
@@ -32,8 +32,11 @@ class AuthorizationMiddleware:
             "/api/images/stored_parameters",
             "/api/files",
             "/api/files/upload",
+            "/api/files/uploads",
             "/api/files/download",
             "/api/files/statusstream",
+            "/api/files/virtual",
+            "/api/files/staging/h5",
         ],
         "AI Researcher": [
             "/api/tasks",
@@ -43,7 +46,10 @@ class AuthorizationMiddleware:
             "/api/images/stored_parameters",
             "/api/files",
             "/api/files/upload",
+            "/api/files/uploads",
             "/api/files/statusstream",
+            "/api/files/virtual",
+            "/api/files/staging/h5",
         ],
         "Maintainer": ["/api/images", "/api/images", "/api/roles"],
     }
@@ -58,6 +64,7 @@ class AuthorizationMiddleware:
             "/api/auth/register",
             "/api/auth/login",
             "/api/health",
+            "/api/metrics",
             "/api/auth/logout",
             "/api/users/roles",
             "/api/auth/viewable_pages",
@@ -0,0 +1,24 @@
+"""This module contains the model for the cached results of file conversions in the database."""
+
+from . import db
+
+
+class ConversionCache(db.Model):
+    """A conversion cache class, the objects of which are directly mapped to the conversion cache
+    table in the database - provides an intuitive programmer interface."""
+
+    __tablename__ = "conversion_cache_table"
+    __table_args__ = (db.UniqueConstraint("input_hash", "format", "options"),)
+
+    id = db.Column(db.Integer, primary_key=True, unique=True, autoincrement=True)
+    # sha256 hex digest of the converted input file
+    input_hash = db.Column(db.String(64), nullable=False)
+    # the format the input was converted to
+    format = db.Column(db.String(50), nullable=False)
+    # the conversion options that influence the output as a json string
+    options = db.Column(db.String(300), nullable=False)
+    # path to the output of the conversion in dCache as file/path/filename.ext
+    path = db.Column(db.String(300), nullable=False)
+    # number of near duplicate frames dropped by the conversion,
+    # None for the entries stored before it was recorded
+    dropped_frames = db.Column(db.Integer, nullable=True, default=0)
@@ -16,3 +16,11 @@ class File(db.Model):
     tags = db.relationship("Tag", secondary=files_tags_table, back_populates="files")
     # type of the file (directory or file)
     type = db.Column(db.String(300), nullable=False)
+    # metadata of video files read from the container headers at upload time, None otherwise
+    width = db.Column(db.Integer, nullable=True)
+    height = db.Column(db.Integer, nullable=True)
+    # duration in seconds
+    duration = db.Column(db.Float, nullable=True)
+    codec = db.Column(db.String(50), nullable=True)
+    frame_count = db.Column(db.Integer, nullable=True)
+    frame_rate = db.Column(db.Float, nullable=True)
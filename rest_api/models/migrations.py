@@ -0,0 +1,58 @@
+"""
+Adds the columns that were added to models after their tables were created.
+db.create_all only creates the tables that are missing, so an existing database
+would not have these columns otherwise.
+"""
+
+from sqlalchemy import inspect, text
+from . import db
+
+# table mapped to the columns that were added to its model, in the order they were added.
+# The columns have to be nullable, as the rows that exist get no value for them.
+ADDED_COLUMNS = {
+    "conversion_cache_table": ("dropped_frames",),
+    "files_table": (
+        "width",
+        "height",
+        "duration",
+        "codec",
+        "frame_count",
+        "frame_rate",
+    ),
+    "upload_progress_table": (
+        "bytes_done",
+        "bytes_total",
+        "frames_done",
+        "frames_total",
+        "bytes_per_second",
+        "frames_per_second",
+        "eta",
+        "job_id",
+        "owner",
+    ),
+}
+
+
+def add_missing_columns():
+    """
+    Add the columns of ADDED_COLUMNS that the tables in the database do not have yet.
+    Runs at startup after the tables are created, so it has to be safe to run on every start,
+    also by several replicas at the same time.
+    """
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect
+    # another replica may add a column between the inspection and the ALTER
+    if_not_exists = "IF NOT EXISTS " if dialect.name == "postgresql" else ""
+    for table_name, column_names in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table_name)}
+        table = db.metadata.tables[table_name]
+        for name in column_names:
+            if name in existing:
+                continue
+            column_type = table.c[name].type.compile(dialect=dialect)
+            db.session.execute(
+                text(
+                    f"ALTER TABLE {table_name} ADD COLUMN {if_not_exists}{name} {column_type}"
+                )
+            )
+    db.session.commit()
@@ -0,0 +1,46 @@
+"""This module contains the model for the progress of uploads in the database."""
+
+from datetime import datetime
+
+from . import db
+
+
+class UploadProgress(db.Model):
+    """An upload progress class, the objects of which are directly mapped to the upload progress
+    table in the database - provides an intuitive programmer interface.
+    Every row is an item of an upload, a file or a directory, until the status stream of the user
+    reported it as done."""
+
+    __tablename__ = "upload_progress_table"
+
+    id = db.Column(db.Integer, primary_key=True, unique=True, autoincrement=True)
+    user_id = db.Column(
+        db.Integer, db.ForeignKey("users_table.id", ondelete="CASCADE"), nullable=False
+    )
+    # path of the item as reported on the status stream
+    item = db.Column(db.String(300), nullable=False)
+    # id of the upload job the item belongs to, as returned by the upload request
+    job_id = db.Column(db.String(32), nullable=True)
+    # key of the advisory lock held by the process running the job, the job is lost without it
+    owner = db.Column(db.BigInteger, nullable=True)
+    # whether all files of the item are uploaded, or the upload failed
+    done = db.Column(db.Boolean, nullable=False, default=False)
+    # why the upload of the item failed, None if it did not
+    message = db.Column(db.String(300), nullable=True)
+    # number of near duplicate frames dropped from the conversions of the item
+    dropped_frames = db.Column(db.Integer, nullable=True)
+    # position of the item in the conversion queue, 0 once its conversion started
+    position = db.Column(db.Integer, nullable=True)
+    # bytes of the files of the item that are uploaded and in total, None until the upload started
+    bytes_done = db.Column(db.BigInteger, nullable=True)
+    bytes_total = db.Column(db.BigInteger, nullable=True)
+    # frames of the videos of the item that are converted and in total, None if not known
+    frames_done = db.Column(db.Integer, nullable=True)
+    frames_total = db.Column(db.Integer, nullable=True)
+    # smoothed throughput of the upload
+    bytes_per_second = db.Column(db.Float, nullable=True)
+    frames_per_second = db.Column(db.Float, nullable=True)
+    # estimated seconds until the item is done, None if not known
+    eta = db.Column(db.Float, nullable=True)
+    # time of the last change, old rows are dropped
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.now)
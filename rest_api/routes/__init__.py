@@ -3,6 +3,7 @@
 
 from flask import Blueprint
 from .health import health
+from .metrics import metrics
 from .auth import register_auth_endpoints
 from .users import register_users_blueprints
 from .tags import register_tags_endpoints
@@ -24,3 +25,6 @@ register_roles_endpoints(blueprint)
 
 # This route makes pings to the backend to check that the server is alive.
 blueprint.add_url_rule("/api/health", view_func=health, methods=["GET"])
+
+# This route exposes the metrics of the application, like the conversion cache hit rate.
+blueprint.add_url_rule("/api/metrics", view_func=metrics, methods=["GET"])
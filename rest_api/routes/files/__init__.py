@@ -9,6 +9,18 @@ from .download_file_endpoint import download_file
 from .edit_file_endpoint import edit_file
 from .delete_file_endpoint import delete_file
 from .file_upload_status_endpoint import upload_status
+from .convert_file_endpoint import convert_file
+from .frame_endpoints import fetch_frame, fetch_frames
+from .thumbnail_endpoint import fetch_thumbnail
+from .h5_slice_endpoint import fetch_h5_slice, fetch_staged_h5_slice
+from .virtual_dataset_endpoint import create_virtual_dataset
+from .resumable_upload_endpoint import (
+    create_resumable_upload,
+    fetch_resumable_upload,
+    upload_chunk,
+    commit_resumable_upload,
+    delete_resumable_upload,
+)
 
 
 def register_files_blueprints(blueprint):
@@ -28,6 +40,45 @@ def register_files_blueprints(blueprint):
         "/api/files/<string:file_id>", view_func=delete_file, methods=["DELETE"]
     )
 
+    # This route handles converting a file that is already stored
+    blueprint.add_url_rule(
+        "/api/files/<string:file_id>/convert", view_func=convert_file, methods=["POST"]
+    )
+
+    # This route handles fetching a single frame of a stored video
+    blueprint.add_url_rule(
+        "/api/files/<string:file_id>/frames/<int:frame_index>",
+        view_func=fetch_frame,
+        methods=["GET"],
+    )
+
+    # This route handles fetching a batch of frames of a stored video
+    blueprint.add_url_rule(
+        "/api/files/<string:file_id>/frames", view_func=fetch_frames, methods=["GET"]
+    )
+
+    # This route handles fetching the thumbnail of a file
+    blueprint.add_url_rule(
+        "/api/files/<string:file_id>/thumbnail",
+        view_func=fetch_thumbnail,
+        methods=["GET"],
+    )
+
+    # This route handles fetching a slice of a dataset of a stored h5 file
+    blueprint.add_url_rule(
+        "/api/files/<string:file_id>/h5", view_func=fetch_h5_slice, methods=["GET"]
+    )
+
+    # This route handles fetching a slice of an h5 conversion that is still being uploaded
+    blueprint.add_url_rule(
+        "/api/files/staging/h5", view_func=fetch_staged_h5_slice, methods=["GET"]
+    )
+
+    # This route handles combining stored h5 files into a virtual dataset
+    blueprint.add_url_rule(
+        "/api/files/virtual", view_func=create_virtual_dataset, methods=["POST"]
+    )
+
     # This route handles downloading a file
     blueprint.add_url_rule(
         "/api/files/download/<string:file_id>", view_func=download_file, methods=["GET"]
@@ -36,6 +87,29 @@ def register_files_blueprints(blueprint):
     # This route handles uploading a file
     blueprint.add_url_rule("/api/files/upload", view_func=upload_file, methods=["POST"])
 
+    # These routes handle uploading a large file in resumable chunks
+    blueprint.add_url_rule(
+        "/api/files/uploads", view_func=create_resumable_upload, methods=["POST"]
+    )
+    blueprint.add_url_rule(
+        "/api/files/uploads/<string:upload_id>",
+        view_func=fetch_resumable_upload,
+        methods=["GET"],
+    )
+    blueprint.add_url_rule(
+        "/api/files/uploads/<string:upload_id>", view_func=upload_chunk, methods=["PUT"]
+    )
+    blueprint.add_url_rule(
+        "/api/files/uploads/<string:upload_id>",
+        view_func=delete_resumable_upload,
+        methods=["DELETE"],
+    )
+    blueprint.add_url_rule(
+        "/api/files/uploads/<string:upload_id>/commit",
+        view_func=commit_resumable_upload,
+        methods=["POST"],
+    )
+
     # This route handles fetching the upload status
     blueprint.add_url_rule(
         "/api/files/statusstream/<int:uid>", view_func=upload_status, methods=["GET"]
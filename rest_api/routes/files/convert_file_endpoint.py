@@ -0,0 +1,55 @@
+"""Endpoint to convert an mp4 file that is already stored in dCache"""
+
+from flask import request, jsonify, abort
+from ...models import file, tag
+from ...lib.user_utils import get_user_by_session
+from ...lib.file_conversion_utils import is_convertible, ConversionJob
+from .file_upload_endpoint import get_formats, start_job
+
+
+def convert_file(file_id):
+    """
+    Convert an mp4 file stored in dCache to one or more formats.
+    The conversion runs in the background like an upload and the request returns 202 with the id
+    of its job, the outputs are stored next to the file and reported on the status stream.
+    An earlier output is only reused if it was converted from the same video with the same options.
+
+    The form data takes the same fields as an upload:
+    - format: a format to convert to, can be given multiple times
+    - frames, scene_threshold, dedup_distance, shard_size, jpeg_layout and stream_h5:
+      the conversion options
+    """
+    # get the file to convert
+    source: file.File = file.File.query.get_or_404(file_id)
+
+    # get the user tag
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+    user_tag = tag.Tag.query.filter_by(name=user.email).first()
+
+    # make sure user has access to file
+    if user_tag is None or user_tag not in source.tags:
+        abort(401)
+
+    if not is_convertible(source):
+        return jsonify(
+            {"success": False, "message": "Only mp4 files can be converted."}
+        ), 400
+
+    # check the formats before the job is created
+    if not get_formats(request.form):
+        return jsonify(
+            {"success": False, "message": "At least one format is required."}
+        ), 400
+
+    try:
+        # the options are read from the form like for an upload
+        job = ConversionJob(source, request.form, user)
+    except FileNotFoundError:
+        return jsonify(
+            {"success": False, "message": "The file does not exist in dCache."}
+        ), 404
+
+    # broken videos are rejected with 400 before the job is started
+    return start_job(job)
@@ -1,6 +1,7 @@
 """Endpoint to delte a file from dcache"""
 
 from ...lib.user_utils import authenticate_user_by_tag
+from ...lib.conversion_cache_utils import forget_cached_conversions
 from ...models.file import File
 from ...models import db
 from .interactor import interactor
@@ -17,6 +18,7 @@ def delete_file(file_id):
 
     # delete the file on the database and dcache
     interactor.delete_file(file_to_delete.index[1:])
+    forget_cached_conversions(file_to_delete.index[1:])
     File.query.filter_by(id=file_id).delete()
     db.session.commit()
 
@@ -8,6 +8,7 @@ import zipstream
 from flask import Response, abort
 from ...models import file, tag
 from ...lib.user_utils import get_user_by_session
+from ...lib.jpeg_layout_utils import list_files
 from .interactor import interactor
 
 
@@ -45,8 +46,8 @@ def download_file(file_id):
         response.headers["Content-Disposition"] = f"attachment; filename={file_name}"
         return response
 
-    # if it's a directory stream it a zip file
-    dcache_file_paths = interactor.get_dir_content_recursive(file_name)
+    # if it's a directory stream it a zip file, listed from its manifest if it has one
+    dcache_file_paths = list_files(file_name)
 
     def stream_file():
         zip_stream = zipstream.ZipFile(mode="w", compression=zipstream.ZIP_DEFLATED)
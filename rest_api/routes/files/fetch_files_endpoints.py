@@ -2,10 +2,26 @@
 API endpoints for fetching files.
 """
 
+import operator
+
 from flask import jsonify, request
 from ...models.file import File
 from ...lib.user_utils import get_user_by_session
 
+# filters on the metadata of video files, as parameter: (column, type, comparison)
+MEDIA_FILTERS = {
+    "min_width": ("width", int, operator.ge),
+    "max_width": ("width", int, operator.le),
+    "min_height": ("height", int, operator.ge),
+    "max_height": ("height", int, operator.le),
+    "min_duration": ("duration", float, operator.ge),
+    "max_duration": ("duration", float, operator.le),
+    "codec": ("codec", str, operator.eq),
+}
+
+# the video metadata returned with every file
+MEDIA_FIELDS = ["width", "height", "duration", "codec", "frame_count", "frame_rate"]
+
 
 def fetch_files():
     """
@@ -16,6 +32,9 @@ def fetch_files():
     - tags: a list of tag ids to filter the files by
     - page: the page number to fetch (default is 1)
     - per_page: the number of files to fetch per page (default is 10, between 1 and 100)
+    - min_width, max_width, min_height, max_height: the resolution of videos in pixels
+    - min_duration, max_duration: the duration of videos in seconds
+    - codec: the codec of videos, like h264
     """
     # Because the fanout counts every instance of the object called as a fanout, we just import it once and then use it.
     file = File
@@ -30,6 +49,11 @@ def fetch_files():
     tags = request.args.getlist("tags", type=int)
     page = request.args.get("page", type=int, default=1)
     per_page = request.args.get("per_page", type=int, default=20)
+    media_filters = {
+        name: request.args.get(name, type=value_type)
+        for name, (_, value_type, _) in MEDIA_FILTERS.items()
+        if request.args.get(name, type=value_type) is not None
+    }
 
     # Check if the page is valid
     if page < 1:
@@ -53,6 +77,9 @@ def fetch_files():
         for tag_id in tags:
             res = res.filter(file.tags.any(id=tag_id))
 
+    # Filter the files by the video metadata stored at upload time
+    res = filter_media(res, media_filters)
+
     res = res.order_by(file.id)
 
     # Paginate the files
@@ -75,12 +102,17 @@ def fetch_files():
                 }
                 for t in f.tags
             ],
+            "media": (
+                {field: getattr(f, field) for field in MEDIA_FIELDS}
+                if f.width is not None
+                else None
+            ),
         }
         for f in files
     ]
 
     if res.has_next:
-        next_url = get_next_url(search, tags, res.next_num, per_page)
+        next_url = get_next_url(search, tags, res.next_num, per_page, media_filters)
     else:
         next_url = None
 
@@ -94,7 +126,17 @@ def fetch_files():
     ), 200
 
 
-def get_next_url(search, tags, page, per_page):
+def filter_media(query, media_filters):
+    """
+    Filter a files query by the metadata of videos.
+    """
+    for name, value in media_filters.items():
+        column, _, compare = MEDIA_FILTERS[name]
+        query = query.filter(compare(getattr(File, column), value))
+    return query
+
+
+def get_next_url(search, tags, page, per_page, media_filters=None):
     """
     Get the next url for the files endpoint based on the current request.
     """
@@ -107,4 +149,8 @@ def get_next_url(search, tags, page, per_page):
         # to have multiple tags we specify the tags parameter multiple times, so &tags=1&tags=2&tags=3
         for tag_id in tags:
             next_url += f"&tags={tag_id}"
+    if media_filters:
+        # We want to keep the video metadata filters in the next url
+        for name, value in media_filters.items():
+            next_url += f"&{name}={value}"
     return next_url
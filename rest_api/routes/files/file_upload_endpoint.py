@@ -1,20 +1,103 @@
 # validate-ignore
 """The endpoint for uploading files or directories."""
 
-import io
-
-from flask import abort, request
-from ...file_converter import FileConverter
-from ...models import file, tag, db
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from contextlib import ExitStack, contextmanager
+
+from flask import abort, current_app, jsonify, request
+from sqlalchemy import insert
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.exceptions import HTTPException
+from ...conversion_scheduler import ConversionScheduler, get_cost, get_weight
+from ...upload_progress import ProgressRegistry
+from ...dcache_file import DCacheFile
+from ...file_converter import FileConverter, probe_video
+from ...frame_batch import FrameBatch
+from ...h5_staging import H5_STAGING_DIR, StagingH5Writer, staging_files
+from ...shard_writer import ShardWriter
+from ...models import file, tag, db, files_tags_table, user as user_model
 from ...lib.user_utils import get_user_by_session
+from ...lib.conversion_cache_utils import (
+    hash_input,
+    write_hashed,
+    copy_cached_conversion,
+    forget_cached_conversions,
+    store_cached_conversion,
+)
+from ...lib.jpeg_layout_utils import (
+    MANIFEST_NAME,
+    create_manifest,
+    get_sharded_frame_path,
+)
+from ...lib.streaming_upload_utils import STREAM_BLOCK_SIZE, iter_parts
 from .interactor import interactor
 
 converter = FileConverter()
+# the progress of the uploads of every user, reported on the status stream
+progress = ProgressRegistry()
+
+
+def report_positions():
+    """
+    Store the positions of the conversions waiting in this process, for the status streams.
+    """
+    progress.set_positions(scheduler.get_all_positions())
+
+
+# shares the conversion workers fairly between the users of all request threads
+scheduler = ConversionScheduler(on_change=report_positions)
+
+# conversions that produce a single file, mapped to the converter method creating it
+SINGLE_FILE_CONVERSIONS = {
+    "pickle": converter.jpeg_to_pickle,
+    "h5": converter.jpeg_to_h5,
+    "npy": converter.jpeg_to_npy,
+    "npz": converter.jpeg_to_npz,
+}
+
+# conversions that produce a directory of files
+DIRECTORY_CONVERSIONS = ["jpeg", "shards"]
+
+# layouts of the directory of the jpeg conversion
+JPEG_LAYOUTS = ["flat", "sharded"]
+
+# targeted size of a tar shard when no size is requested, 1 GB
+DEFAULT_SHARD_SIZE = 1024**3
+
+# largest Hamming distance between two 64 bit perceptual hashes
+MAX_DEDUP_DISTANCE = 64
+
+# folder the files of an upload are kept in until its job is done
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR", tempfile.gettempdir())
+
+# number of files that are registered in the database with one insert statement
+REGISTER_CHUNK_SIZE = int(os.environ.get("REGISTER_CHUNK_SIZE", 1000))
+# longest time a finished item waits for its database entry, in seconds
+REGISTER_INTERVAL = float(os.environ.get("REGISTER_INTERVAL", 1))
+
+# the metadata stored with files that are not videos
+NO_MEDIA = dict.fromkeys(
+    ("width", "height", "duration", "codec", "frame_count", "frame_rate")
+)
+
+# id of an upload job mapped to its future, until the job is done
+upload_jobs = {}
+
+
+class SpooledFile(FileStorage):
+    """A file of an upload in a spool file, with the sha256 digest of its data."""
 
-# queue of files waiting to be uploaded
-upload_queue = {}
-# items that have been uploaded
-finished_uploads = {}
+    def __init__(self, stream, filename, name, digest):
+        super().__init__(stream=stream, filename=filename, name=name)
+        # hashed while it is spooled, to look up earlier conversions of the file
+        self.digest = digest
 
 
 class FileClass:
@@ -34,202 +117,771 @@ class FileClass:
         self.path_to_file = path.rsplit("/", 1)[0] if self.is_dir_item else ""
 
 
-def generate_queues(files, uid):
+def generate_queues(files, uid, totals=None, job_id=None):
     """
-    Generates queues to keep track of which files have been uploaded
+    Generates queues to keep track of which files have been uploaded,
+    totals maps the items to the (bytes, frames) their progress is reported against,
+    and the items are reported with the id of their upload job
     """
-    for path, uploaded_file in files:
-        # process the files to be uploaded to seperate into queues
+    # check all files before any of them is queued
+    for _, uploaded_file in files:
         if uploaded_file.name is None or uploaded_file.name.isspace():
-            # cleanup  queue
-            if upload_queue[uid] is not None:
-                upload_queue.pop(uid)
             # send back error
             abort(500)
-        # check if the file is in a directory
-        is_dir_item = "/" in path
-        if is_dir_item:
-            root_name = path.split("/")[0] + "/"
-        else:
-            root_name = "/"
 
-        # insert into queues
-        if root_name in upload_queue[uid]:
-            upload_queue[uid][root_name].add(path)
-        else:
-            upload_queue[uid][root_name] = {path}
+    # the files of a directory are reported as the directory once they are all done
+    progress.add_files(
+        uid,
+        [
+            (path, get_item(FileClass(file_data=uploaded_file, path=path)))
+            for path, uploaded_file in files
+        ],
+        totals,
+        job_id,
+    )
 
-        # set finished state
-        if is_dir_item:
-            finished_uploads[uid][root_name] = False
-        else:
-            finished_uploads[uid][path] = False
+
+def get_size(file_data):
+    """Get the size of a spooled or stored file in bytes."""
+    size = file_data.stream.seek(0, os.SEEK_END)
+    file_data.stream.seek(0)
+    return size
+
+
+def read_blocks(file_data, uid, item):
+    """
+    Read a file in blocks for a streamed upload to dCache,
+    reporting every block that was sent as transferred bytes of its item.
+    """
+    file_data.stream.seek(0)
+    while True:
+        block = file_data.stream.read(STREAM_BLOCK_SIZE)
+        if not block:
+            return
+        yield block
+        progress.add_transfer(uid, item, len(block))
+
+
+def get_item(up_file: FileClass):
+    """Get the item a file is reported as on the status stream, its directory or its path."""
+    return up_file.root_name if up_file.is_dir_item else up_file.path
+
+
+def get_output_dir(up_file: FileClass):
+    """Get the path of the directory a conversion into multiple files is stored in."""
+    if up_file.is_dir_item:
+        return f"{up_file.path_to_file}/{up_file.name}"
+    return f"{up_file.name}"
+
+
+def get_output_path(up_file: FileClass, file_format: str):
+    """Get the path in dCache the output of a conversion is stored at."""
+    if file_format in SINGLE_FILE_CONVERSIONS:
+        return f"{get_output_dir(up_file)}.{file_format}"
+    if file_format == "shards":
+        # kept apart from the jpeg directory, so both can be created from one upload
+        return f"{get_output_dir(up_file)}_shards"
+    return get_output_dir(up_file)
+
+
+def get_formats(form):
+    """
+    Get the formats mp4 files are converted to from the request form.
+    The format field can be given multiple times to convert to multiple formats,
+    or once as "none" to store mp4 files without conversion.
+    """
+    formats = form.getlist("format")
+    # malformed request
+    if not formats:
+        abort(400)
+    if formats == ["none"]:
+        return []
+    if any(
+        f not in SINGLE_FILE_CONVERSIONS and f not in DIRECTORY_CONVERSIONS
+        for f in formats
+    ):
+        abort(400)
+    # keep the order, but convert to each format only once
+    return list(dict.fromkeys(formats))
+
+
+def get_conversion_options(form):
+    """
+    Get the options of the conversions from the request form.
+
+    Optional fields:
+    - frames: "all" to convert every frame or "keyframes" to only convert keyframes (default is "all")
+    - scene_threshold: only keep keyframes that differ at least this much from the previous kept
+      keyframe, as a mean absolute pixel difference between 0 and 255
+    - shard_size: targeted size of a tar shard in bytes (default is 1 GB)
+    - dedup_distance: drop frames whose perceptual hash is within this Hamming distance of the
+      previous kept frame, between 0 and 64 (default is to keep every frame)
+    - jpeg_layout: "flat" to store the jpeg conversion as frame_<i>.jpeg in one directory, or
+      "sharded" to spread the frames over subdirectories listed in a manifest (default is "flat")
+    - stream_h5: "true" to make the frames of the h5 conversion readable while the video is
+      converted, through a staging file (default is "false")
+    """
+    frames = form.get("frames", default="all")
+    scene_threshold = form.get("scene_threshold", type=float)
+    shard_size = form.get("shard_size", type=int, default=DEFAULT_SHARD_SIZE)
+    dedup_distance = form.get("dedup_distance", type=int)
+    stream_h5 = form.get("stream_h5", default="false")
+    jpeg_layout = form.get("jpeg_layout", default="flat")
+    # malformed request
+    if frames not in ("all", "keyframes") or shard_size < 1:
+        abort(400)
+    if jpeg_layout not in JPEG_LAYOUTS:
+        abort(400)
+    if stream_h5 not in ("true", "false"):
+        abort(400)
+    if dedup_distance is not None and not 0 <= dedup_distance <= MAX_DEDUP_DISTANCE:
+        abort(400)
+    # scene changes are only detected between keyframes
+    if frames == "all":
+        scene_threshold = None
+    return {
+        "frames": frames,
+        "scene_threshold": scene_threshold,
+        "shard_size": shard_size,
+        "dedup_distance": dedup_distance,
+        "stream_h5": stream_h5 == "true",
+        "jpeg_layout": jpeg_layout,
+    }
+
+
+def probe_videos(files):
+    """
+    Read the metadata of every mp4 file from its headers before anything is uploaded.
+    Rejects the upload if one of them is not a readable video.
+    """
+    media = {}
+    for path, file_data in files:
+        if file_data.filename and file_data.filename.rsplit(".", 1)[-1] == "mp4":
+            try:
+                media[path] = probe_video(file_data)
+            except ValueError:
+                # broken video
+                abort(400)
+    return media
 
 
-def upload_jpegs(up_file: FileClass, jpegs: list):
+def upload_jpegs(up_file: FileClass, jpegs: FrameBatch, layout: str = "flat"):
     """Upload mp4 to jpeg conversion."""
     # save as directory of jpegs
-    if up_file.is_dir_item:
-        upload_path = f"{up_file.path_to_file}/{up_file.name}"
-    else:
-        upload_path = f"{up_file.name}"
-    # upload each image into a directory named after the mp4
+    upload_path = get_output_dir(up_file)
+    if layout == "sharded":
+        # spread the images over subdirectories, so no directory gets too large to list
+        for i, img in enumerate(jpegs):
+            interactor.upload_file(f"{upload_path}/{get_sharded_frame_path(i)}", img)
+        # the manifest is written last, so it only lists frames that exist
+        interactor.upload_file(
+            f"{upload_path}/{MANIFEST_NAME}", create_manifest(len(jpegs))
+        )
+        return
+    # upload each image into a directory named after the mp4, straight from the batch
     for i, img in enumerate(jpegs):
-        byte_stream = io.BytesIO(img)
-        with byte_stream as f:
-            interactor.upload_file(f"{upload_path}/frame_{i}.jpeg", f)
+        interactor.upload_file(f"{upload_path}/frame_{i}.jpeg", img)
 
 
-def upload_pickle(up_file: FileClass, jpegs: list):
-    """Upload pickle mp4 to pickle conversion."""
-    # create the new name for the file
-    new_name = f"{up_file.name}.pickle"
+def upload_converted(up_file: FileClass, extension: str, converted):
+    """Upload a single file produced by an mp4 conversion."""
     # select the path based on directory structure
-    if up_file.is_dir_item:
-        upload_path = f"{up_file.path_to_file}/{new_name}"
-    else:
-        upload_path = f"{new_name}"
-    # create the pickle
-    pickle = converter.jpeg_to_pickle(jpegs)
-    with pickle as f:
-        # upload pickle to dcache
+    upload_path = get_output_path(up_file, extension)
+    with converted as f:
+        # upload the converted file to dcache
         interactor.upload_file(upload_path, f)
 
 
-def upload_h5(up_file: FileClass, jpegs: list):
-    """Upload mp4 to h5 conversion."""
-    # create the new name for the file
-    new_name = f"{up_file.name}.h5"
-    # select the path based on directory structure
-    if up_file.is_dir_item:
-        upload_path = f"{up_file.path_to_file}/{new_name}"
-    else:
-        upload_path = f"{new_name}"
-    # create the h5
-    h5 = converter.jpeg_to_h5(jpegs)
-    with h5 as f:
-        # upload h5 to dcache
-        interactor.upload_file(upload_path, f)
+def upload_shards(up_file: FileClass, shards: ShardWriter):
+    """Upload the index of the tar shards that were streamed while the mp4 was decoded."""
+    # the index is written last, so it only lists shards that exist
+    upload_path = get_output_path(up_file, "shards")
+    interactor.upload_file(
+        f"{upload_path}/index.json", json.dumps(shards.index).encode()
+    )
 
 
-def handle_conversions(uploaded_file: FileClass, file_format: str, jpegs: list):
-    """Handle file conversions and upload."""
+def upload_conversion(
+    uploaded_file: FileClass, file_format: str, jpegs: FrameBatch, options: dict
+):
+    """Convert the frames of an mp4 to a format and upload the result."""
     if file_format == "jpeg":
         # save as directory of jpegs
-        upload_jpegs(uploaded_file, jpegs)
-        file_type = "directory"
-        index = f"/{uploaded_file.name}"
-    elif file_format == "pickle":
-        # convert to pickle
-        new_name = f"{uploaded_file.name}.pickle"
-        file_type = "file"
-        index = f"/{new_name}"
-        upload_pickle(uploaded_file, jpegs)
-    elif file_format == "h5":
-        # convert to h5
-        new_name = f"{uploaded_file.name}.h5"
-        file_type = "file"
-        index = f"/{new_name}"
-        upload_h5(uploaded_file, jpegs)
+        upload_jpegs(uploaded_file, jpegs, options["jpeg_layout"])
     else:
-        # This is not a possible outcome
-        index = "/"
-        file_type = "file"
-        abort(500)
-    return index, file_type
+        # convert to a single file named after the format
+        converted = SINGLE_FILE_CONVERSIONS[file_format](jpegs)
+        upload_converted(uploaded_file, file_format, converted)
 
 
-def handle_database_entry(
-    uploaded_file: FileClass, index: str, file_type: str, uid: str, user_email: str
-):
-    """Handle creating the database entry for the file"""
-    # create a new entry as a file
-    file_row = file.File()
-    if not uploaded_file.is_dir_item:
-        # if the file is at the root
-        file_row.type = file_type
-        file_row.index = index
-        finished_uploads[uid][uploaded_file.path] = True
-    else:
-        # if the file is at the root
-        file_row.type = "directory"
-        file_row.index = f"/{uploaded_file.root_name}"
-        finished_uploads[uid][uploaded_file.root_name] = True
-    # assign the tags
-    tag_ids = request.form.getlist("tags[]")
-    tags = tag.Tag.query.filter(tag.Tag.id.in_(tag_ids)).all()
-    user_tag = tag.Tag.query.filter_by(name=user_email).first()
-    # always assing the user tag
-    tags.append(user_tag)
-    file_row.tags = tags
-    db.session().add(file_row)
-    db.session().commit()
+@contextmanager
+def stream_shards(uploaded_file: FileClass, shard_size: int):
+    """
+    Write the tar shards of a file while it is converted, streaming each shard to dCache as its
+    frames are decoded, so no shard is built in memory.
+    The shard being written is aborted if the conversion fails.
+    """
+    upload_path = get_output_path(uploaded_file, "shards")
 
-def upload_file():
+    def upload(name, chunks):
+        if not interactor.upload_stream(f"{upload_path}/{name}", chunks).ok:
+            raise OSError(f"{name} could not be stored")
+
+    writer = ShardWriter(upload, shard_size)
+    try:
+        yield writer
+    except BaseException:
+        writer.abort()
+        raise
+
+
+@contextmanager
+def stage_h5(uploaded_file: FileClass, user_id):
     """
-    Upload a file to dCache.
+    Stage the frames of the h5 conversion of a file in a local SWMR file while it is converted,
+    so the user can read them before the h5 file is uploaded.
+    The staging file is removed when the context exits and it is not read anymore.
+    """
+    index = f"/{get_output_path(uploaded_file, 'h5')}"
+    path = os.path.join(H5_STAGING_DIR, f"{uuid.uuid4().hex}.h5")
+    writer = StagingH5Writer(path)
+    staging_files.add(index, user_id, path)
+    try:
+        yield writer
+    finally:
+        writer.close()
+        # the file is removed once the slices that are being read from it are done
+        staging_files.remove(index)
+
+
+def decode_video(file_data, options: dict, writers=(), progress_key=None):
+    """
+    Decode the frames of an mp4 with the conversion options,
+    writing every frame to the writers as soon as it is decoded, like the staging h5 file or
+    the tar shards, which are closed once the video is decoded,
+    and reporting the decoded frames for the (user id, item) of the progress key if one is given.
     """
-    # get data from request
-    data = request.form
-    # get the conversion format
-    file_format = data.get("format")
 
-    # malformed request
-    if file_format is None:
-        abort(400)
+    def on_frame(jpeg, metadata):
+        for writer in writers:
+            writer.append(jpeg, metadata)
+        if progress_key is not None:
+            progress.add_transfer(*progress_key, 1, "frames")
+
+    jpegs = converter.mp4_to_jpeg(
+        file_data,
+        keyframes_only=options["frames"] == "keyframes",
+        scene_threshold=options["scene_threshold"],
+        dedup_distance=options["dedup_distance"],
+        on_frame=on_frame if writers or progress_key is not None else None,
+    )
+    # the outputs are complete, the staging file stays readable until the conversions are uploaded
+    for writer in writers:
+        writer.close()
+    return jpegs
+
+
+def open_writers(
+    stack: ExitStack, uploaded_file: FileClass, formats: list, options: dict, user_id
+):
+    """
+    Open the outputs of the formats a file is converted to that are written while the video is
+    decoded, so they get every frame right away: the staging h5 file of the user with the given
+    id if the stream_h5 option is set, and the tar shards.
+    The outputs are closed or aborted when the stack exits.
 
-    files = list(request.files.items())
+    :return:    the format of every output mapped to its writer
+    """
+    writers = {}
+    if options["stream_h5"] and user_id is not None and "h5" in formats:
+        writers["h5"] = stack.enter_context(stage_h5(uploaded_file, user_id))
+    if "shards" in formats:
+        writers["shards"] = stack.enter_context(
+            stream_shards(uploaded_file, options["shard_size"])
+        )
+    return writers
 
-    # get user id and email
-    user = get_user_by_session()
-    if not user:
-        abort(401)
 
-    uid = user.id
+def get_user_weight(user_id):
+    """Get the share of the conversion workers of a user by their roles."""
+    uploader = user_model.User.query.get(user_id) if user_id is not None else None
+    return get_weight([role.name for role in uploader.roles] if uploader else [])
 
-    # populate the queeus
-    upload_queue[uid] = {}
-    finished_uploads[uid] = {}
-    generate_queues(files, uid)
 
-    # go through each file and upload
-    for path, file_data in files:
-        # get the name without extention
-        if file_data.filename is None:
-            return "Unnamed files in upload batch", 500
+def handle_conversions(
+    uploaded_file: FileClass, formats: list, file_data, options: dict, user_id=None
+):
+    """
+    Handle file conversions and upload.
+    The video is decoded when it is the turn of the user with the given id in the scheduler,
+    and the h5 conversion is staged for them if the stream_h5 option is set.
+    Tar shards are streamed to dCache while the video is decoded.
+    Returns the index and type of the output of every conversion,
+    and the number of near duplicate frames that were dropped.
+    """
+    entries = []
+    dropped = 0
+    if isinstance(file_data, SpooledFile):
+        input_hash = file_data.digest
+    else:
+        input_hash = hash_input(file_data)
+
+    with ExitStack() as stack:
+        missing = []
+        for file_format in formats:
+            output_path = get_output_path(uploaded_file, file_format)
+            entries.append(
+                (
+                    f"/{output_path}",
+                    "directory" if file_format in DIRECTORY_CONVERSIONS else "file",
+                )
+            )
+
+            # reuse the output of an earlier conversion of the same video
+            cached = copy_cached_conversion(
+                input_hash, file_format, options, output_path
+            )
+            if cached:
+                dropped = cached.dropped_frames or 0
+            else:
+                missing.append(file_format)
+
+        if missing:
+            # the earlier outputs at the paths are overwritten
+            forget_cached_conversions(
+                *(get_output_path(uploaded_file, file_format) for file_format in missing)
+            )
+            db.session.commit()
+
+            # decode the video only once for all formats that are not cached
+            writers = open_writers(stack, uploaded_file, missing, options, user_id)
+            jpegs = scheduler.run(
+                user_id,
+                get_user_weight(user_id),
+                get_cost(file_data),
+                lambda item=get_item(uploaded_file): decode_video(
+                    file_data,
+                    options,
+                    list(writers.values()),
+                    # the decoded frames are reported for the item of the user
+                    (user_id, item) if user_id is not None else None,
+                ),
+                label=get_item(uploaded_file),
+            )
+            dropped = jpegs.dropped_frames
+
+            for file_format in missing:
+                if file_format == "shards":
+                    # the shards were uploaded while the video was decoded
+                    upload_shards(uploaded_file, writers["shards"])
+                else:
+                    upload_conversion(uploaded_file, file_format, jpegs, options)
+                store_cached_conversion(
+                    input_hash,
+                    file_format,
+                    options,
+                    get_output_path(uploaded_file, file_format),
+                    jpegs.dropped_frames,
+                )
+
+    return entries, dropped
+
+
+def get_file_rows(uploaded_file: FileClass, entries: list, media=None):
+    """
+    Get the database rows of the files created from an uploaded file.
+    Every entry is an index and type of an output of the file,
+    media is the metadata of a video file stored with each of its outputs.
+    """
+    if uploaded_file.is_dir_item:
+        # if the file is in a directory, create a new entry for the directory
+        return [
+            {"index": f"/{uploaded_file.root_name}", "type": "directory", **NO_MEDIA}
+        ]
+    # if the file is at the root, create a new entry for each output
+    return [
+        {"index": index, "type": file_type, **(media or NO_MEDIA)}
+        for index, file_type in entries
+    ]
+
+
+class EntryBatch:
+    """
+    The database entries of the finished items of an upload job, registered together in one
+    transaction with bulk inserts instead of a commit per item.
+    A batch is registered once it is REGISTER_INTERVAL seconds old and before a video is
+    converted, so the items are still reported on the status stream while the job runs.
+    """
+
+    def __init__(self, uid, tag_ids):
+        self.uid = uid
+        # the tags assigned to every file, resolved once for the whole job
+        self.tag_ids = tag_ids
+        self.items = []
+        self.rows = []
+        # paths in dCache that were written without conversion
+        self.written = []
+        self.started = None
+
+    def add(self, item, rows):
+        """
+        Add the rows of a finished item, and register the batch if it is due.
+        """
+        if self.started is None:
+            self.started = time.monotonic()
+        self.items.append(item)
+        self.rows.extend(rows)
+        if self.due():
+            self.register()
+
+    def due(self):
+        """
+        Whether the oldest item of the batch has waited REGISTER_INTERVAL seconds.
+        """
+        return self.started is not None and time.monotonic() - self.started >= REGISTER_INTERVAL
+
+    def register(self):
+        """
+        Insert the files and their tags in chunks in one transaction,
+        then report every item of the batch as done.
+        The cached conversions whose output was overwritten are dropped in the same transaction.
+        """
+        if not self.items and not self.written:
+            return
+        for start in range(0, len(self.rows), REGISTER_CHUNK_SIZE):
+            file_ids = db.session.scalars(
+                insert(file.File).returning(file.File.id, sort_by_parameter_order=True),
+                self.rows[start : start + REGISTER_CHUNK_SIZE],
+            ).all()
+            db.session.execute(
+                insert(files_tags_table),
+                [
+                    {"file_id": file_id, "tag_id": tag_id}
+                    for file_id in file_ids
+                    for tag_id in self.tag_ids
+                ],
+            )
+        for start in range(0, len(self.written), REGISTER_CHUNK_SIZE):
+            forget_cached_conversions(*self.written[start : start + REGISTER_CHUNK_SIZE])
+        db.session.commit()
+        progress.finish(self.uid, self.items)
+        self.items = []
+        self.rows = []
+        self.written = []
+        self.started = None
 
-        uploaded_file = FileClass(file_data=file_data, path=path)
 
-        if file_format != "none" and uploaded_file.ext == "mp4":
-            # the file is an mp4 file that needsd conversion
-            jpegs = converter.mp4_to_jpeg(file_data)
-            index, file_type = handle_conversions(
-                uploaded_file=uploaded_file, file_format=file_format, jpegs=jpegs
+def spool_files(files):
+    """
+    Copy the files of an upload to temporary files, so they outlive the request.
+    """
+    spooled = []
+    for path, file_data in files:
+        # closed by the upload job once it is done
+        spool = tempfile.TemporaryFile(dir=UPLOAD_SPOOL_DIR)  # pylint: disable=consider-using-with
+        file_data.stream.seek(0)
+        if file_data.filename.rsplit(".", 1)[-1] == "mp4":
+            # videos are hashed while they are copied, to look up their earlier conversions
+            digest = write_hashed(
+                iter(lambda stream=file_data.stream: stream.read(STREAM_BLOCK_SIZE), b""),
+                spool,
             )
+            spooled_file = SpooledFile(spool, file_data.filename, path, digest)
         else:
-            # select the upload path with no conversions
-            index = f"/{path}"
-            file_type = "file"
-            interactor.upload_file(path, file_data)
-
-        if (
-            not uploaded_file.is_dir_item
-            or len(upload_queue[uid][uploaded_file.root_name]) == 1
-        ):
-            handle_database_entry(
-                uploaded_file=uploaded_file,
-                index=index,
-                file_type=file_type,
-                uid=uid,
-                user_email=user.email,
-            )
+            shutil.copyfileobj(file_data.stream, spool)
+            spooled_file = FileStorage(stream=spool, filename=file_data.filename, name=path)
+        spool.seek(0)
+        spooled.append((path, spooled_file))
+    return spooled
+
+
+class UploadJob:
+    """
+    The spooled files and settings of an upload, processed in the background
+    after the request returned.
+    """
+
+    def __init__(self, files, form, user, stored=frozenset()):
+        # the job closes the spooled files once it is done
+        self.files = files
+        # the settings are read while the request is still there
+        self.formats = get_formats(form)
+        self.options = get_conversion_options(form)
+        self.uid = user.id
+        # always assign the user tag
+        user_tag = tag.Tag.query.filter_by(name=user.email).first()
+        self.tag_ids = form.getlist("tags[]") + [user_tag.id]
+        # paths of the files that were streamed to dCache during the request
+        self.stored = stored
+        # metadata of the videos, read before the job is started
+        self.media = {}
+
+    def converts(self, uploaded_file: FileClass):
+        """Whether the file is an mp4 file that is converted."""
+        return bool(self.formats) and uploaded_file.ext == "mp4"
+
+    def get_totals(self):
+        """
+        Get the bytes and frames of every item of the upload, to report its progress against.
+        The frames are those of the videos that are converted to every frame without dropping
+        duplicates, and None for an item without them or if the frame count of one of them
+        is not known.
+        """
+        totals = {}
+        # items with a video whose frames are not known
+        unknown = set()
+        for path, file_data in self.files:
+            uploaded_file = FileClass(file_data=file_data, path=path)
+            item = get_item(uploaded_file)
+            total_bytes, total_frames = totals.get(item, (0, None))
+            if self.converts(uploaded_file):
+                frame_count = self.media[path]["frame_count"]
+                # near duplicate frames are dropped before they are counted
+                if (
+                    self.options["frames"] != "all"
+                    or self.options["dedup_distance"] is not None
+                    or frame_count is None
+                ):
+                    unknown.add(item)
+                total_frames = (total_frames or 0) + (frame_count or 0)
+            totals[item] = (total_bytes + get_size(file_data), total_frames)
+        return {
+            item: (total_bytes, None if item in unknown else total_frames)
+            for item, (total_bytes, total_frames) in totals.items()
+        }
+
+    def process(self):
+        """
+        Convert and upload the files and create their database entries in batches.
+        """
+        uid = self.uid
+        # the tags that exist, the user tag is always among them
+        tags = tag.Tag.query.filter(tag.Tag.id.in_(self.tag_ids)).all()
+        batch = EntryBatch(uid, [t.id for t in tags])
+        try:
+            self.upload_files(batch)
+        finally:
+            # the items that are uploaded are registered even if a later file fails
+            batch.register()
+
+    def upload_files(self, batch: EntryBatch):
+        """
+        Convert and upload the files, adding the entries of every finished item to the batch.
+        """
+        uid = self.uid
+        # go through each file and upload
+        for path, file_data in self.files:
+            uploaded_file = FileClass(file_data=file_data, path=path)
+            item = get_item(uploaded_file)
+            converts = self.converts(uploaded_file)
+            # the finished items are not held back while a video is converted
+            # or by the items after them
+            if converts or batch.due():
+                batch.register()
+
+            if converts:
+                # the file is an mp4 file that needsd conversion
+                entries, dropped = handle_conversions(
+                    uploaded_file=uploaded_file,
+                    formats=self.formats,
+                    file_data=file_data,
+                    options=self.options,
+                    user_id=uid,
+                )
+                # report the dropped frames per item, summed over the files of a directory
+                progress.add_dropped(uid, item, dropped)
+                # the frames of a video are reported while it is decoded, its bytes once it is done
+                progress.add_transfer(uid, item, get_size(file_data))
+            else:
+                # select the upload path with no conversions
+                entries = [(f"/{path}", "file")]
+                batch.written.append(path)
+                if path in self.stored:
+                    progress.add_transfer(uid, item, get_size(file_data))
+                else:
+                    interactor.upload_stream(path, read_blocks(file_data, uid, item))
+
+            # a directory gets its entry once its last file is uploaded
+            if progress.remove_file(uid, path):
+                batch.add(item, self.get_rows(uploaded_file, entries))
+
+    def get_rows(self, uploaded_file: FileClass, entries: list):
+        """Get the database rows of the outputs of a finished file, see get_file_rows."""
+        return get_file_rows(uploaded_file, entries, self.media.get(uploaded_file.path))
+
+    def run(self, app):
+        """
+        Process the upload in the app context of a background thread.
+        If it fails, the items that are not done are reported as failed on the status stream.
+        """
+        with app.app_context():
+            try:
+                self.process()
+            except Exception:  # pylint: disable=broad-exception-caught
+                # whatever went wrong, the status stream has to learn that the items are done
+                db.session.rollback()
+                self.report_failure()
+            finally:
+                for _, file_data in self.files:
+                    file_data.close()
+
+    def report_failure(self):
+        """Mark the items of the upload that are not done as failed."""
+        items = {
+            get_item(FileClass(file_data=file_data, path=path))
+            for path, file_data in self.files
+        }
+        progress.fail(self.uid, items, "The upload failed.")
+
+
+def submit_job(job: UploadJob, app):
+    """
+    Run an upload job on a thread of its own, so it is not queued behind the jobs of other users.
+    The conversions of the jobs wait for their turn in the fair queue of the scheduler instead.
 
-        # cleanup the queue
-        if len(upload_queue[uid][uploaded_file.root_name]) == 1:
-            upload_queue[uid].pop(uploaded_file.root_name)
+    :return:    future that is done once the job is done
+    """
+    future = Future()
+
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(job.run(app))
+        except BaseException as error:  # pylint: disable=broad-exception-caught
+            future.set_exception(error)
+
+    threading.Thread(target=run).start()
+    return future
+
+
+def start_upload(files, user, form, stored=frozenset()):
+    """
+    Start the background job uploading spooled files,
+    with the conversion formats, options and tags of the request.
+
+    :param files:   list of (path, FileStorage) of the spooled files
+    :param user:    the user uploading the files
+    :param form:    the fields of the request with the formats, options and tags
+    :param stored:  paths of the files that are already stored in dCache
+    :return:        the response with the id of the upload job
+    """
+    # get the conversion formats, options and tags
+    return start_job(UploadJob(files, form, user, stored))
+
+
+def start_job(job: UploadJob):
+    """
+    Start an upload job in the background, once the videos of its files are known to be readable.
+
+    :param job: the upload job, with the files, settings and user of the request
+    :return:    the response with the id of the upload job
+    """
+    # reject broken videos before uploading anything
+    job.media = probe_videos(job.files)
+
+    # populate the queues, next to the items of other uploads of the user
+    job_id = uuid.uuid4().hex
+    generate_queues(job.files, job.uid, job.get_totals(), job_id)
+
+    upload_jobs[job_id] = submit_job(
+        job,
+        # the app of the request, as the job runs outside of it
+        current_app._get_current_object(),  # pylint: disable=protected-access
+    )
+    upload_jobs[job_id].add_done_callback(lambda _: upload_jobs.pop(job_id, None))
+
+    return jsonify({"success": True, "job_id": job_id}), 202
+
+
+def receive_streamed_files(files, stored):
+    """
+    Read the parts of a multipart upload while it is received, without buffering the request.
+    Files that are stored without conversion are streamed straight to dCache, mp4 files that are
+    converted are written to a spool file once, as the converter needs to seek in them.
+    The form fields have to come before the files, so the formats are known for the first file.
+
+    :param files:   list the (path, FileStorage) of the received files are added to
+    :param stored:  set the paths of the files streamed to dCache are added to
+    :return:        the form fields of the request
+    :raises ValueError: if the request is malformed
+    """
+    boundary = request.mimetype_params.get("boundary")
+    if request.mimetype != "multipart/form-data" or not boundary:
+        raise ValueError("The request is not multipart/form-data.")
+
+    form = MultiDict()
+    formats = None
+    for path, filename, data in iter_parts(request.stream, boundary):
+        if filename is None:
+            if files:
+                raise ValueError("The form fields have to come before the files.")
+            form.add(path, data)
+            continue
+        if not filename or not path or path.isspace():
+            # unnamed files in the upload batch
+            abort(500)
+        if formats is None:
+            # check the settings before anything is stored
+            formats = get_formats(form)
+            get_conversion_options(form)
+
+        if formats and filename.rsplit(".", 1)[-1] == "mp4":
+            # closed by the upload job once it is done
+            stream = tempfile.TemporaryFile(dir=UPLOAD_SPOOL_DIR)  # pylint: disable=consider-using-with
+            try:
+                digest = write_hashed(data, stream)
+            except ValueError:
+                stream.close()
+                raise
+            stream.seek(0)
+            files.append((path, SpooledFile(stream, filename, path, digest)))
         else:
-            upload_queue[uid][uploaded_file.root_name].remove(path)
+            stored.add(path)
+            if not interactor.upload_stream(path, data).ok:
+                abort(502)
+            # read back with ranged reads, like probing a video for its metadata
+            stream = DCacheFile(interactor, path)
+            files.append((path, FileStorage(stream=stream, filename=filename, name=path)))
+    return form
+
+
+def upload_streamed_file(user):
+    """
+    Upload the files of a request while they are received, see receive_streamed_files.
+    If the upload is rejected, the files streamed to dCache so far are deleted.
+    """
+    files = []
+    stored = set()
+    try:
+        form = receive_streamed_files(files, stored)
+        return start_upload(files, user, form, stored)
+    except (ValueError, HTTPException) as error:
+        for _, file_data in files:
+            file_data.close()
+        for path in stored:
+            interactor.delete_file(path)
+        if isinstance(error, HTTPException):
+            raise
+        return jsonify({"success": False, "message": str(error)}), 400
+
+
+def upload_file():
+    """
+    Upload a file to dCache.
+    The files are spooled and the request returns 202 with the id of the upload job right away,
+    the conversions and uploads run in the background and are reported on the status stream.
+    With stream=true the files are read while they are received instead of being spooled.
+    """
+    # get user id and email
+    user = get_user_by_session()
+    if not user:
+        abort(401)
 
-    upload_queue.pop(uid)
+    if request.args.get("stream", default="false") == "true":
+        return upload_streamed_file(user)
+
+    files = list(request.files.items())
+    if any(file_data.filename is None for _, file_data in files):
+        return "Unnamed files in upload batch", 500
 
-    return "OK", 200
+    return start_upload(spool_files(files), user, request.form)
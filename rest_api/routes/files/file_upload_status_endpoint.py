@@ -1,34 +1,71 @@
 """Send SSE for upload progress"""
 
-from flask import Response
-from .file_upload_endpoint import finished_uploads
+import json
+
+from flask import Response, stream_with_context
+from ...upload_progress import UPLOAD_HEARTBEAT_SECONDS
+from .file_upload_endpoint import progress
 
 def upload_status(uid):
     """
     Create an SSE stream that will send upload complete
     events as the server relays files.
+    The stream waits for updates of the uploads and sends a heartbeat comment
+    when there were none for UPLOAD_HEARTBEAT_SECONDS.
+    The progress is read from the database, so the stream can be served by another
+    replica than the uploads.
     """
 
     def send_events():
+        # the last reported position of every item in the conversion queue
+        positions = {}
+        # the last reported progress of every item that is uploaded
+        transfers = {}
+        version = None
         # for each user send updates as the files finish
-        while uid in finished_uploads:
-            keys_to_remove = []
-            # check if the files are done uploading
-            for path in finished_uploads[uid]:
-                if finished_uploads[uid][path]:
-                    keys_to_remove.append(path)
-                    # send the update
-                    yield f"data: {path}\n\n"
-            # cleanup the queues
-            for path in keys_to_remove:
-                if len(finished_uploads[uid]) == 1:
-                    finished_uploads.pop(uid)
-                else:
-                    finished_uploads[uid].pop(path)
+        while True:
+            seen = version
+            version = progress.wait(uid, seen, timeout=UPLOAD_HEARTBEAT_SECONDS)
+            if version is None:
+                # the user has no uploads left
+                break
+            # the table is also read when the wait timed out, so changes whose notification
+            # was lost, or that were made without Postgres, are sent at the next heartbeat
+            # report the items whose position in the conversion queue changed,
+            # with position 0 once their conversion started
+            for path, position in progress.get_positions(uid).items():
+                if positions.get(path) != position:
+                    report = json.dumps({"path": path, **position})
+                    yield f"event: queue\ndata: {report}\n\n"
+                    positions[path] = position
+            # report the bytes and frames of the items that changed since their last report
+            for path, transfer in progress.get_transfers(uid).items():
+                if transfers.get(path) != transfer:
+                    report = json.dumps({"path": path, **transfer})
+                    yield f"event: progress\ndata: {report}\n\n"
+                    transfers[path] = transfer
+            # send the items that are done uploading
+            for path, error, dropped, job_id in progress.pop_finished(uid):
+                positions.pop(path, None)
+                transfers.pop(path, None)
+                # report why the upload of the item failed
+                if error is not None:
+                    report = json.dumps({"path": path, "message": error, "job_id": job_id})
+                    yield f"event: error\ndata: {report}\n\n"
+                # report the near duplicate frames dropped from the conversions
+                if dropped is not None:
+                    report = json.dumps({"path": path, "dropped_frames": dropped, "job_id": job_id})
+                    yield f"event: report\ndata: {report}\n\n"
+                # send the update
+                yield f"data: {path}\n\n"
+            if version == seen:
+                # keep the connection open through proxies while nothing happens
+                yield ": heartbeat\n\n"
 
     # return sse's and keep connenction open
     return Response(
-        send_events(),
+        # the app context is kept for the database queries of the stream
+        stream_with_context(send_events()),
         mimetype="text/event-stream",
         headers={"Content-Encoding": "none"},
     )
@@ -0,0 +1,105 @@
+"""
+Endpoints to extract frames from a video stored in dCache
+"""
+
+import zipstream
+
+from flask import Response, request, jsonify, abort
+from ...dcache_file import DCacheFile
+from ...frame_extractor import FrameExtractor
+from ...models import file, tag
+from ...lib.user_utils import get_user_by_session
+from ...lib.file_conversion_utils import is_convertible
+from .interactor import interactor
+
+# the largest number of frames that can be extracted in one request
+MAX_BATCH_FRAMES = 256
+
+# shared by all requests, so they share the cache of decoded frames
+extractor = FrameExtractor()
+
+
+def get_video(file_id):
+    """
+    Get a stored mp4 file the user has access to.
+    """
+    video = file.File.query.get_or_404(file_id)
+
+    # get the user
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+    user_tag = tag.Tag.query.filter_by(name=user.email).first()
+
+    # make sure user has access to file
+    if user_tag not in video.tags:
+        abort(401)
+
+    # frames can only be extracted from videos
+    if not is_convertible(video):
+        abort(400)
+
+    return video
+
+
+def extract_frames(video, indices):
+    """
+    Extract frames from a video as JPEGs, only reading the parts of the video in dCache
+    that are needed to decode them.
+    """
+    try:
+        return extractor.get_frames(
+            # the id changes when a video is uploaded again at the same path
+            f"{video.id}:{video.index}",
+            lambda: DCacheFile(interactor, video.index[1:]),
+            indices,
+        )
+    except (IndexError, FileNotFoundError):
+        # the frame or the video does not exist
+        return abort(404)
+    except ValueError:
+        # the index of a frame does not tell its timestamp with a variable frame rate
+        return abort(400)
+
+
+def fetch_frame(file_id, frame_index):
+    """
+    Fetch a single frame of a video as JPEG.
+    """
+    video = get_video(file_id)
+    jpeg = extract_frames(video, [frame_index])[0]
+    return Response(jpeg, content_type="image/jpeg")
+
+
+def fetch_frames(file_id):
+    """
+    Fetch a batch of frames of a video as a zip file of JPEGs.
+    Optional parameters:
+    - start: the index of the first frame (default is 0)
+    - count: the number of frames (default is 1, at most 256)
+    - step: the distance between the indices of the frames (default is 1)
+    """
+    video = get_video(file_id)
+
+    start = request.args.get("start", type=int, default=0)
+    count = request.args.get("count", type=int, default=1)
+    step = request.args.get("step", type=int, default=1)
+
+    # Check if the range is valid
+    if start < 0 or count < 1 or count > MAX_BATCH_FRAMES or step < 1:
+        return jsonify({"success": False, "message": "Invalid frame range."}), 400
+
+    indices = range(start, start + count * step, step)
+    jpegs = extract_frames(video, indices)
+
+    # the frames are already compressed, so they are stored as they are
+    zip_stream = zipstream.ZipFile(mode="w", compression=zipstream.ZIP_STORED)
+    for index, jpeg in zip(indices, jpegs):
+        zip_stream.write_iter(f"frame_{index:06d}.jpeg", [jpeg])
+
+    file_name = video.index[1:].rsplit("/", 1)[-1].rsplit(".", 1)[0]
+    response = Response(zip_stream, content_type="application/zip")
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename={file_name}_frames_{start}.zip"
+    )
+    return response
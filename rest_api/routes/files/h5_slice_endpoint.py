@@ -0,0 +1,181 @@
+"""
+Endpoint to read slices of datasets of an h5 file in dCache
+"""
+
+import io
+
+import cv2
+import numpy as np
+import zipstream
+
+from flask import Response, request, jsonify, abort
+from ...dcache_file import DCacheFile
+from ...h5_slicer import H5_BLOCK_SIZE, parse_selection, read_slice
+from ...h5_staging import staging_files
+from ...models import file, tag
+from ...lib.user_utils import get_user_by_session
+from .file_upload_endpoint import converter
+from .interactor import interactor
+
+# pylint: disable=no-member
+# This should be ignored because pylint insists that imencode doesn't exist yet it does.
+
+
+def encode_images(data):
+    """
+    Encode a slice of a numeric dataset as JPEGs.
+    A slice of shape (height, width) or (height, width, channels) is a single image,
+    one with an extra first axis is a list of images.
+    """
+    if data.ndim == 2 or (data.ndim == 3 and data.shape[-1] in (1, 3, 4)):
+        data = data[np.newaxis]
+    if data.ndim not in (3, 4):
+        raise ValueError("the slice is not an image")
+    jpegs = []
+    for img in data:
+        success, buffer = cv2.imencode(".jpg", np.ascontiguousarray(img))
+        if not success:
+            raise ValueError("the slice is not an image")
+        jpegs.append(buffer.tobytes())
+    return jpegs
+
+
+def encode_npy(frames, data):
+    """
+    Encode a slice as npy file, JPEG frames are decoded to a (frames, height, width, 3) array.
+    """
+    if frames is not None:
+        # frames of one conversion all have the same size
+        return converter.jpeg_to_npy(frames).getvalue()
+    npy_buffer = io.BytesIO()
+    np.save(npy_buffer, data)
+    return npy_buffer.getvalue()
+
+
+def jpeg_response(jpegs, file_name):
+    """
+    Respond with a single JPEG, or a zip file of JPEGs if there are more.
+    """
+    if len(jpegs) == 1:
+        return Response(jpegs[0], content_type="image/jpeg")
+
+    # the images are already compressed, so they are stored as they are
+    zip_stream = zipstream.ZipFile(mode="w", compression=zipstream.ZIP_STORED)
+    for i, jpeg in enumerate(jpegs):
+        zip_stream.write_iter(f"{i:06d}.jpeg", [jpeg])
+
+    response = Response(zip_stream, content_type="application/zip")
+    response.headers["Content-Disposition"] = f"attachment; filename={file_name}_slice.zip"
+    return response
+
+
+def source_opener(user_tag):
+    """
+    Get the function that opens the sources of a virtual dataset from dCache,
+    only allowing sources the user has access to.
+    """
+
+    def open_source(file_name):
+        source = file.File.query.filter_by(index=f"/{file_name.lstrip('/')}").first()
+        if source is None or user_tag not in source.tags:
+            raise PermissionError(file_name)
+        return DCacheFile(interactor, source.index[1:], block_size=H5_BLOCK_SIZE)
+
+    return open_source
+
+
+def slice_response(open_file, file_name, open_source=None, swmr=False):
+    """
+    Read the slice of an h5 file requested by the query parameters and respond with it.
+    The file is opened by open_file, a function without arguments returning its path or
+    file-like object, so a file that does not exist is reported as not found.
+    """
+    dataset = request.args.get("dataset", default="jpeg_images")
+    output_format = request.args.get("format", default="npy")
+    if output_format not in ("npy", "jpeg"):
+        return jsonify({"success": False, "message": "Invalid format."}), 400
+    try:
+        selection = parse_selection(request.args.get("slice", default=""))
+    except ValueError:
+        return jsonify({"success": False, "message": "Invalid slice."}), 400
+
+    try:
+        frames, data = read_slice(
+            open_file(), dataset, selection, open_source=open_source, swmr=swmr
+        )
+        if output_format == "npy":
+            return Response(
+                encode_npy(frames, data), content_type="application/octet-stream"
+            )
+        jpegs = frames if frames is not None else encode_images(data)
+    except PermissionError:
+        # a virtual dataset refers to a file the user has no access to
+        abort(401)
+    except (FileNotFoundError, KeyError):
+        # the file or the dataset does not exist
+        return jsonify({"success": False, "message": "Dataset not found."}), 404
+    except (ValueError, IndexError, TypeError, OSError) as e:
+        # the selection does not fit the dataset, is too large, or the file is not an h5 file
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    return jpeg_response(jpegs, file_name)
+
+
+def fetch_h5_slice(file_id):
+    """
+    Fetch a slice of a dataset of an h5 file.
+    Only the blocks of the file holding the selected elements are read from dCache,
+    virtual datasets are read from the blocks of their sources.
+    Optional parameters:
+    - dataset: the path of the dataset in the file (default is jpeg_images)
+    - slice: the selection as NumPy slices like 10:20 or 0:100:10,0:3 (default is everything)
+    - format: npy or jpeg (default is npy)
+    """
+    h5_file = file.File.query.get_or_404(file_id)
+
+    # get the user
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+    user_tag = tag.Tag.query.filter_by(name=user.email).first()
+
+    # make sure user has access to file
+    if user_tag not in h5_file.tags:
+        abort(401)
+
+    if h5_file.type != "file" or not h5_file.index.lower().endswith(".h5"):
+        return jsonify({"success": False, "message": "The file is not an h5 file."}), 400
+
+    return slice_response(
+        lambda: DCacheFile(interactor, h5_file.index[1:], block_size=H5_BLOCK_SIZE),
+        h5_file.index[1:].rsplit("/", 1)[-1].rsplit(".", 1)[0],
+        open_source=source_opener(user_tag),
+    )
+
+
+def fetch_staged_h5_slice():
+    """
+    Fetch a slice of the h5 conversion of a video the user is uploading with stream_h5,
+    before the upload is done. Only the frames converted so far can be read.
+    The staging file is local to the process converting the video, so the request has to reach
+    the replica of the API that runs the upload.
+    Parameters:
+    - path: the path of the h5 file the upload creates, like vid.h5
+    - slice and format: the same as when fetching a slice of a stored h5 file
+    """
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+
+    path = request.args.get("path", default="")
+    # only the uploading user can read the staging file,
+    # which is kept until the slice is read even if the upload finishes meanwhile
+    with staging_files.read(f"/{path.lstrip('/')}", user.id) as staged:
+        if staged is None:
+            return jsonify(
+                {"success": False, "message": "The file is not being converted."}
+            ), 404
+
+        return slice_response(
+            lambda: staged, path.rsplit("/", 1)[-1].rsplit(".", 1)[0], swmr=True
+        )
@@ -0,0 +1,144 @@
+"""
+Endpoints to upload a large file in chunks that can be resumed after an interruption
+"""
+
+from flask import request, jsonify, abort
+from werkzeug.datastructures import FileStorage
+from ...lib.resumable_upload_utils import (
+    RESUMABLE_CHUNK_BYTES,
+    ChunkError,
+    append_chunk,
+    create_upload,
+    get_upload,
+    open_upload,
+    remove_upload,
+)
+from ...lib.user_utils import get_user_by_session
+from .file_upload_endpoint import start_upload
+
+
+def get_user_upload(upload_id):
+    """
+    Get the user of the session and their upload, aborts if there is none.
+    """
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+    upload = get_upload(upload_id, user.id)
+    if upload is None:
+        abort(404)
+    return user, upload
+
+
+def create_resumable_upload():
+    """
+    Start a resumable upload of a file.
+    Parameters:
+    - path: the path the file is stored at, like vid.mp4 or dir/vid.mp4
+    - size: the size of the file in bytes
+    """
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+
+    path = request.form.get("path", default="").strip("/")
+    size = request.form.get("size", type=int)
+    # malformed request
+    if not path or not path.rsplit("/", 1)[-1].strip() or size is None or size < 0:
+        return jsonify({"success": False, "message": "Invalid path or size."}), 400
+
+    upload_id = create_upload(user.id, path, size)
+    return jsonify(
+        {"success": True, "upload_id": upload_id, "chunk_size": RESUMABLE_CHUNK_BYTES}
+    ), 201
+
+
+def fetch_resumable_upload(upload_id):
+    """
+    Get the byte ranges of a resumable upload that are received and confirmed,
+    an interrupted upload continues at the end of the last range.
+    """
+    _, upload = get_user_upload(upload_id)
+    received = upload["received"]
+    return jsonify(
+        {
+            "success": True,
+            "path": upload["path"],
+            "size": upload["size"],
+            "offset": received,
+            "ranges": [[0, received]] if received else [],
+        }
+    )
+
+
+def upload_chunk(upload_id):
+    """
+    Append a chunk to a resumable upload, the body of the request is the chunk.
+    Parameters:
+    - offset: the position of the chunk in the file, the number of bytes received so far
+    - X-Chunk-SHA256 header: the sha256 hex digest of the chunk
+    """
+    get_user_upload(upload_id)
+
+    offset = request.args.get("offset", type=int)
+    checksum = request.headers.get("X-Chunk-SHA256")
+    if offset is None or not checksum:
+        return jsonify({"success": False, "message": "Missing offset or checksum."}), 400
+
+    try:
+        received = append_chunk(upload_id, offset, request.stream, checksum)
+    except ChunkError as e:
+        # the chunk is dropped, the client continues at the returned offset
+        code = 409 if offset != e.offset else 400
+        return jsonify({"success": False, "message": str(e), "offset": e.offset}), code
+
+    return jsonify({"success": True, "offset": received})
+
+
+def commit_resumable_upload(upload_id):
+    """
+    Finish a resumable upload once all its bytes are received, and convert, store and register
+    the file like a normal upload.
+    Parameters: the format, conversion options and tags[] of a normal upload.
+    """
+    user, upload = get_user_upload(upload_id)
+    if upload["received"] != upload["size"]:
+        return jsonify(
+            {
+                "success": False,
+                "message": "The upload is not complete.",
+                "offset": upload["received"],
+            }
+        ), 409
+
+    try:
+        data_file = open_upload(upload_id)
+    except FileNotFoundError:
+        abort(404)
+    except BlockingIOError:
+        return jsonify(
+            {"success": False, "message": "The upload is already being committed."}
+        ), 409
+
+    path = upload["path"]
+    file_data = FileStorage(
+        stream=data_file, filename=path.rsplit("/", 1)[-1], name=path
+    )
+    try:
+        response = start_upload([(path, file_data)], user, request.form)
+    except Exception:
+        # the upload is kept, so the commit can be retried, like with other settings
+        data_file.close()
+        raise
+    # the job reads the data from the open file, so the upload can be dropped
+    remove_upload(upload_id)
+    return response
+
+
+def delete_resumable_upload(upload_id):
+    """
+    Cancel a resumable upload and drop the bytes received so far.
+    """
+    get_user_upload(upload_id)
+    remove_upload(upload_id)
+    return jsonify({"success": True})
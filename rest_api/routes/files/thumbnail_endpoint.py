@@ -0,0 +1,130 @@
+"""
+Endpoint to fetch a thumbnail of a file or folder in dcache
+"""
+
+import re
+
+from flask import Response, request, jsonify, abort
+from ...dcache_file import DCacheFile
+from ...models import file, tag
+from ...lib.user_utils import get_user_by_session
+from ...lib.jpeg_layout_utils import list_files
+from ...thumbnailer import (
+    Thumbnailer,
+    contact_sheet,
+    h5_contact_sheet,
+    image_thumbnail,
+    sample_indices,
+)
+from .frame_endpoints import extractor
+from .interactor import interactor
+
+# extensions of the files that are shown as image
+IMAGE_EXTENSIONS = ["jpeg", "jpg", "png", "bmp", "webp", "tif", "tiff"]
+
+# how long browsers may reuse a thumbnail in seconds, a year, as the file of an id does not change
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
+
+# shared by all requests, so they share the worker pool and the cache
+thumbnailer = Thumbnailer()
+
+
+def frame_number(path):
+    """
+    Get the last number in the name of a file, so frame_10 is sorted after frame_9.
+    """
+    numbers = re.findall(r"\d+", path.rsplit("/", 1)[-1])
+    return int(numbers[-1]) if numbers else -1
+
+
+def folder_contact_sheet(path):
+    """
+    Create a contact sheet of images sampled from a folder, like the output of the jpeg conversion.
+    """
+    images = sorted(
+        (
+            image_path
+            for image_path in list_files(path)
+            if image_path.rsplit(".", 1)[-1].lower() in IMAGE_EXTENSIONS
+        ),
+        key=frame_number,
+    )
+    # only the sampled images are downloaded
+    return contact_sheet(
+        [interactor.get_file(images[i][1:]).content for i in sample_indices(len(images))]
+    )
+
+
+def get_thumbnail_generator(file_to_preview):
+    """
+    Get the function that creates the thumbnail of a file, None if the file has no thumbnail.
+    The function only uses values copied from the file, as it runs outside of the request.
+    """
+    path = file_to_preview.index[1:]
+    extension = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+
+    if file_to_preview.type == "directory":
+        return lambda: folder_contact_sheet(path)
+
+    if extension == "mp4":
+        # a frame a tenth into the video, the first frames are often black
+        poster_index = (file_to_preview.frame_count or 0) // 10
+        video_key = f"{file_to_preview.id}:{file_to_preview.index}"
+        return lambda: image_thumbnail(
+            extractor.get_frames(
+                video_key,
+                lambda: DCacheFile(interactor, path),
+                [poster_index],
+                # any frame near the index is a good poster
+                exact=False,
+            )[0]
+        )
+
+    if extension == "h5":
+        return lambda: h5_contact_sheet(DCacheFile(interactor, path))
+
+    if extension in IMAGE_EXTENSIONS:
+        return lambda: image_thumbnail(interactor.get_file(path).content)
+
+    return None
+
+
+def fetch_thumbnail(file_id):
+    """
+    Fetch a thumbnail of a file as JPEG.
+    Images are scaled down, videos show a poster frame,
+    and h5 files and folders show a contact sheet of sampled frames.
+    """
+    # get the file to preview
+    file_to_preview = file.File.query.get_or_404(file_id)
+
+    # get the user
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+    user_tag = tag.Tag.query.filter_by(name=user.email).first()
+
+    # make sure user has access to file
+    if user_tag not in file_to_preview.tags:
+        abort(401)
+
+    generate = get_thumbnail_generator(file_to_preview)
+    if generate is None:
+        return jsonify({"success": False, "message": "The file has no thumbnail."}), 404
+
+    try:
+        thumbnail, etag = thumbnailer.get(
+            f"{file_to_preview.id}:{file_to_preview.index}", generate
+        )
+    except (ValueError, KeyError, IndexError, OSError):
+        # the file is not readable as its type
+        return jsonify(
+            {"success": False, "message": "The thumbnail could not be created."}
+        ), 404
+
+    response = Response(thumbnail, content_type="image/jpeg")
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    # answer with 304 if the browser already has this thumbnail
+    return response.make_conditional(request)
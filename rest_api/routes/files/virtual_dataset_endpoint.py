@@ -0,0 +1,94 @@
+"""Endpoint to combine h5 files stored in dCache into a virtual dataset"""
+
+from flask import request, jsonify, abort
+from ...dcache_file import DCacheFile
+from ...h5_slicer import H5_BLOCK_SIZE
+from ...models import file, tag, db
+from ...lib.user_utils import get_user_by_session
+from ...virtual_dataset import build_virtual_dataset, read_layout
+from .interactor import interactor
+
+
+def create_virtual_dataset():
+    """
+    Create an h5 file with a virtual dataset that concatenates the datasets of stored h5 files.
+    Only the mapping to the sources is written to dCache, no frames are copied, so the file is
+    created in about the time it takes to read the headers of the sources.
+
+    The form data takes the fields:
+    - file: the id of a source h5 file, given once per source in the order of concatenation
+    - name: the name of the new file, it is stored at the root and has to end with .h5
+    - dataset: the path of the dataset in the sources (default is jpeg_images)
+    - tags[]: the ids of tags to assign besides the tag of the user
+    """
+    # get the user tag
+    user = get_user_by_session()
+    if not user:
+        abort(401)
+    user_tag = tag.Tag.query.filter_by(name=user.email).first()
+
+    name = request.form.get("name", default="")
+    dataset_name = request.form.get("dataset", default="jpeg_images")
+    source_ids = request.form.getlist("file")
+    if not name.endswith(".h5") or "/" in name or not source_ids:
+        return jsonify(
+            {"success": False, "message": "A name ending with .h5 and sources are required."}
+        ), 400
+    if file.File.query.filter_by(index=f"/{name}").first() is not None:
+        return jsonify({"success": False, "message": "The file already exists."}), 400
+
+    sources = []
+    for source_id in source_ids:
+        source = file.File.query.get_or_404(source_id)
+
+        # make sure user has access to every source
+        if user_tag is None or user_tag not in source.tags:
+            abort(401)
+        if source.type != "file" or not source.index.lower().endswith(".h5"):
+            return jsonify(
+                {"success": False, "message": "Only h5 files can be combined."}
+            ), 400
+        sources.append(source)
+
+    try:
+        # only the headers of the sources are read to get the shapes of their datasets
+        layouts = [
+            (
+                source.index[1:],
+                *read_layout(
+                    DCacheFile(interactor, source.index[1:], block_size=H5_BLOCK_SIZE),
+                    dataset_name,
+                ),
+            )
+            for source in sources
+        ]
+        h5_file = build_virtual_dataset(layouts, dataset_name)
+    except (FileNotFoundError, KeyError):
+        return jsonify(
+            {"success": False, "message": "A source or its dataset does not exist."}
+        ), 404
+    except (ValueError, OSError) as e:
+        # the datasets have different shapes or types, or a source is not an h5 file
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    response = interactor.upload_file(name, h5_file)
+    if not response.ok:
+        abort(500)
+
+    tags = tag.Tag.query.filter(tag.Tag.id.in_(request.form.getlist("tags[]"))).all()
+    tags.append(user_tag)
+    virtual_file = file.File(index=f"/{name}", type="file", tags=tags)
+    db.session.add(virtual_file)
+    db.session.commit()
+
+    return jsonify(
+        {
+            "success": True,
+            "message": "Virtual dataset created successfully.",
+            "file": {
+                "id": virtual_file.id,
+                "index": virtual_file.index,
+                "type": virtual_file.type,
+            },
+        }
+    )
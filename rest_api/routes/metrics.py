@@ -0,0 +1,11 @@
+"""This module defines the route exposing the metrics of the application."""
+
+from flask import jsonify
+from ..lib.metrics import get_metrics
+
+
+def metrics():
+    """
+    Returns the counters of the application, like the conversion cache hit rate.
+    """
+    return jsonify(get_metrics()), 200
@@ -6,6 +6,7 @@ from flask import request, jsonify
 from ...models import db, image
 from ...lib.tasks_creation_external_utils import prepare_input_directory_and_token, fill_token_couchdb
 from ...lib.tasks_creation_postgres_utils import get_image_url, check_image_access, add_to_postgres
+from ..files.file_upload_endpoint import SINGLE_FILE_CONVERSIONS, DIRECTORY_CONVERSIONS
 
 
 def create_task():
@@ -24,6 +25,8 @@ def create_task():
     image_name = data["image"]
     parameters = data["parameters"]
     tag_names = data["tags"]
+    # optional format mp4 inputs are converted to before staging
+    input_format = data.get("format")
 
     if isinstance(data["input"], str):
         input_files = [data["input"]]
@@ -51,7 +54,7 @@ def create_task():
         return jsonify({"success": False, "message": "Parameters are not valid."}), 406
 
     # Copy files to directory and create empty token in Couchdb
-    token_id = prepare_input_directory_and_token(input_files)
+    token_id = prepare_input_directory_and_token(input_files, input_format)
 
     # submit task to couchdb so PiCaS can run it
     fill_token_couchdb(token_id, container_path, parameters)
@@ -74,8 +77,16 @@ def data_is_valid(data):
     # the data must contain a (possibly empty) field for parameters and tags
     not_params_tags = not ("parameters" in data and "tags" in data)
 
-    # the length must be 5 and all data must be specified
-    if not_required_values or len(data) != 5 or not_params_tags:
+    # the format is optional, but must be a known conversion
+    has_format = "format" in data
+    if has_format and (
+        data["format"] not in SINGLE_FILE_CONVERSIONS
+        and data["format"] not in DIRECTORY_CONVERSIONS
+    ):
+        return False
+
+    # the length must be 5, or 6 with a format, and all data must be specified
+    if not_required_values or len(data) != 5 + has_format or not_params_tags:
         return False
 
     # check if the name length is valid
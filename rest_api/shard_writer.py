@@ -0,0 +1,149 @@
+"""
+Defines writing tar shards of the frames of a video while it is decoded.
+"""
+
+import json
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+from .file_converter import tar_end, tar_member, tar_member_size
+
+# number of frames that wait for the upload of a shard, before the decoder waits for the upload
+SHARD_QUEUE_FRAMES = int(os.environ.get("SHARD_QUEUE_FRAMES", 32))
+
+# seconds the decoder waits for room in the queue before it checks whether the upload failed
+PUT_TIMEOUT = 1
+
+# ends the frames of a shard in the queue
+END_OF_SHARD = None
+
+# ends the frames of a shard that is not complete, so its upload fails instead of storing it
+ABORTED = object()
+
+
+def iter_chunks(frames):
+    """
+    Iterate over the tar blocks of the frames of a shard from its queue, until the shard ends.
+
+    :param frames:  queue of the blocks of every frame as lists of bytes-like objects
+    :raises OSError: if the shard is aborted
+    """
+    while (chunks := frames.get()) is not END_OF_SHARD:
+        if chunks is ABORTED:
+            raise OSError("the shard was aborted")
+        yield from chunks
+
+
+class ShardWriter:
+    """
+    Writes JPEG frames to size targeted tar shards while they are decoded, with the same layout
+    and content as FileConverter.jpeg_to_shards, streaming every shard to storage as its frames
+    arrive instead of building it in memory.
+
+    A shard is stored by the upload function on a thread of its own, which reads the blocks of
+    the frames from a bounded queue, so a slow upload holds the decoder back instead of piling up
+    frames. One shard is uploaded at a time, the next one is started once it is stored.
+    """
+
+    def __init__(self, upload, shard_size, queue_frames=SHARD_QUEUE_FRAMES):
+        """
+        :param upload:          function storing a shard, called with its name, like
+                                shard_000000.tar, and an iterator over its content as bytes-like
+                                objects, which raises OSError if the shard is aborted
+        :param shard_size:      targeted size of a shard in bytes, a shard only
+                                exceeds it if a single frame is larger
+        :param queue_frames:    number of frames that wait for the upload at most
+        """
+        self.upload = upload
+        self.shard_size = shard_size
+        self.queue_frames = queue_frames
+        # name and number of frames of every stored shard, in order
+        self.shards = []
+        self.frames = 0
+        # name, queue, upload future, size and number of frames of the shard being uploaded
+        self.current = None
+
+    @property
+    def index(self):
+        """The index of the stored shards, listing their names and number of frames."""
+        return {"shards": self.shards}
+
+    def append(self, jpeg, metadata=None):
+        """
+        Add a frame with its metadata, like its timestamp,
+        finishing the current shard first if the frame would push it over the targeted size.
+        """
+        i = self.frames
+        sample = json.dumps({"frame": i, **(metadata or {})}).encode()
+        sample_size = tar_member_size(len(jpeg)) + tar_member_size(len(sample))
+        if self.current is not None and self.current["size"] + sample_size > self.shard_size:
+            self.finish_shard()
+        if self.current is None:
+            self.start_shard()
+
+        # the frame is copied, as the batch it is taken from grows while it waits in the queue
+        self.put(
+            tar_member(f"frame_{i:06d}.jpg", bytes(jpeg))
+            + tar_member(f"frame_{i:06d}.json", sample)
+        )
+        self.current["size"] += sample_size
+        self.current["samples"] += 1
+        self.frames += 1
+
+    def start_shard(self):
+        """Start the upload of the next shard on a thread of its own."""
+        name = f"shard_{len(self.shards):06d}.tar"
+        frames = queue.Queue(maxsize=self.queue_frames)
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self.upload(name, iter_chunks(frames)))
+            except BaseException as error:  # pylint: disable=broad-exception-caught
+                future.set_exception(error)
+
+        threading.Thread(target=run, daemon=True).start()
+        self.current = {"name": name, "frames": frames, "future": future, "size": 0, "samples": 0}
+
+    def put(self, item):
+        """
+        Queue the blocks of a frame or the end of the shard for the upload of the current shard.
+
+        :raises OSError: if the upload stopped reading the shard, or the error of the upload
+        """
+        while True:
+            try:
+                self.current["frames"].put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                if self.current["future"].done():
+                    # raises the error of the upload, if it has one
+                    self.current["future"].result()
+                    raise OSError(f"the upload of {self.current['name']} stopped") from None
+
+    def finish_shard(self):
+        """End the current shard and wait until it is stored."""
+        self.put([tar_end(self.current["size"])])
+        self.put(END_OF_SHARD)
+        self.current["future"].result()
+        self.shards.append({"name": self.current["name"], "samples": self.current["samples"]})
+        self.current = None
+
+    def close(self):
+        """Finish the last shard, once all frames are added."""
+        if self.current is not None:
+            self.finish_shard()
+
+    def abort(self):
+        """Abort the upload of the current shard, like when the video can not be decoded."""
+        if self.current is None:
+            return
+        try:
+            self.put(ABORTED)
+            self.current["future"].exception()
+        except OSError:
+            # the upload already failed
+            pass
+        self.current = None
@@ -0,0 +1,187 @@
+"""
+Defines the generation and caching of thumbnails of stored files.
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import h5py
+import numpy as np
+
+# pylint: disable=no-member
+# This should be ignored because pylint insists that the cv2 functions don't exist yet they do.
+
+# the largest width and height of a thumbnail in pixels
+THUMBNAIL_SIZE = 256
+# number of frames in a row and column of a contact sheet
+CONTACT_SHEET_GRID = 3
+# quality of the JPEG encoding of thumbnails
+THUMBNAIL_QUALITY = 80
+
+# number of threads generating thumbnails
+THUMBNAIL_WORKERS = int(os.environ.get("THUMBNAIL_WORKERS", 4))
+# total size of the thumbnails that are kept in memory, 64 MB
+THUMBNAIL_CACHE_BYTES = int(os.environ.get("THUMBNAIL_CACHE_BYTES", 64 * 1024**2))
+
+
+def fit(img, size):
+    """
+    Resize an image to fit in a square, keeping its aspect ratio.
+
+    :param img:     image as NumPy array
+    :param size:    width and height of the square
+    :return:        the resized image
+    """
+    height, width = img.shape[:2]
+    scale = size / max(height, width)
+    if scale >= 1:
+        return img
+    new_size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, new_size, interpolation=cv2.INTER_AREA)
+
+
+def decode_image(data):
+    """
+    Decode an encoded image, like a JPEG.
+
+    :param data:        the encoded image as bytes-like object
+    :return:            the image as BGR NumPy array
+    :raises ValueError: if the data is not an image
+    """
+    img = cv2.imdecode(np.frombuffer(data, dtype="uint8"), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError("the data is not an image")
+    return img
+
+
+def encode_thumbnail(img):
+    """
+    Encode a thumbnail as JPEG.
+
+    :param img:     image as BGR NumPy array
+    :return:        the JPEG file as bytes
+    """
+    success, buffer = cv2.imencode(
+        ".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY]
+    )
+    if not success:
+        raise ValueError("the thumbnail could not be encoded")
+    return buffer.tobytes()
+
+
+def image_thumbnail(data):
+    """
+    Create a thumbnail of an encoded image, like a file or a frame of a video.
+
+    :param data:    the encoded image as bytes-like object
+    :return:        the thumbnail as JPEG bytes
+    """
+    return encode_thumbnail(fit(decode_image(data), THUMBNAIL_SIZE))
+
+
+def sample_indices(count, samples=CONTACT_SHEET_GRID**2):
+    """
+    Get evenly spread indices of items to show on a contact sheet.
+
+    :param count:   the number of items
+    :param samples: the largest number of indices
+    :return:        list of indices
+    """
+    if count <= samples:
+        return list(range(count))
+    return [int(i) for i in np.linspace(0, count - 1, samples).round()]
+
+
+def contact_sheet(images):
+    """
+    Create a thumbnail that shows multiple images in a grid.
+
+    :param images:  list of encoded images as bytes-like objects, at most the size of the grid
+    :return:        the contact sheet as JPEG bytes
+    """
+    if not images:
+        raise ValueError("a contact sheet needs at least one image")
+    tile = THUMBNAIL_SIZE // CONTACT_SHEET_GRID
+    rows = -(-len(images) // CONTACT_SHEET_GRID)
+    sheet = np.zeros((rows * tile, CONTACT_SHEET_GRID * tile, 3), dtype="uint8")
+    for i, data in enumerate(images):
+        img = fit(decode_image(data), tile)
+        # center every image in its tile
+        top = (i // CONTACT_SHEET_GRID) * tile + (tile - img.shape[0]) // 2
+        left = (i % CONTACT_SHEET_GRID) * tile + (tile - img.shape[1]) // 2
+        sheet[top : top + img.shape[0], left : left + img.shape[1]] = img
+    return encode_thumbnail(sheet)
+
+
+def h5_contact_sheet(h5_file):
+    """
+    Create a contact sheet of frames sampled from an h5 file created by the h5 conversion.
+
+    :param h5_file: the h5 file as seekable file-like object, only the sampled frames are read
+    :return:        the contact sheet as JPEG bytes
+    """
+    with h5py.File(h5_file, "r") as h5:
+        frames = h5["jpeg_images"]
+        return contact_sheet([frames[i] for i in sample_indices(len(frames))])
+
+
+class Thumbnailer:
+    """
+    Generates thumbnails on a pool of worker threads and keeps them in a LRU cache.
+
+    A thumbnail is generated the first time it is requested, requests for a thumbnail that is
+    being generated wait for the same generation. The cache is bounded by the total size of the
+    thumbnails, so it only holds small objects.
+    """
+
+    def __init__(self, workers=THUMBNAIL_WORKERS, max_bytes=THUMBNAIL_CACHE_BYTES):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.max_bytes = max_bytes
+        # key mapped to (JPEG bytes, ETag), the least recently used first
+        self.thumbnails = OrderedDict()
+        self.cached_bytes = 0
+        # key mapped to the future of a thumbnail that is being generated
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, generate):
+        """
+        Get a thumbnail, generating it if it is not cached.
+
+        :param key:         identifies the thumbnail, it should change when the file does
+        :param generate:    function without arguments that creates the thumbnail as JPEG bytes
+        :return:            (JPEG bytes, ETag)
+        """
+        with self.lock:
+            if key in self.thumbnails:
+                self.thumbnails.move_to_end(key)
+                return self.thumbnails[key]
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pool.submit(generate)
+                self.pending[key] = future
+
+        try:
+            thumbnail = future.result()
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+        etag = hashlib.sha256(thumbnail).hexdigest()[:32]
+        self.add(key, thumbnail, etag)
+        return thumbnail, etag
+
+    def add(self, key, thumbnail, etag):
+        """Cache a thumbnail and evict the least recently used thumbnails."""
+        with self.lock:
+            if key in self.thumbnails:
+                return
+            self.thumbnails[key] = (thumbnail, etag)
+            self.cached_bytes += len(thumbnail)
+            while self.cached_bytes > self.max_bytes and len(self.thumbnails) > 1:
+                evicted, _ = self.thumbnails.popitem(last=False)[1]
+                self.cached_bytes -= len(evicted)
@@ -0,0 +1,551 @@
+"""
+Defines the registry of the progress of uploads that is reported on the status stream.
+
+The items of the uploads are stored in the upload progress table, so the status stream of a user
+can be served by any replica of the API, not only by the one running the upload. Every change is
+announced with a Postgres notification on the upload_progress channel, which a listener thread in
+every process relays to the streams of the user waiting in that process.
+"""
+
+import os
+import select
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, func, or_, text, update
+from .models import db
+from .models.upload_progress import UploadProgress
+
+# seconds a status stream waits for an event before it sends a heartbeat
+UPLOAD_HEARTBEAT_SECONDS = float(os.environ.get("UPLOAD_HEARTBEAT_SECONDS", 15))
+# seconds after which the items of a user that are done but not read by a status stream are dropped
+UPLOAD_PROGRESS_TTL = float(os.environ.get("UPLOAD_PROGRESS_TTL", 3600))
+# seconds after which items that are not done are dropped, like those of a replica that stopped
+UPLOAD_STALE_SECONDS = float(os.environ.get("UPLOAD_STALE_SECONDS", 24 * 3600))
+
+# most progress reports per second of the uploads of a user in a process
+UPLOAD_PROGRESS_RATE = float(os.environ.get("UPLOAD_PROGRESS_RATE", 4))
+# weight of the newest measurement in the smoothed throughput of a transfer
+THROUGHPUT_SMOOTHING = 0.3
+# what the progress of a transfer is measured in
+TRANSFER_UNITS = ("bytes", "frames")
+
+# channel the changes of the progress are announced on, with the id of the user as payload
+NOTIFY_CHANNEL = "upload_progress"
+# seconds the listener waits before it connects again after losing its connection
+LISTEN_RETRY_SECONDS = 5
+
+# the keys of the advisory locks held in the database, by the processes running upload jobs
+HELD_OWNERS_QUERY = """
+SELECT (classid::bigint << 32) | objid::bigint FROM pg_locks
+WHERE locktype = 'advisory' AND objsubid = 1
+AND database = (SELECT oid FROM pg_database WHERE datname = current_database())
+"""
+# why the items of a job are failed whose process stopped
+LOST_MESSAGE = "The upload was lost, as the server running it stopped."
+
+
+class UserProgress:
+    """
+    The state of the uploads of one user that is local to a process.
+    """
+
+    def __init__(self, lock):
+        # path of every file uploaded by this process that is not uploaded yet mapped to its item
+        self.files = {}
+        # item of these files mapped to the number of its files that are not uploaded yet
+        self.remaining = {}
+        # changes with every notification for the user, so a stream knows whether it missed one
+        self.version = 0
+        self.condition = threading.Condition(lock)
+        # item of every upload of this process that is not done mapped to its Transfer
+        self.transfers = {}
+        # time.monotonic() of the last progress report of the user
+        self.reported_at = None
+
+    def update(self):
+        """Wake up the streams waiting for the user."""
+        self.version += 1
+        self.condition.notify_all()
+
+    def add_file(self, path, item):
+        """Add a file that is not uploaded yet, the lock has to be held."""
+        self.remove_file(path)
+        self.files[path] = item
+        self.remaining[item] = self.remaining.get(item, 0) + 1
+
+    def remove_file(self, path):
+        """
+        Remove a file, the lock has to be held.
+
+        :return:    whether it was the last file of its item
+        """
+        if path not in self.files:
+            return False
+        item = self.files.pop(path)
+        self.remaining[item] -= 1
+        if self.remaining[item]:
+            return False
+        del self.remaining[item]
+        return True
+
+
+class Transfer:
+    """
+    The bytes and frames of an item that are transferred, local to the process uploading it.
+    The throughput is measured between two reports and smoothed over the reports.
+    """
+
+    def __init__(self, total_bytes, total_frames=None):
+        # the totals are None if they are not known
+        self.total = {"bytes": total_bytes, "frames": total_frames}
+        self.done = {"bytes": 0, "frames": 0}
+        # units per second, None until it is measured
+        self.rate = {"bytes": None, "frames": None}
+        # what was done at the last report, the time is None until the transfer started
+        self.reported = {"bytes": 0, "frames": 0}
+        self.reported_at = None
+
+    def add(self, count, unit, now):
+        """Add transferred bytes or frames, the first ones start the transfer."""
+        if self.reported_at is None:
+            self.reported_at = now
+        self.done[unit] += count
+
+    def changed(self):
+        """Whether something was transferred since the last report."""
+        return self.done != self.reported
+
+    def measure(self, now):
+        """
+        Measure the throughput since the last report and estimate the time left.
+
+        :param now: the time.monotonic() of the report
+        :return:    the values of the columns of the item
+        """
+        elapsed = now - self.reported_at
+        remaining = []
+        for unit in TRANSFER_UNITS:
+            if elapsed > 0:
+                rate = (self.done[unit] - self.reported[unit]) / elapsed
+                if self.rate[unit] is not None:
+                    rate = (
+                        THROUGHPUT_SMOOTHING * rate
+                        + (1 - THROUGHPUT_SMOOTHING) * self.rate[unit]
+                    )
+                self.rate[unit] = rate
+            if self.total[unit] is not None and self.rate[unit]:
+                remaining.append(
+                    max(self.total[unit] - self.done[unit], 0) / self.rate[unit]
+                )
+        self.reported = dict(self.done)
+        self.reported_at = now
+        return {
+            UploadProgress.bytes_done: self.done["bytes"],
+            UploadProgress.bytes_total: self.total["bytes"],
+            UploadProgress.frames_done: self.done["frames"],
+            UploadProgress.frames_total: self.total["frames"],
+            UploadProgress.bytes_per_second: self.rate["bytes"],
+            UploadProgress.frames_per_second: self.rate["frames"],
+            # the slowest measure decides when the item is done
+            UploadProgress.eta: max(remaining, default=None),
+        }
+
+
+class OwnerLock:
+    """
+    The advisory lock in Postgres a process holds while it runs upload jobs, until it stops.
+    Without Postgres nothing is locked.
+    """
+
+    def __init__(self):
+        # random key that fits the signed bigint of the lock functions
+        self.key = uuid.uuid4().int >> 65
+        # the connection holding the lock, once it is taken
+        self.connection = None
+
+    def hold(self):
+        """Take the lock, if it is not held yet."""
+        if self.connection is not None or db.engine.dialect.name != "postgresql":
+            return
+        connection = db.engine.raw_connection()
+        # the connection holds the lock, so it does not go back to the pool
+        connection.detach()
+        dbapi_connection = connection.dbapi_connection
+        dbapi_connection.autocommit = True
+        dbapi_connection.cursor().execute("SELECT pg_advisory_lock(%s)", (self.key,))
+        self.connection = connection
+
+
+class ProgressRegistry:  # pylint: disable=too-many-public-methods
+    """
+    Keeps track of the items of the uploads of every user, stored in the database.
+
+    An item is a file uploaded on its own, or a directory that is done once all its files are.
+    While an item is uploaded, its transferred bytes and frames are reported with the throughput
+    and the time left, at most UPLOAD_PROGRESS_RATE times per second per user and process.
+    The upload jobs update the items while status streams of the users wait on a condition of
+    their user until a notification for them arrives, so a stream only wakes up when there is
+    something to report. Items are dropped once a stream reported them as done, after the TTL
+    when no stream reads them, or when they are stale.
+
+    The notifications need Postgres, with another database only the streams in the process
+    of the upload are woken up, others see the changes at their next heartbeat.
+    While a process runs upload jobs it holds an advisory lock in Postgres,
+    so the items of the jobs of a process that stopped can be told apart and failed.
+    """
+
+    def __init__(self, ttl=UPLOAD_PROGRESS_TTL, stale=UPLOAD_STALE_SECONDS):
+        self.ttl = ttl
+        self.stale = stale
+        self.lock = threading.Lock()
+        # id of the user mapped to their UserProgress
+        self.users = {}
+        # (user id, item) of the conversions waiting in this process mapped to their position
+        self.positions = {}
+        self.listener = None
+        # held while this process runs upload jobs
+        self.owner = OwnerLock()
+
+    def get_user(self, uid):
+        """Get the local state of a user, the lock has to be held."""
+        if uid not in self.users:
+            self.users[uid] = UserProgress(self.lock)
+        return self.users[uid]
+
+    def notify(self, uid):
+        """Wake up the streams of a user in this process."""
+        with self.lock:
+            if uid in self.users:
+                self.users[uid].update()
+
+    def notify_all(self):
+        """Wake up every stream in this process, like when notifications may have been missed."""
+        with self.lock:
+            for user_progress in self.users.values():
+                user_progress.update()
+
+    def publish(self, uids):
+        """Commit the changes of the items of users and announce them to every process."""
+        if db.engine.dialect.name == "postgresql":
+            for uid in uids:
+                # sent once the transaction is committed
+                db.session.execute(
+                    text("SELECT pg_notify(:channel, :uid)"),
+                    {"channel": NOTIFY_CHANNEL, "uid": str(uid)},
+                )
+        db.session.commit()
+        for uid in uids:
+            self.notify(uid)
+
+    def evict(self):
+        """Drop the items that are done and nobody read within the TTL, and stale items."""
+        now = datetime.now()
+        UploadProgress.query.filter(
+            or_(
+                and_(
+                    UploadProgress.done,
+                    UploadProgress.updated < now - timedelta(seconds=self.ttl),
+                ),
+                UploadProgress.updated < now - timedelta(seconds=self.stale),
+            )
+        ).delete(synchronize_session=False)
+
+    def update_items(self, uid, items, values):
+        """Set values of the items of a user that are not done, without committing them."""
+        values[UploadProgress.updated] = datetime.now()
+        UploadProgress.query.filter(
+            UploadProgress.user_id == uid,
+            UploadProgress.item.in_(items),
+            UploadProgress.done.is_(False),
+        ).update(values, synchronize_session=False)
+
+    def fail_lost(self):
+        """
+        Mark the items that are not done as failed if the process running their job stopped,
+        like the jobs of a replica that was restarted, whose spooled files are gone.
+        Needs Postgres, to see which processes still hold their advisory lock.
+        """
+        if db.engine.dialect.name != "postgresql":
+            return
+        held = db.session.scalars(text(HELD_OWNERS_QUERY)).all()
+        uids = db.session.scalars(
+            update(UploadProgress)
+            .where(
+                UploadProgress.done.is_(False),
+                or_(UploadProgress.owner.is_(None), UploadProgress.owner.notin_(held)),
+            )
+            .values(done=True, message=LOST_MESSAGE, updated=datetime.now())
+            .returning(UploadProgress.user_id)
+        ).all()
+        self.publish(set(uids))
+
+    def add_files(self, uid, files, totals=None, job_id=None):
+        """
+        Add the files of an upload that are not uploaded yet.
+
+        :param uid:     id of the user uploading the files
+        :param files:   list of (path of the file, the item it is reported as)
+        :param totals:  item mapped to its total (bytes, frames) if its progress is reported
+        :param job_id:  id of the upload job, reported with the items
+        """
+        with self.lock:
+            # before the items exist, so they are never taken for those of a stopped process
+            self.owner.hold()
+            user_progress = self.get_user(uid)
+            for path, item in files:
+                user_progress.add_file(path, item)
+            for item, (total_bytes, total_frames) in (totals or {}).items():
+                user_progress.transfers[item] = Transfer(total_bytes, total_frames)
+        self.evict()
+        # the files of a directory are one item
+        for item in dict.fromkeys(item for _, item in files):
+            db.session.add(
+                UploadProgress(user_id=uid, item=item, job_id=job_id, owner=self.owner.key)
+            )
+        self.publish([uid])
+
+    def remove_file(self, uid, path):
+        """
+        Remove a file that has been uploaded.
+
+        :param uid:     id of the user uploading the file
+        :param path:    path of the file
+        :return:        whether it was the last file of its item
+        """
+        with self.lock:
+            user_progress = self.users.get(uid)
+            if user_progress is None:
+                return False
+            return user_progress.remove_file(path)
+
+    def add_dropped(self, uid, item, count):
+        """Add near duplicate frames dropped from the conversions of an item."""
+        self.update_items(
+            uid,
+            [item],
+            {UploadProgress.dropped_frames: func.coalesce(UploadProgress.dropped_frames, 0) + count},
+        )
+        db.session.commit()
+
+    def add_transfer(self, uid, item, count, unit="bytes"):
+        """
+        Add bytes or frames of an item that are transferred. The progress of the items of the user
+        is reported if the last report was long enough ago.
+
+        :param uid:     id of the user uploading the item
+        :param item:    the item
+        :param count:   the number of bytes or frames
+        :param unit:    "bytes" or "frames"
+        """
+        now = time.monotonic()
+        with self.lock:
+            user_progress = self.users.get(uid)
+            if user_progress is None or item not in user_progress.transfers:
+                return
+            user_progress.transfers[item].add(count, unit, now)
+            reported_at = user_progress.reported_at
+            if reported_at is not None and now - reported_at < 1 / UPLOAD_PROGRESS_RATE:
+                return
+            user_progress.reported_at = now
+            changed = {
+                key: transfer.measure(now)
+                for key, transfer in user_progress.transfers.items()
+                if transfer.changed()
+            }
+        for changed_item, values in changed.items():
+            self.update_items(uid, [changed_item], values)
+        self.publish([uid])
+
+    def drop_transfers(self, uid, items):
+        """Stop reporting the progress of items that are done."""
+        with self.lock:
+            user_progress = self.users.get(uid)
+            for item in items if user_progress is not None else []:
+                user_progress.transfers.pop(item, None)
+
+    def finish(self, uid, items):
+        """Mark items of a user as done."""
+        self.drop_transfers(uid, items)
+        self.update_items(uid, items, {UploadProgress.done: True})
+        self.publish([uid])
+
+    def fail(self, uid, items, message):
+        """
+        Mark the items of a failed upload that are not done as failed,
+        and drop their files that are not uploaded.
+
+        :param uid:     id of the user uploading the items
+        :param items:   the items of the upload
+        :param message: why the upload failed
+        """
+        with self.lock:
+            user_progress = self.get_user(uid)
+            for path, item in list(user_progress.files.items()):
+                if item in items:
+                    user_progress.remove_file(path)
+        self.drop_transfers(uid, items)
+        self.update_items(
+            uid, list(items), {UploadProgress.done: True, UploadProgress.message: message}
+        )
+        self.publish([uid])
+
+    def set_positions(self, positions):
+        """
+        Store the positions of the conversions waiting in this process,
+        conversions that are not waiting anymore have started and get position 0.
+
+        :param positions:   (user id, item) mapped to the position in the conversion queue
+        """
+        with self.lock:
+            changed = {
+                key: position
+                for key, position in positions.items()
+                if self.positions.get(key) != position
+            }
+            changed.update({key: 0 for key in self.positions if key not in positions})
+            self.positions = dict(positions)
+        for (uid, item), position in changed.items():
+            self.update_items(uid, [item], {UploadProgress.position: position})
+        if changed:
+            self.publish({uid for uid, _ in changed})
+
+    def get_transfers(self, uid):
+        """
+        Get the progress of the items of a user that are not done and have started.
+
+        :param uid:     id of the user
+        :return:        item mapped to a dict of its bytes and frames done and in total,
+                        the throughput in bytes and frames per second, the seconds left
+                        and the id of its job, unknown values are None
+        """
+        rows = UploadProgress.query.filter(
+            UploadProgress.user_id == uid,
+            UploadProgress.done.is_(False),
+            UploadProgress.bytes_done.isnot(None),
+        ).all()
+        transfers = {
+            row.item: {
+                "bytes": row.bytes_done,
+                "total_bytes": row.bytes_total,
+                "frames": row.frames_done,
+                "total_frames": row.frames_total,
+                "bytes_per_second": row.bytes_per_second,
+                "frames_per_second": row.frames_per_second,
+                "eta": row.eta,
+                "job_id": row.job_id,
+            }
+            for row in rows
+        }
+        # do not keep the transaction open while the stream waits
+        db.session.commit()
+        return transfers
+
+    def get_positions(self, uid):
+        """
+        Get the positions in the conversion queue of the items of a user that are not done.
+
+        :param uid:     id of the user
+        :return:        item mapped to a dict of its position, 0 once its conversion started,
+                        and the id of its job
+        """
+        rows = UploadProgress.query.filter(
+            UploadProgress.user_id == uid,
+            UploadProgress.done.is_(False),
+            UploadProgress.position.isnot(None),
+        ).all()
+        positions = {
+            row.item: {"position": row.position, "job_id": row.job_id} for row in rows
+        }
+        # do not keep the transaction open while the stream waits
+        db.session.commit()
+        return positions
+
+    def listen(self):
+        """Start the thread relaying the notifications to the streams of this process, once."""
+        with self.lock:
+            if self.listener is not None or db.engine.dialect.name != "postgresql":
+                return
+            self.listener = threading.Thread(
+                target=self.relay, args=(db.engine,), daemon=True
+            )
+            self.listener.start()
+
+    def relay(self, engine):
+        """
+        Listen to the notifications of all processes and wake up the streams of their users.
+        After losing the connection it connects again and wakes up every stream,
+        as notifications may have been missed in between.
+        """
+        while True:
+            try:
+                connection = engine.raw_connection()
+                # the connection listens until it fails, so it does not go back to the pool
+                connection.detach()
+                try:
+                    dbapi_connection = connection.dbapi_connection
+                    dbapi_connection.autocommit = True
+                    dbapi_connection.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    self.notify_all()
+                    while True:
+                        select.select([dbapi_connection], [], [], UPLOAD_HEARTBEAT_SECONDS)
+                        dbapi_connection.poll()
+                        while dbapi_connection.notifies:
+                            self.notify(int(dbapi_connection.notifies.pop(0).payload))
+                finally:
+                    connection.close()
+            except Exception:  # pylint: disable=broad-exception-caught
+                # whatever went wrong, the streams have to keep getting notifications
+                time.sleep(LISTEN_RETRY_SECONDS)
+
+    def wait(self, uid, version, timeout=UPLOAD_HEARTBEAT_SECONDS):
+        """
+        Wait until the progress of a user changed since a version, or the timeout passed.
+
+        :param uid:     id of the user
+        :param version: the version the stream has seen, None if it has seen none
+        :param timeout: seconds to wait at most
+        :return:        the current version, the same as the given one after a timeout,
+                        or None if the user has no uploads
+        """
+        self.listen()
+        self.evict()
+        has_items = UploadProgress.query.filter_by(user_id=uid).first() is not None
+        # do not keep the transaction open while the stream waits
+        db.session.commit()
+
+        with self.lock:
+            user_progress = self.get_user(uid)
+            if not has_items:
+                if not user_progress.files:
+                    self.users.pop(uid)
+                return None
+            user_progress.condition.wait_for(
+                lambda: user_progress.version != version, timeout=timeout
+            )
+            return user_progress.version
+
+    def pop_finished(self, uid):
+        """
+        Take the items of a user that are done, in the order they were added.
+        A stream of the user in another process does not get the same items.
+
+        :param uid:     id of the user
+        :return:        list of (item, message of why it failed or None,
+                        number of dropped frames or None, id of its job)
+        """
+        rows = (
+            UploadProgress.query.filter_by(user_id=uid, done=True)
+            .order_by(UploadProgress.id)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        finished = [
+            (row.item, row.message, row.dropped_frames, row.job_id) for row in rows
+        ]
+        for row in rows:
+            db.session.delete(row)
+        db.session.commit()
+        return finished
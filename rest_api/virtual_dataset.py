@@ -0,0 +1,62 @@
+"""
+Defines combining datasets of h5 files into a virtual dataset, without copying their data.
+"""
+
+import io
+
+import h5py
+
+
+def read_layout(h5_file, dataset_name):
+    """
+    Read the shape and type of a dataset of an h5 file, only reading the metadata of the file.
+
+    :param h5_file:         the h5 file as path or seekable file-like object
+    :param dataset_name:    path of the dataset in the file
+    :return:                (shape, dtype) of the dataset
+    :raises KeyError:       if the dataset does not exist
+    """
+    with h5py.File(h5_file, "r") as h5:
+        dataset = h5.get(dataset_name)
+        if not isinstance(dataset, h5py.Dataset):
+            raise KeyError(dataset_name)
+        return dataset.shape, dataset.dtype
+
+
+def build_virtual_dataset(sources, dataset_name):
+    """
+    Build an h5 file with a virtual dataset that concatenates datasets of other h5 files
+    along their first axis. The file only holds the mapping to the sources, which are read
+    when the virtual dataset is.
+
+    Relative source names are resolved by HDF5 from the HDF5_VDS_PREFIX environment variable,
+    or else from the folder of the virtual dataset file.
+
+    :param sources:         list of (file name, shape, dtype) of the datasets, in order
+    :param dataset_name:    path of the dataset in the sources and in the new file
+    :return:                the h5 file as BytesIO
+    :raises ValueError:     if the datasets can not be concatenated
+    """
+    if not sources:
+        raise ValueError("a virtual dataset needs at least one source")
+    _, first_shape, dtype = sources[0]
+    if not first_shape:
+        raise ValueError("scalar datasets can not be concatenated")
+    for name, shape, source_dtype in sources:
+        if shape[1:] != first_shape[1:] or source_dtype != dtype:
+            raise ValueError(f"the dataset of {name} does not match the first source")
+
+    length = sum(shape[0] for _, shape, _ in sources)
+    layout = h5py.VirtualLayout(shape=(length,) + first_shape[1:], dtype=dtype)
+    offset = 0
+    for name, shape, _ in sources:
+        layout[offset : offset + shape[0]] = h5py.VirtualSource(
+            name, dataset_name, shape=shape
+        )
+        offset += shape[0]
+
+    h5_buffer = io.BytesIO()
+    with h5py.File(h5_buffer, "w") as h5:
+        h5.create_virtual_dataset(dataset_name, layout)
+    h5_buffer.seek(0)
+    return h5_buffer
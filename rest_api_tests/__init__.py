@@ -16,6 +16,8 @@ from rest_api.models import image
 from rest_api.models import tag
 from rest_api.models import file
 from rest_api.models import task
+from rest_api.models import conversion_cache
+from rest_api.models import upload_progress
 from rest_api import dcache_interactor
 
 create_app = rest_api.create_app
@@ -31,6 +33,8 @@ Tag = tag.Tag
 Task = task.Task
 File = file.File
 Image = image.Image
+ConversionCache = conversion_cache.ConversionCache
+UploadProgress = upload_progress.UploadProgress
 
 
 # pylint: disable=redefined-outer-name
@@ -53,12 +57,14 @@ def delete_db_records(app):
     with app.app_context():
         # Clear tables
         db.session.query(Session).delete()
+        db.session.query(UploadProgress).delete()
         db.session.query(User).delete()
         db.session.query(File).delete()
         db.session.query(Task).delete()
         db.session.query(Tag).delete()
         db.session.query(Role).delete()
         db.session.query(Image).delete()
+        db.session.query(ConversionCache).delete()
 
         # Create and add the 4 fixed roles
         roles = [
@@ -0,0 +1,68 @@
+"""Conversion cache unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+import io
+from werkzeug.datastructures import MultiDict
+from rest_api.lib.conversion_cache_utils import (
+    copy_cached_conversion,
+    hash_input,
+    store_cached_conversion,
+    write_hashed,
+)
+from rest_api.routes.files.file_upload_endpoint import get_conversion_options
+from . import pytest, client, app, delete_db_records, ConversionCache
+from .test_file_storage import (
+    init_storage_test_envionment,
+    create_test_file,
+    interactor,
+    SESSION_TOKEN_1,
+    wait_for_upload,
+)
+
+OPTIONS = get_conversion_options(MultiDict())
+
+
+def test_write_hashed():
+    """
+    Tests that hashing the chunks of a file while it is written gives the digest of the file
+    """
+    output_file = io.BytesIO()
+    digest = write_hashed([b"first ", b"second"], output_file)
+
+    assert output_file.getvalue() == b"first second"
+    assert digest == hash_input(output_file)
+
+
+def test_overwritten_output_forgotten(app):
+    """
+    Tests that the conversion of another video stored at the same path replaces the entry
+    of the earlier one, so its overwritten output is not reused
+    """
+    with app.app_context():
+        interactor.upload_file("vid.h5", create_test_file())
+        store_cached_conversion("a" * 64, "h5", OPTIONS, "vid.h5")
+        store_cached_conversion("b" * 64, "h5", OPTIONS, "vid.h5")
+
+        assert [c.input_hash for c in ConversionCache.query.all()] == ["b" * 64]
+        assert copy_cached_conversion("a" * 64, "h5", OPTIONS, "vid.h5") is None
+        assert copy_cached_conversion("b" * 64, "h5", OPTIONS, "vid.h5") is not None
+
+
+def test_uploaded_file_forgets_output(client, app):
+    """
+    Tests that uploading a file to the path of a cached output drops its entry
+    """
+    with app.app_context():
+        store_cached_conversion("a" * 64, "h5", OPTIONS, "vid.h5")
+
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        response = client.post(
+            "/api/files/upload",
+            data={"vid.h5": (create_test_file(), "vid.h5"), "tags[]": [], "format": "none"},
+            content_type="multipart/form-data",
+        )
+        wait_for_upload(response)
+
+        assert ConversionCache.query.count() == 0
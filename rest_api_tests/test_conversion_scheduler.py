@@ -0,0 +1,97 @@
+"""Fair share conversion scheduler unit tests."""
+
+import io
+import threading
+import time
+from rest_api.conversion_scheduler import ConversionScheduler, get_cost, get_weight
+
+
+def wait_for(condition, timeout=5):
+    """Wait until a condition holds."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_weight_and_cost():
+    """
+    Tests the weight of users by their roles and the cost of videos by their size
+    """
+    assert get_weight([]) == 1
+    assert get_weight(["AI Researcher"]) == 1
+
+    video = io.BytesIO(b"\0" * (3 * 1024**2))
+    video.seek(10)
+    assert get_cost(video) == 3
+    # the position in the file is kept
+    assert video.tell() == 10
+    assert get_cost(io.BytesIO(b"small")) == 1
+
+
+def test_small_conversion_not_queued_behind_bulk():
+    """
+    Tests that a small conversion of a user starts before the queued bulk of another user
+    """
+    scheduler = ConversionScheduler(workers=1)
+    release = threading.Event()
+    order = []
+
+    def submit(user, cost, label):
+        def convert():
+            order.append(label)
+            if label == "blocking":
+                release.wait()
+
+        thread = threading.Thread(
+            target=scheduler.run, args=(user, 1, cost, convert, label)
+        )
+        thread.start()
+        return thread
+
+    threads = [submit("bulk", 100, "blocking")]
+    wait_for(lambda: order == ["blocking"])
+    for i in range(3):
+        threads.append(submit("bulk", 100, f"bulk_{i}"))
+        wait_for(lambda i=i: len(scheduler.get_positions("bulk")) == i + 1)
+    threads.append(submit("small", 1, "small"))
+    wait_for(lambda: scheduler.get_positions("small"))
+
+    # the small conversion is first in line, the bulk keeps its own order
+    assert scheduler.get_positions("small") == {"small": 1}
+    assert scheduler.get_positions("bulk") == {"bulk_0": 2, "bulk_1": 3, "bulk_2": 4}
+
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert order == ["blocking", "small", "bulk_0", "bulk_1", "bulk_2"]
+    assert not scheduler.get_positions("bulk")
+
+
+def test_workers_cap():
+    """
+    Tests that no more conversions than workers run at the same time
+    """
+    scheduler = ConversionScheduler(workers=2)
+    lock = threading.Lock()
+    running = []
+    peak = []
+
+    def convert():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.pop()
+
+    threads = [
+        threading.Thread(target=scheduler.run, args=(f"user_{i % 3}", 1, 1, convert))
+        for i in range(9)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    assert len(peak) == 9
+    assert max(peak) == 2
@@ -0,0 +1,240 @@
+"""File converter unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import io
+import tarfile
+import av
+import pytest
+import numpy as np
+from rest_api.file_converter import (
+    FileConverter,
+    find_segments,
+    probe_video,
+    PARALLEL_MIN_FRAMES,
+)
+from rest_api.frame_batch import FrameBatch
+from rest_api.shard_writer import ShardWriter
+
+
+def create_test_video(frames, gop_size, width=160, height=120, repeat=1):
+    """Create an mp4 video in memory with a line that moves every repeat frames."""
+    video = io.BytesIO()
+    with av.open(video, "w", format="mp4") as container:
+        stream = container.add_stream("h264", rate=25)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = gop_size
+        for i in range(frames):
+            img = np.zeros((height, width, 3), dtype=np.uint8)
+            img[:, (i // repeat * 3) % width] = 255
+            frame = av.VideoFrame.from_ndarray(img, format="rgb24")
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    video.seek(0)
+    return video
+
+
+def test_find_segments_short_video():
+    """
+    Tests that short videos are not split into segments
+    """
+    video = create_test_video(PARALLEL_MIN_FRAMES - 1, gop_size=10)
+
+    assert not find_segments(video, 4)
+
+
+def test_find_segments_long_video():
+    """
+    Tests that long videos are split on keyframes
+    """
+    video = create_test_video(PARALLEL_MIN_FRAMES, gop_size=10)
+
+    segments = find_segments(video, 2)
+
+    assert len(segments) == 8
+    assert segments[0][0] is None
+    assert segments[-1][1] is None
+    # every segment ends where the next one starts
+    for (_, end), (start, _) in zip(segments, segments[1:]):
+        assert end == start
+
+
+def test_parallel_decoding_matches_serial():
+    """
+    Tests that decoding in segments over multiple processes gives the same frames
+    """
+    video = create_test_video(PARALLEL_MIN_FRAMES + 100, gop_size=25)
+
+    serial_frames = FileConverter(processes=1).mp4_to_jpeg(video)
+    parallel_frames = FileConverter(processes=4).mp4_to_jpeg(video)
+
+    assert len(serial_frames) == PARALLEL_MIN_FRAMES + 100
+    assert parallel_frames.buffer == serial_frames.buffer
+    assert parallel_frames.offsets == serial_frames.offsets
+    assert parallel_frames.metadata == serial_frames.metadata
+
+
+def test_dedup_drops_repeated_frames():
+    """
+    Tests that frames repeating the previous kept frame are dropped and counted
+    """
+    # a single changing frame followed by the same frame until the next keyframe
+    video = create_test_video(PARALLEL_MIN_FRAMES + 100, gop_size=25, repeat=25)
+
+    serial_frames = FileConverter(processes=1).mp4_to_jpeg(video, dedup_distance=4)
+    parallel_frames = FileConverter(processes=4).mp4_to_jpeg(video, dedup_distance=4)
+
+    assert len(serial_frames) < PARALLEL_MIN_FRAMES + 100
+    assert len(serial_frames) + serial_frames.dropped_frames == PARALLEL_MIN_FRAMES + 100
+    assert parallel_frames.buffer == serial_frames.buffer
+    assert parallel_frames.metadata == serial_frames.metadata
+    assert parallel_frames.dropped_frames == serial_frames.dropped_frames
+
+
+def test_probe_video():
+    """
+    Tests reading the metadata of a video from its headers
+    """
+    video = create_test_video(50, gop_size=25)
+
+    metadata = probe_video(video)
+
+    assert metadata["width"] == 160
+    assert metadata["height"] == 120
+    assert metadata["codec"] == "h264"
+    assert metadata["frame_count"] == 50
+    assert metadata["frame_rate"] == 25
+    assert metadata["duration"] == pytest.approx(2)
+    assert video.tell() == 0
+
+
+def test_probe_invalid_video():
+    """
+    Tests that probing a file that is not a video fails
+    """
+    with pytest.raises(ValueError):
+        probe_video(io.BytesIO(b"not a video" * 100))
+
+
+def test_frame_batch_packs_frames():
+    """
+    Tests that frames are packed into one buffer and handed out without copying
+    """
+    batch = FrameBatch()
+    batch.append(b"first", pts=0)
+    batch.append(b"second frame", pts=1)
+
+    assert len(batch) == 2
+    assert batch.nbytes == 17
+    assert bytes(batch[1]) == b"second frame"
+    assert bytes(batch[-2]) == b"first"
+    assert batch[1].obj is batch.buffer
+    assert batch.offsets_array().tolist() == [0, 5, 17]
+    assert batch.lengths_array().tolist() == [5, 12]
+    assert batch.metadata == [{"pts": 0}, {"pts": 1}]
+
+
+def test_frame_batch_extend():
+    """
+    Tests that appending a batch moves its offsets behind the existing frames
+    """
+    first = FrameBatch()
+    first.append(b"abc", pts=0)
+    second = FrameBatch()
+    second.append(b"de", pts=1)
+    second.append(b"fgh", pts=2)
+
+    first.extend(second)
+
+    assert [bytes(frame) for frame in first] == [b"abc", b"de", b"fgh"]
+    assert [m["pts"] for m in first.metadata] == [0, 1, 2]
+
+
+def test_npz_offsets_match_batch():
+    """
+    Tests that the npz conversion stores the packed frames with their offsets
+    """
+    frames = FileConverter(processes=1).mp4_to_jpeg(create_test_video(5, gop_size=5))
+
+    npz_file = np.load(FileConverter().jpeg_to_npz(frames))
+
+    assert npz_file["offsets"].tolist() == frames.offsets.tolist()
+    assert npz_file["frames"].tobytes() == bytes(frames.buffer)
+
+
+def write_tarfile_shard(samples):
+    """Write a tar shard with tarfile, like the shards were written before."""
+    shard_buffer = io.BytesIO()
+    with tarfile.open(fileobj=shard_buffer, mode="w") as shard:
+        for i, jpeg_data, metadata in samples:
+            for name, content in (
+                (f"frame_{i:06d}.jpg", jpeg_data),
+                (f"frame_{i:06d}.json", metadata),
+            ):
+                member = tarfile.TarInfo(name)
+                member.size = len(content)
+                shard.addfile(member, io.BytesIO(content))
+    return shard_buffer.getvalue()
+
+
+def test_shards_match_tarfile():
+    """
+    Tests that the blocks of a shard are the tar file tarfile writes
+    """
+    samples = [(i, bytes([i]) * (100 + 300 * i), b'{"frame": %d}' % i) for i in range(5)]
+
+    chunks = FileConverter(processes=1).write_shard(samples)
+
+    assert b"".join(chunks) == write_tarfile_shard(samples)
+
+
+def test_shard_writer_matches_batch_shards():
+    """
+    Tests that shards streamed while a video is decoded are the shards of the decoded batch
+    """
+    stored = {}
+
+    def upload(name, chunks):
+        stored[name] = b"".join(chunks)
+
+    converter = FileConverter(processes=1)
+    writer = ShardWriter(upload, shard_size=20000, queue_frames=2)
+    jpegs = converter.mp4_to_jpeg(create_test_video(30, gop_size=10), on_frame=writer.append)
+    writer.close()
+
+    shards = list(converter.jpeg_to_shards(jpegs, 20000))
+    assert len(shards) > 1
+    assert writer.index["shards"] == [
+        {"name": f"shard_{i:06d}.tar", "samples": samples}
+        for i, (_, samples) in enumerate(shards)
+    ]
+    assert [stored[f"shard_{i:06d}.tar"] for i in range(len(shards))] == [
+        b"".join(chunks) for chunks, _ in shards
+    ]
+
+
+def test_shard_writer_abort():
+    """
+    Tests that the upload of a shard that is not complete fails when it is aborted
+    """
+    errors = []
+
+    def upload(name, chunks):
+        try:
+            b"".join(chunks)
+        except OSError as error:
+            errors.append(error)
+            raise
+
+    writer = ShardWriter(upload, shard_size=10**6)
+    writer.append(b"\xff\xd8", {"pts": 0})
+    writer.abort()
+
+    assert len(errors) == 1
+    assert not writer.index["shards"]
@@ -8,10 +8,15 @@ import time
 import zipfile
 import pickle
 import stat
+import tarfile
 from datetime import datetime, timedelta
 import io
 import os
 import h5py
+import numpy as np
+from rest_api.h5_staging import staging_files
+from rest_api.routes.files import file_upload_endpoint
+from rest_api.routes.files.file_upload_endpoint import upload_jobs
 from . import (
     pytest,
     Role,
@@ -24,6 +29,7 @@ from . import (
     Tag,
     dcache_interactor,
     File,
+    ConversionCache,
 )
 from .test_user_endpoints import set_user_role
 
@@ -83,6 +89,17 @@ def create_test_file():
     return io.BytesIO(file_content.encode("utf-8"))
 
 
+def wait_for_upload(response):
+    """
+    Wait until the background job of an accepted upload is done.
+    """
+    assert response.status_code == 202
+    job = upload_jobs.get(response.json["job_id"])
+    # the job is forgotten once it is done
+    if job is not None:
+        job.result(timeout=120)
+
+
 @pytest.fixture(autouse=True)
 def init_storage_test_envionment(app):
     """Create neccessery data before running tests"""
@@ -146,7 +163,7 @@ def test_upload_directory(client, app):
             content_type="multipart/form-data",
         )
 
-        assert response.status_code == 200
+        wait_for_upload(response)
 
         dir_content = interactor.get_dir_content_recursive("dir")
         assert len(dir_content) == 3
@@ -176,7 +193,7 @@ def test_upload_file_h5(client, app):
                 content_type="multipart/form-data",
             )
 
-            assert response.status_code == 200
+            wait_for_upload(response)
 
             dir_content = interactor.get_dir_content()
             assert "/vid.h5" in dir_content
@@ -208,7 +225,7 @@ def test_upload_file_pickle(client, app):
                 content_type="multipart/form-data",
             )
 
-            assert response.status_code == 200
+            wait_for_upload(response)
 
             dir_content = interactor.get_dir_content()
             assert "/vid.pickle" in dir_content
@@ -225,6 +242,360 @@ def test_upload_file_pickle(client, app):
             assert len(data) == 3
 
 
+def test_upload_file_npy(client, app):
+    """
+    Tests uploading an mp4 converted to npy
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={"vid.mp4": (vid, "vid.mp4"), "tags[]": [], "format": "npy"},
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            dir_content = interactor.get_dir_content()
+            assert "/vid.npy" in dir_content
+
+            assert len(File.query.all()) == 1
+            file = File.query.first()
+            assert file.index == "/vid.npy"
+
+            frames = np.load(io.BytesIO(interactor.get_file("vid.npy").content))
+
+            assert frames.shape[0] == 3
+            assert frames.dtype == np.uint8
+
+
+def test_upload_file_npz(client, app):
+    """
+    Tests uploading an mp4 converted to npz
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={"vid.mp4": (vid, "vid.mp4"), "tags[]": [], "format": "npz"},
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            dir_content = interactor.get_dir_content()
+            assert "/vid.npz" in dir_content
+
+            assert len(File.query.all()) == 1
+            file = File.query.first()
+            assert file.index == "/vid.npz"
+
+            npz_file = np.load(io.BytesIO(interactor.get_file("vid.npz").content))
+            offsets = npz_file["offsets"]
+            frames = npz_file["frames"]
+
+            assert len(offsets) == 4
+            assert offsets[-1] == len(frames)
+            # every frame in the index is a complete jpeg
+            for i in range(3):
+                jpeg = frames[offsets[i] : offsets[i + 1]].tobytes()
+                assert jpeg[:2] == b"\xff\xd8"
+
+
+def test_upload_file_shards(client, app):
+    """
+    Tests uploading an mp4 converted to tar shards
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "shards",
+                    # every frame is larger than this, so each ends up in its own shard
+                    "shard_size": 1,
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            dir_content = interactor.get_dir_content("vid_shards")
+            assert sorted(dir_content) == [
+                "/vid_shards/index.json",
+                "/vid_shards/shard_000000.tar",
+                "/vid_shards/shard_000001.tar",
+                "/vid_shards/shard_000002.tar",
+            ]
+
+            file = File.query.first()
+            assert file.index == "/vid_shards"
+            assert file.type == "directory"
+
+            index = interactor.get_file("vid_shards/index.json").json()
+            assert [shard["samples"] for shard in index["shards"]] == [1, 1, 1]
+
+            shard = io.BytesIO(
+                interactor.get_file("vid_shards/shard_000001.tar").content
+            )
+            with tarfile.open(fileobj=shard) as tar:
+                assert tar.getnames() == ["frame_000001.jpg", "frame_000001.json"]
+
+
+def test_upload_file_multiple_formats(client, app):
+    """
+    Tests uploading an mp4 converted to multiple formats at once
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": ["jpeg", "h5", "npz"],
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            dir_content = interactor.get_dir_content()
+            assert "/vid.h5" in dir_content
+            assert "/vid.npz" in dir_content
+            assert len(interactor.get_dir_content("vid")) == 3
+
+            files = sorted(File.query.all(), key=lambda f: f.index)
+            assert [(f.index, f.type) for f in files] == [
+                ("/vid", "directory"),
+                ("/vid.h5", "file"),
+                ("/vid.npz", "file"),
+            ]
+            for f in files:
+                assert [t.name for t in f.tags] == [EMAIL_1]
+
+
+def test_upload_file_media_metadata(client, app):
+    """
+    Tests that the metadata of an uploaded mp4 is stored with every output
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": ["h5", "npz"],
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            files = File.query.order_by(File.index).all()
+            assert len(files) == 2
+            for f in files:
+                assert (f.width, f.height) == (480, 360)
+                assert f.codec == "h264"
+                assert f.frame_count == 3
+                assert f.duration == pytest.approx(0.1)
+
+
+def test_upload_broken_video(client, app):
+    """
+    Tests that uploading a file that is not a video as mp4 fails before uploading
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+
+        response = client.post(
+            "/api/files/upload",
+            data={
+                "vid.mp4": (create_test_file(), "vid.mp4"),
+                "tags[]": [],
+                "format": "jpeg",
+            },
+            content_type="multipart/form-data",
+        )
+
+        assert response.status_code == 400
+        assert File.query.count() == 0
+
+
+def test_upload_file_invalid_format(client, app):
+    """
+    Tests that uploading with an unknown or no conversion format fails before uploading
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            for file_format in [["gif"], ["none", "h5"], []]:
+                vid.seek(0)
+                response = client.post(
+                    "/api/files/upload",
+                    data={
+                        "vid.mp4": (vid, "vid.mp4"),
+                        "tags[]": [],
+                        "format": file_format,
+                    },
+                    content_type="multipart/form-data",
+                )
+
+                assert response.status_code == 400
+
+            assert len(File.query.all()) == 0
+            assert not interactor.get_dir_content()
+
+
+def test_upload_file_conversion_cache(client, app):
+    """
+    Tests that uploading the same mp4 again copies the earlier conversion
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        hits_before = client.get("/api/metrics").json.get("conversion_cache_hits", 0)
+
+        for name in ["vid.mp4", "copy/vid2.mp4"]:
+            with open(VIDEO_PATH, "rb") as vid:
+                response = client.post(
+                    "/api/files/upload",
+                    data={name: (vid, name), "tags[]": [], "format": "h5"},
+                    content_type="multipart/form-data",
+                )
+                wait_for_upload(response)
+
+        assert len(ConversionCache.query.all()) == 1
+        assert ConversionCache.query.first().path == "vid.h5"
+
+        metrics = client.get("/api/metrics").json
+        assert metrics["conversion_cache_hits"] == hits_before + 1
+
+        assert "/copy/vid2.h5" in interactor.get_dir_content("copy")
+        original = interactor.get_file("vid.h5").content
+        assert interactor.get_file("copy/vid2.h5").content == original
+
+
+def test_upload_file_keyframes(client, app):
+    """
+    Tests uploading an mp4 converted to jpeg with only the keyframes
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "jpeg",
+                    "frames": "keyframes",
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            # the test video only starts with a keyframe
+            dir_content = interactor.get_dir_content("vid")
+            assert dir_content == ["/vid/frame_0.jpeg"]
+
+
+def test_upload_file_dedup(client, app):
+    """
+    Tests uploading an mp4 converted to jpeg without near duplicate frames
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "jpeg",
+                    "dedup_distance": 64,
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            # every frame is within the largest distance of the first frame
+            dir_content = interactor.get_dir_content("vid")
+            assert dir_content == ["/vid/frame_0.jpeg"]
+            assert ConversionCache.query.first().dropped_frames > 0
+
+
+def test_upload_file_stream_h5(client, app):
+    """
+    Tests uploading an mp4 converted to h5 through a staging file
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "h5",
+                    "stream_h5": "true",
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            # the uploaded file has the layout of the h5 conversion
+            h5_file = io.BytesIO(interactor.get_file("vid.h5").content)
+            with h5py.File(h5_file, "r") as h5_file:
+                assert len(h5_file["jpeg_images"]) == 3
+
+            # the staging file is removed once the upload is done
+            assert not staging_files.files
+            response = client.get("/api/files/staging/h5?path=vid.h5")
+            assert response.status_code == 404
+
+
+def test_upload_file_invalid_dedup_distance(client, app):
+    """
+    Tests uploading an mp4 with a dedup distance larger than the hash
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "jpeg",
+                    "dedup_distance": 65,
+                },
+                content_type="multipart/form-data",
+            )
+
+            assert response.status_code == 400
+
+
 def test_upload_file_jpeg(client, app):
     """
     Tests uploading an mp4 converted to jpeg
@@ -239,7 +610,7 @@ def test_upload_file_jpeg(client, app):
                 content_type="multipart/form-data",
             )
 
-            assert response.status_code == 200
+            wait_for_upload(response)
 
             dir_content = interactor.get_dir_content("vid")
             assert len(dir_content) == 3
@@ -253,6 +624,41 @@ def test_upload_file_jpeg(client, app):
             assert file.tags[0].name == EMAIL_1
 
 
+def test_upload_file_jpeg_sharded(client, app):
+    """
+    Tests uploading an mp4 converted to jpeg in the sharded layout and downloading it
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        with app.app_context():
+            client.set_cookie("session-id", SESSION_TOKEN_1)
+
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "jpeg",
+                    "jpeg_layout": "sharded",
+                },
+                content_type="multipart/form-data",
+            )
+
+            wait_for_upload(response)
+
+            # the frames are only listed in the manifest, next to the subdirectories
+            assert interactor.get_dir_content("vid") == ["/vid/manifest.json"]
+            manifest = interactor.get_file("vid/manifest.json").json()
+            expected_files = [f"frames/000/frame_{i:06d}.jpeg" for i in range(3)]
+            assert manifest["files"] == expected_files
+
+            response = client.get(f"/api/files/download/{File.query.first().id}")
+            with zipfile.ZipFile(io.BytesIO(response.data), "r") as zip_ref:
+                # the manifest is downloaded with the frames
+                assert zip_ref.namelist() == [
+                    f"vid/{path}" for path in expected_files + ["manifest.json"]
+                ]
+
+
 def test_upload_file(client, app):
     """
     Tests uploading a file with a custom tag
@@ -274,7 +680,7 @@ def test_upload_file(client, app):
             content_type="multipart/form-data",
         )
 
-        assert response.status_code == 200
+        wait_for_upload(response)
 
         dir_content = interactor.get_dir_content()
         assert "/test_file" in dir_content
@@ -292,6 +698,68 @@ def test_upload_file(client, app):
         assert sorted_tags[1].name == EMAIL_1
 
 
+def test_upload_many_files(client, app, monkeypatch):
+    """
+    Tests that the files of an upload are registered together in chunks with their tags
+    """
+    monkeypatch.setattr(file_upload_endpoint, "REGISTER_CHUNK_SIZE", 4)
+    monkeypatch.setattr(file_upload_endpoint, "REGISTER_INTERVAL", 60)
+
+    with app.app_context():
+        custom_tag = Tag.query.filter_by(type="custom").first()
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+
+        data = {f"file_{i}": (create_test_file(), f"file_{i}") for i in range(10)}
+        data["dir/item"] = (create_test_file(), "dir/item")
+        response = client.post(
+            "/api/files/upload",
+            data={**data, "tags[]": [custom_tag.id], "format": "none"},
+            content_type="multipart/form-data",
+        )
+        wait_for_upload(response)
+
+        files = File.query.all()
+        assert sorted(f.index for f in files) == sorted(
+            [f"/file_{i}" for i in range(10)] + ["/dir/"]
+        )
+        for f in files:
+            assert sorted(t.name for t in f.tags) == ["custom-tag1", EMAIL_1]
+
+
+def test_upload_registered_before_conversion(client, app, monkeypatch):
+    """
+    Tests that the items finished before a video is converted are registered without
+    waiting for the conversion
+    """
+    monkeypatch.setattr(file_upload_endpoint, "REGISTER_INTERVAL", 60)
+    handle_conversions = file_upload_endpoint.handle_conversions
+    registered = []
+
+    def record_registered(**kwargs):
+        registered.extend(f.index for f in File.query.all())
+        return handle_conversions(**kwargs)
+
+    monkeypatch.setattr(file_upload_endpoint, "handle_conversions", record_registered)
+
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        with open(VIDEO_PATH, "rb") as vid:
+            response = client.post(
+                "/api/files/upload",
+                data={
+                    "a.txt": (create_test_file(), "a.txt"),
+                    "vid.mp4": (vid, "vid.mp4"),
+                    "tags[]": [],
+                    "format": "h5",
+                },
+                content_type="multipart/form-data",
+            )
+            wait_for_upload(response)
+
+        assert registered == ["/a.txt"]
+        assert sorted(f.index for f in File.query.all()) == ["/a.txt", "/vid.h5"]
+
+
 def test_download_directory(client, app):
     """
     Tests getting downloading a directory the user has access to
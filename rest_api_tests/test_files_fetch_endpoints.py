@@ -315,6 +315,36 @@ def test_search_files_by_all_parameters(client, app):
         check_file(files_data[0], correct_file.index, ["admin@gmail.com", "some_tag"])
 
 
+def test_filter_files_by_media(client, app):
+    """
+    Test that filters files by the metadata of videos.
+    """
+
+    with app.app_context():
+        small = add_user_file()
+        large = add_user_file()
+        add_user_file()
+        small.width, small.height, small.duration, small.codec = 640, 480, 5.0, "h264"
+        large.width, large.height, large.duration, large.codec = 1920, 1080, 60.0, "hevc"
+        db.session.commit()
+
+        set_user_role(client, "Data Engineer")
+
+        response = client.get("/api/files?min_width=1280")
+        assert response.status_code == 200
+        files_data = response.json.get("files")
+        assert [f["index"] for f in files_data] == [large.index]
+        assert files_data[0]["media"]["height"] == 1080
+
+        response = client.get("/api/files?max_duration=10&codec=h264")
+        files_data = response.json.get("files")
+        assert [f["index"] for f in files_data] == [small.index]
+
+        # files without metadata are not matched by a filter
+        response = client.get("/api/files?min_duration=0")
+        assert len(response.json.get("files")) == 2
+
+
 def test_fetch_files_pagination(client, app):
     """
     Test that fetching files with pagination works.
@@ -0,0 +1,170 @@
+"""Frame extractor and ranged dCache reads unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import io
+from fractions import Fraction
+import av
+import numpy as np
+import pytest
+from rest_api.dcache_file import DCacheFile
+from rest_api.file_converter import FileConverter
+from rest_api.frame_extractor import FrameExtractor
+from .test_file_converter import create_test_video
+
+
+class MemoryInteractor:
+    """Serves ranged reads of a file in memory, like dCache does."""
+
+    def __init__(self, data):
+        self.data = data
+        self.requests = 0
+
+    def get_file_size(self, path):
+        """Get the size of the file."""
+        return len(self.data)
+
+    def get_file_range(self, path, start, end):
+        """Get a byte range of the file."""
+        self.requests += 1
+        return self.data[start:end]
+
+
+def test_dcache_file_ranged_reads():
+    """
+    Tests reading and seeking in a file that is fetched in blocks
+    """
+    data = bytes(range(256)) * 100
+    remote = MemoryInteractor(data)
+    dcache_file = DCacheFile(remote, "file", block_size=1000)
+
+    dcache_file.seek(2500)
+    assert dcache_file.read(3000) == data[2500:5500]
+    # four missing blocks in a row are fetched at once
+    assert remote.requests == 1
+
+    dcache_file.seek(-10, io.SEEK_END)
+    assert dcache_file.read(100) == data[-10:]
+    assert dcache_file.read() == b""
+
+    # blocks that were read before are not fetched again
+    requests = remote.requests
+    dcache_file.seek(3000)
+    assert dcache_file.read(1000) == data[3000:4000]
+    assert remote.requests == requests
+
+    dcache_file.seek(0)
+    assert dcache_file.read() == data
+    assert dcache_file.fetched_bytes <= 2 * len(data)
+
+
+def test_extract_frames():
+    """
+    Tests that extracted frames are the same as the frames of a full conversion
+    """
+    video = create_test_video(300, gop_size=25)
+    all_frames = FileConverter(processes=1).mp4_to_jpeg(video)
+    remote = MemoryInteractor(video.getvalue())
+    opened = []
+
+    def open_video():
+        opened.append(DCacheFile(remote, "vid.mp4", block_size=4096))
+        return opened[-1]
+
+    extractor = FrameExtractor()
+    indices = [0, 24, 25, 150, 299, 3]
+    jpegs = extractor.get_frames("vid", open_video, indices)
+
+    assert jpegs == [bytes(all_frames[i]) for i in indices]
+    assert len(opened) == 1
+
+    # frames of decoded groups of pictures are served from the cache
+    assert extractor.get_frames("vid", open_video, [26]) == [bytes(all_frames[26])]
+    assert len(opened) == 1
+
+    with pytest.raises(IndexError):
+        extractor.get_frames("vid", open_video, [300])
+
+
+def test_extract_frames_cache_eviction():
+    """
+    Tests that the least recently used groups of pictures are evicted
+    """
+    video = create_test_video(100, gop_size=25)
+    remote = MemoryInteractor(video.getvalue())
+    extractor = FrameExtractor(max_gops=2)
+
+    extractor.get_frames("vid", lambda: DCacheFile(remote, "vid.mp4"), [0])
+    first_gop = next(iter(extractor.gops))
+    extractor.get_frames("vid", lambda: DCacheFile(remote, "vid.mp4"), [30, 60])
+
+    assert len(extractor.gops) == 2
+    assert first_gop not in extractor.gops
+
+
+class EmptyContainer:
+    """A video container that decodes no frames, like after seeking past the end."""
+
+    def seek(self, *args, **kwargs):
+        """Seek to a timestamp."""
+
+    def decode(self, stream):
+        """Decode the frames after the seek."""
+        return []
+
+
+def test_extract_frames_nothing_decoded():
+    """
+    Tests that nothing is cached when no frame is decoded, so the video can still be read
+    """
+    video = create_test_video(50, gop_size=25)
+    remote = MemoryInteractor(video.getvalue())
+    extractor = FrameExtractor()
+
+    gop = extractor.decode_gops("vid", EmptyContainer(), None, 10**9)
+    with pytest.raises(IndexError):
+        extractor.select_frame(gop, 10**9, 1)
+    assert not extractor.gops
+
+    assert len(extractor.get_frames("vid", lambda: DCacheFile(remote, "vid.mp4"), [30])) == 1
+
+
+def create_variable_rate_video():
+    """Create an mp4 video in memory whose frames are twice as far apart in its second half."""
+    video = io.BytesIO()
+    time_base = Fraction(1, 100)
+    with av.open(video, "w", format="mp4") as container:
+        stream = container.add_stream("h264", rate=25)
+        stream.width = 160
+        stream.height = 120
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.time_base = time_base
+        for i in range(50):
+            frame = av.VideoFrame.from_ndarray(
+                np.zeros((120, 160, 3), dtype=np.uint8), format="rgb24"
+            )
+            frame.pts = i * 4 if i < 25 else 100 + (i - 25) * 8
+            frame.time_base = time_base
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    video.seek(0)
+    return video
+
+
+def test_extract_frames_variable_rate():
+    """
+    Tests that exact frames of a video with a variable frame rate are refused,
+    as their timestamps do not follow from their indices
+    """
+    remote = MemoryInteractor(create_variable_rate_video().getvalue())
+    extractor = FrameExtractor()
+
+    with pytest.raises(ValueError):
+        extractor.get_frames("vid", lambda: DCacheFile(remote, "vid.mp4"), [40])
+    # a frame near the index, like for a poster frame
+    jpegs = extractor.get_frames("vid", lambda: DCacheFile(remote, "vid.mp4"), [10], exact=False)
+    assert len(jpegs) == 1
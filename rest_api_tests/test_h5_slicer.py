@@ -0,0 +1,174 @@
+"""Remote h5 slicing unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+
+import io
+import h5py
+import numpy as np
+import pytest
+from rest_api.dcache_file import DCacheFile
+from rest_api.file_converter import FileConverter
+from rest_api.h5_slicer import H5_BLOCK_SIZE, parse_selection, read_slice
+from rest_api.h5_staging import StagingH5Writer, StagingRegistry
+from rest_api.virtual_dataset import build_virtual_dataset, read_layout
+from .test_file_converter import create_test_video
+from .test_frame_extractor import MemoryInteractor
+
+
+def test_parse_selection():
+    """
+    Tests parsing NumPy style selections
+    """
+    assert parse_selection("") == (slice(None),)
+    assert parse_selection("5") == (5,)
+    assert parse_selection("10:20") == (slice(10, 20, None),)
+    assert parse_selection(":20:2, 1") == (slice(None, 20, 2), 1)
+
+    for invalid in ["a", "1:2:3:4", "0:10:0", "0:10:-1"]:
+        with pytest.raises(ValueError):
+            parse_selection(invalid)
+
+
+def test_read_jpeg_slice():
+    """
+    Tests reading frames of an h5 conversion, only fetching the blocks holding them
+    """
+    converter = FileConverter()
+    jpegs = converter.mp4_to_jpeg(create_test_video(frames=120, gop_size=10))
+    data = converter.jpeg_to_h5(jpegs).getvalue()
+    remote = MemoryInteractor(data)
+
+    frames, array = read_slice(
+        DCacheFile(remote, "file.h5", block_size=4096), "jpeg_images", (slice(50, 60, 3),)
+    )
+    assert array is None
+    assert frames == [bytes(jpegs[i]) for i in range(50, 60, 3)]
+    assert remote.requests < len(data) // 4096
+
+    frames, _ = read_slice(io.BytesIO(data), "jpeg_images", (7,))
+    assert frames == [bytes(jpegs[7])]
+
+    with pytest.raises(KeyError):
+        read_slice(io.BytesIO(data), "missing", (slice(None),))
+    with pytest.raises(IndexError):
+        read_slice(io.BytesIO(data), "jpeg_images", (500,))
+
+
+def test_read_numeric_slice():
+    """
+    Tests reading a slice of a chunked array, only fetching the chunks it touches
+    """
+    array = np.arange(256 * 64 * 64, dtype="uint16").reshape(256, 64, 64)
+    buffer = io.BytesIO()
+    with h5py.File(buffer, "w") as h5:
+        h5.create_dataset("images", data=array, chunks=(1, 64, 64))
+    data = buffer.getvalue()
+    dcache_file = DCacheFile(MemoryInteractor(data), "file.h5", block_size=H5_BLOCK_SIZE // 16)
+
+    frames, result = read_slice(dcache_file, "images", (slice(100, 104), slice(0, 32)))
+    assert frames is None
+    np.testing.assert_array_equal(result, array[100:104, 0:32])
+    assert dcache_file.fetched_bytes < len(data) / 4
+
+
+def test_read_virtual_dataset():
+    """
+    Tests combining h5 conversions into a virtual dataset and reading it from the sources
+    """
+    converter = FileConverter()
+    jpegs = converter.mp4_to_jpeg(create_test_video(frames=30, gop_size=10))
+    sources = {
+        "a.h5": converter.jpeg_to_h5(jpegs.select(range(0, 10))).getvalue(),
+        "b.h5": converter.jpeg_to_h5(jpegs.select(range(10, 30))).getvalue(),
+    }
+    layouts = [
+        (name, *read_layout(io.BytesIO(data), "jpeg_images")) for name, data in sources.items()
+    ]
+    virtual = build_virtual_dataset(layouts, "jpeg_images").getvalue()
+    # only the mapping is stored, not the frames
+    assert len(virtual) < min(len(data) for data in sources.values())
+
+    opened = []
+
+    def open_source(name):
+        opened.append(name)
+        return io.BytesIO(sources[name])
+
+    frames, _ = read_slice(io.BytesIO(virtual), "jpeg_images", (slice(5, 15, 2),), open_source)
+    assert frames == [bytes(jpegs[i]) for i in range(5, 15, 2)]
+    assert opened == ["a.h5", "b.h5"]
+
+    frames, _ = read_slice(io.BytesIO(virtual), "jpeg_images", (25,), open_source)
+    assert frames == [bytes(jpegs[25])]
+
+
+def test_build_virtual_dataset_mismatch():
+    """
+    Tests that only datasets with the same type and trailing shape can be combined
+    """
+    with pytest.raises(ValueError):
+        build_virtual_dataset([], "images")
+    with pytest.raises(ValueError):
+        build_virtual_dataset(
+            [("a.h5", (10, 4), np.dtype("uint8")), ("b.h5", (5, 3), np.dtype("uint8"))],
+            "images",
+        )
+
+    array = np.arange(20, dtype="float32").reshape(10, 2)
+    buffer = io.BytesIO()
+    with h5py.File(buffer, "w") as h5:
+        h5.create_dataset("images", data=array)
+    virtual = build_virtual_dataset(
+        [("a.h5", (10, 2), np.dtype("float32")), ("b.h5", (10, 2), np.dtype("float32"))],
+        "images",
+    )
+    _, data = read_slice(
+        virtual, "images", (slice(8, 12), 1), lambda name: io.BytesIO(buffer.getvalue())
+    )
+    np.testing.assert_array_equal(data, [17, 19, 1, 3])
+
+
+def test_read_staging_file_while_writing(tmp_path):
+    """
+    Tests reading the frames flushed to a staging file before it is complete
+    """
+    converter = FileConverter()
+    path = str(tmp_path / "staging.h5")
+    writer = StagingH5Writer(path, flush_frames=8)
+    jpegs = converter.mp4_to_jpeg(
+        create_test_video(frames=20, gop_size=10), on_frame=writer.append
+    )
+
+    # only the frames of complete flushes are visible while writing
+    frames, _ = read_slice(path, "jpeg_images", (slice(None),), swmr=True)
+    assert frames == [bytes(jpeg) for jpeg in jpegs.select(range(16))]
+
+    writer.close()
+    frames, _ = read_slice(path, "jpeg_images", (slice(15, None, 2),), swmr=True)
+    assert frames == [bytes(jpegs[i]) for i in range(15, 20, 2)]
+    with pytest.raises(IndexError):
+        read_slice(path, "jpeg_images", (20,), swmr=True)
+
+
+def test_staging_file_kept_while_read(tmp_path):
+    """
+    Tests that a staging file whose conversion finishes is only removed once it is not read anymore
+    """
+    path = tmp_path / "staging.h5"
+    path.write_bytes(b"")
+    registry = StagingRegistry()
+    registry.add("/vid.h5", 1, str(path))
+
+    # only the uploading user can read the file
+    with registry.read("/vid.h5", 2) as staged:
+        assert staged is None
+
+    with registry.read("/vid.h5", 1) as staged:
+        assert staged == str(path)
+        registry.remove("/vid.h5")
+        assert path.exists()
+        with registry.read("/vid.h5", 1) as finished:
+            assert finished is None
+    assert not path.exists()
@@ -0,0 +1,35 @@
+"""Jpeg conversion layout unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+from rest_api.lib.jpeg_layout_utils import create_manifest, read_manifest
+from . import pytest, app, delete_db_records
+from .test_file_storage import init_storage_test_envionment, interactor
+
+
+def test_read_manifest():
+    """
+    Tests that only the manifest of a sharded jpeg conversion is read,
+    and listed with the frames
+    """
+    interactor.upload_file("vid/manifest.json", create_manifest(2))
+    assert read_manifest("vid") == [
+        "/vid/frames/000/frame_000000.jpeg",
+        "/vid/frames/000/frame_000001.jpeg",
+        "/vid/manifest.json",
+    ]
+
+
+@pytest.mark.parametrize(
+    "content",
+    [b"not json", b"[1, 2]", b'{"version": 1}', b'{"files": ["a.txt"]}'],
+)
+def test_read_foreign_manifest(content):
+    """
+    Tests that a manifest.json that a dataset folder ships is not taken as a sharded conversion
+    """
+    interactor.upload_file("dataset/manifest.json", content)
+    assert read_manifest("dataset") is None
+    # a directory without a manifest is walked
+    assert read_manifest("empty") is None
@@ -0,0 +1,42 @@
+"""Schema migration unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+from sqlalchemy import inspect, text
+from rest_api.models.migrations import ADDED_COLUMNS, add_missing_columns
+from . import app, delete_db_records, db, ConversionCache, File
+
+
+def get_columns(table_name):
+    """Get the names of the columns of a table in the database."""
+    return {column["name"] for column in inspect(db.engine).get_columns(table_name)}
+
+
+def test_missing_columns_added(app):
+    """
+    Tests that the columns added to a model are added to a table created by an earlier version,
+    and that running the migration again does nothing
+    """
+    with app.app_context():
+        db.session.add(File(index="/old_file", type="file"))
+        db.session.add(
+            ConversionCache(input_hash="0" * 64, format="h5", options="{}", path="vid.h5")
+        )
+        db.session.commit()
+        # the tables as they were before the columns were added
+        for table_name, column_names in ADDED_COLUMNS.items():
+            for name in column_names:
+                db.session.execute(text(f"ALTER TABLE {table_name} DROP COLUMN {name}"))
+        db.session.commit()
+        db.session.expire_all()
+
+        add_missing_columns()
+        add_missing_columns()
+
+        for table_name, column_names in ADDED_COLUMNS.items():
+            assert set(column_names) <= get_columns(table_name)
+        # the rows that existed get no values for the new columns
+        old_file = File.query.filter_by(index="/old_file").first()
+        assert old_file.width is None and old_file.codec is None
+        assert ConversionCache.query.first().dropped_frames is None
@@ -0,0 +1,130 @@
+"""Resumable chunked upload endpoints unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+import hashlib
+from rest_api.lib import resumable_upload_utils
+from . import pytest, client, app, delete_db_records, File
+from .test_file_storage import (
+    init_storage_test_envionment,
+    interactor,
+    SESSION_TOKEN_1,
+    SESSION_TOKEN_2,
+    VIDEO_PATH,
+    wait_for_upload,
+)
+
+
+def put_chunk(client, upload_id, offset, chunk, checksum=None):
+    """Send a chunk of a resumable upload."""
+    return client.put(
+        f"/api/files/uploads/{upload_id}?offset={offset}",
+        data=chunk,
+        headers={"X-Chunk-SHA256": checksum or hashlib.sha256(chunk).hexdigest()},
+    )
+
+
+def test_resumable_upload(client, app):
+    """
+    Tests uploading a video in chunks, resuming after a rejected chunk, and committing it
+    """
+    with open(VIDEO_PATH, "rb") as vid:
+        video = vid.read()
+    half = len(video) // 2
+
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+
+        response = client.post(
+            "/api/files/uploads", data={"path": "vid.mp4", "size": len(video)}
+        )
+        assert response.status_code == 201
+        upload_id = response.json["upload_id"]
+
+        assert put_chunk(client, upload_id, 0, video[:half]).json["offset"] == half
+
+        # a corrupted chunk is dropped
+        response = put_chunk(client, upload_id, half, video[half:], checksum="0" * 64)
+        assert response.status_code == 400
+        assert response.json["offset"] == half
+        # a chunk at the wrong offset is rejected with the offset to continue at
+        response = put_chunk(client, upload_id, 0, video[:half])
+        assert response.status_code == 409
+        assert response.json["offset"] == half
+
+        # the upload resumes at the confirmed bytes
+        response = client.get(f"/api/files/uploads/{upload_id}")
+        assert response.json["ranges"] == [[0, half]]
+        response = client.post(
+            f"/api/files/uploads/{upload_id}/commit", data={"tags[]": [], "format": "h5"}
+        )
+        assert response.status_code == 409
+
+        assert put_chunk(client, upload_id, half, video[half:]).json["offset"] == len(video)
+        response = client.post(
+            f"/api/files/uploads/{upload_id}/commit", data={"tags[]": [], "format": "h5"}
+        )
+        wait_for_upload(response)
+
+        assert "/vid.h5" in interactor.get_dir_content()
+        assert File.query.filter_by(index="/vid.h5").first().width == 480
+        # the upload is gone once committed
+        assert client.get(f"/api/files/uploads/{upload_id}").status_code == 404
+
+
+def test_resumable_upload_other_user(client, app):
+    """
+    Tests that the resumable upload of a user can not be continued or cancelled by another user
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        response = client.post("/api/files/uploads", data={"path": "file", "size": 4})
+        upload_id = response.json["upload_id"]
+
+        client.set_cookie("session-id", SESSION_TOKEN_2)
+        assert put_chunk(client, upload_id, 0, b"data").status_code == 404
+        assert client.delete(f"/api/files/uploads/{upload_id}").status_code == 404
+
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        assert client.delete(f"/api/files/uploads/{upload_id}").status_code == 200
+        assert client.get(f"/api/files/uploads/{upload_id}").status_code == 404
+
+
+def test_resumable_upload_commit_rejected(client, app):
+    """
+    Tests that an upload is kept when its commit is rejected, so the commit can be retried
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        response = client.post("/api/files/uploads", data={"path": "file", "size": 4})
+        upload_id = response.json["upload_id"]
+        put_chunk(client, upload_id, 0, b"data")
+
+        response = client.post(
+            f"/api/files/uploads/{upload_id}/commit", data={"tags[]": [], "format": "gif"}
+        )
+        assert response.status_code == 400
+        response = client.get(f"/api/files/uploads/{upload_id}")
+        assert response.status_code == 200
+        assert response.json["ranges"] == [[0, 4]]
+
+        response = client.post(
+            f"/api/files/uploads/{upload_id}/commit", data={"tags[]": [], "format": "none"}
+        )
+        wait_for_upload(response)
+        assert interactor.get_file("file").content == b"data"
+        assert client.get(f"/api/files/uploads/{upload_id}").status_code == 404
+
+
+def test_replicas_need_shared_dir(monkeypatch):
+    """
+    Tests that several replicas are refused without a configured staging folder
+    """
+    monkeypatch.setattr(resumable_upload_utils, "API_REPLICAS", 2)
+    monkeypatch.setattr(resumable_upload_utils, "UPLOAD_DIR_CONFIGURED", False)
+    with pytest.raises(RuntimeError):
+        resumable_upload_utils.check_shared_dir()
+
+    monkeypatch.setattr(resumable_upload_utils, "UPLOAD_DIR_CONFIGURED", True)
+    resumable_upload_utils.check_shared_dir()
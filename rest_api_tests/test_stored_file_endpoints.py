@@ -0,0 +1,344 @@
+"""Tests for the endpoints that work on files already stored in dCache."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+import io
+import zipfile
+import h5py
+import numpy as np
+from werkzeug.datastructures import MultiDict
+from rest_api.lib.conversion_cache_utils import get_cache_options
+from rest_api.routes.files.file_upload_endpoint import get_conversion_options
+from . import pytest, client, app, delete_db_records, File, ConversionCache
+from .test_file_storage import (
+    init_storage_test_envionment,
+    add_file_to_db_and_dcache,
+    interactor,
+    SESSION_TOKEN_1,
+    SESSION_TOKEN_2,
+    EMAIL_1,
+    VIDEO_PATH,
+    wait_for_upload,
+)
+
+
+def upload_raw_video(client):
+    """Upload the test video without converting it."""
+    with open(VIDEO_PATH, "rb") as vid:
+        response = client.post(
+            "/api/files/upload",
+            data={"vid.mp4": (vid, "vid.mp4"), "tags[]": [], "format": "none"},
+            content_type="multipart/form-data",
+        )
+        wait_for_upload(response)
+    return File.query.filter_by(index="/vid.mp4").first()
+
+
+def test_convert_stored_file(client, app):
+    """
+    Tests converting an mp4 that is already stored in dCache
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        source = upload_raw_video(client)
+
+        response = client.post(
+            f"/api/files/{source.id}/convert",
+            data={"format": ["h5", "jpeg"]},
+            content_type="multipart/form-data",
+        )
+        # the conversion runs in the background like an upload
+        wait_for_upload(response)
+
+        h5_row = File.query.filter_by(index="/vid.h5").first()
+        assert [t.name for t in h5_row.tags] == [EMAIL_1]
+        assert h5_row.width == 480
+        assert File.query.filter_by(index="/vid", type="directory").count() == 1
+
+        h5_file = io.BytesIO(interactor.get_file("vid.h5").content)
+        with h5py.File(h5_file, "r") as h5_file:
+            assert len(h5_file["jpeg_images"]) == 3
+        assert len(interactor.get_dir_content("vid")) == 3
+
+        # an output with other options is converted again, keeping its entry
+        response = client.post(
+            f"/api/files/{source.id}/convert",
+            data={"format": "h5", "frames": "keyframes"},
+            content_type="multipart/form-data",
+        )
+        wait_for_upload(response)
+        assert File.query.count() == 3
+        assert File.query.filter_by(index="/vid.h5").first().id == h5_row.id
+        options = get_conversion_options(MultiDict({"frames": "keyframes"}))
+        cached = ConversionCache.query.filter_by(path="vid.h5").one()
+        assert cached.options == get_cache_options("h5", options)
+
+
+def test_convert_stored_file_not_mp4(client, app):
+    """
+    Tests that only mp4 files can be converted
+    """
+    with app.app_context():
+        id_ = add_file_to_db_and_dcache(app, EMAIL_1, "test_file")
+
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        response = client.post(
+            f"/api/files/{id_}/convert",
+            data={"format": "h5"},
+            content_type="multipart/form-data",
+        )
+
+        assert response.status_code == 400
+        assert File.query.count() == 1
+
+
+def test_convert_stored_file_unauthorized(client, app):
+    """
+    Tests converting a file the user does not own
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        source = upload_raw_video(client)
+
+        client.set_cookie("session-id", SESSION_TOKEN_2)
+        response = client.post(
+            f"/api/files/{source.id}/convert",
+            data={"format": "h5"},
+            content_type="multipart/form-data",
+        )
+
+        assert response.status_code == 401
+        assert File.query.count() == 1
+
+
+def test_fetch_frame(client, app):
+    """
+    Tests fetching a single frame of a stored video
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        source = upload_raw_video(client)
+
+        response = client.get(f"/api/files/{source.id}/frames/2")
+
+        assert response.status_code == 200
+        assert response.content_type == "image/jpeg"
+        assert response.data[:2] == b"\xff\xd8"
+
+        # the test video has 3 frames
+        response = client.get(f"/api/files/{source.id}/frames/3")
+        assert response.status_code == 404
+
+
+def test_fetch_frames_batch(client, app):
+    """
+    Tests fetching a batch of frames of a stored video as zip
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        source = upload_raw_video(client)
+
+        response = client.get(f"/api/files/{source.id}/frames?start=0&count=3")
+
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.data)) as frames_zip:
+            assert frames_zip.namelist() == [
+                "frame_000000.jpeg",
+                "frame_000001.jpeg",
+                "frame_000002.jpeg",
+            ]
+
+        response = client.get(f"/api/files/{source.id}/frames?count=0")
+        assert response.status_code == 400
+
+
+def test_fetch_frame_unauthorized(client, app):
+    """
+    Tests fetching a frame of a video the user does not own
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        source = upload_raw_video(client)
+
+        client.set_cookie("session-id", SESSION_TOKEN_2)
+        response = client.get(f"/api/files/{source.id}/frames/0")
+
+        assert response.status_code == 401
+
+
+def test_fetch_thumbnail(client, app):
+    """
+    Tests fetching the thumbnail of a video with caching headers
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        source = upload_raw_video(client)
+
+        response = client.get(f"/api/files/{source.id}/thumbnail")
+
+        assert response.status_code == 200
+        assert response.content_type == "image/jpeg"
+        assert response.data[:2] == b"\xff\xd8"
+        assert response.headers["ETag"]
+        assert "max-age" in response.headers["Cache-Control"]
+
+        # the browser can revalidate its copy
+        response = client.get(
+            f"/api/files/{source.id}/thumbnail",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert response.status_code == 304
+
+
+def test_fetch_thumbnail_h5(client, app):
+    """
+    Tests fetching a contact sheet of an h5 conversion
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        h5_file = upload_h5_video(client)
+
+        response = client.get(f"/api/files/{h5_file.id}/thumbnail")
+
+        assert response.status_code == 200
+        assert response.content_type == "image/jpeg"
+
+
+def test_fetch_thumbnail_unsupported(client, app):
+    """
+    Tests that files that are not images, videos or datasets have no thumbnail
+    """
+    with app.app_context():
+        id_ = add_file_to_db_and_dcache(app, EMAIL_1, "test_file")
+
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        response = client.get(f"/api/files/{id_}/thumbnail")
+
+        assert response.status_code == 404
+
+
+def upload_h5_video(client):
+    """Upload the test video converted to h5."""
+    with open(VIDEO_PATH, "rb") as vid:
+        response = client.post(
+            "/api/files/upload",
+            data={"vid.mp4": (vid, "vid.mp4"), "tags[]": [], "format": "h5"},
+            content_type="multipart/form-data",
+        )
+        wait_for_upload(response)
+    return File.query.filter_by(index="/vid.h5").first()
+
+
+def test_fetch_h5_slice(client, app):
+    """
+    Tests fetching frames of an h5 file in dCache as npy and JPEG
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        h5_file = upload_h5_video(client)
+
+        response = client.get(f"/api/files/{h5_file.id}/h5?slice=1:3")
+        assert response.status_code == 200
+        frames = np.load(io.BytesIO(response.data))
+        assert frames.shape == (2, 360, 480, 3)
+
+        response = client.get(f"/api/files/{h5_file.id}/h5?slice=0&format=jpeg")
+        assert response.status_code == 200
+        assert response.content_type == "image/jpeg"
+
+        response = client.get(f"/api/files/{h5_file.id}/h5?format=jpeg")
+        assert response.status_code == 200
+        with zipfile.ZipFile(io.BytesIO(response.data)) as zip_file:
+            assert len(zip_file.namelist()) == 3
+
+
+def test_fetch_h5_slice_invalid(client, app):
+    """
+    Tests that invalid selections and missing datasets are rejected
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        h5_file = upload_h5_video(client)
+
+        response = client.get(f"/api/files/{h5_file.id}/h5?slice=a:b")
+        assert response.status_code == 400
+        response = client.get(f"/api/files/{h5_file.id}/h5?slice=10")
+        assert response.status_code == 400
+        response = client.get(f"/api/files/{h5_file.id}/h5?dataset=missing")
+        assert response.status_code == 404
+
+        client.set_cookie("session-id", SESSION_TOKEN_2)
+        response = client.get(f"/api/files/{h5_file.id}/h5")
+        assert response.status_code == 401
+
+
+def test_fetch_h5_slice_missing_file(client, app):
+    """
+    Tests that an h5 file whose entry exists but that was deleted from dCache is not found
+    """
+    file_id = add_file_to_db_and_dcache(app, EMAIL_1, "gone.h5")
+    interactor.delete_file("gone.h5")
+
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        response = client.get(f"/api/files/{file_id}/h5")
+        assert response.status_code == 404
+
+
+def test_create_virtual_dataset(client, app):
+    """
+    Tests combining stored h5 files into a virtual dataset and slicing it
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        h5_file = upload_h5_video(client)
+
+        response = client.post(
+            "/api/files/virtual",
+            data={"file": [h5_file.id, h5_file.id], "name": "all.h5", "tags[]": []},
+            content_type="multipart/form-data",
+        )
+
+        assert response.status_code == 200
+        virtual_file = File.query.filter_by(index="/all.h5").first()
+        assert response.json["file"]["id"] == virtual_file.id
+        assert [t.name for t in virtual_file.tags] == [EMAIL_1]
+
+        response = client.get(f"/api/files/{virtual_file.id}/h5?slice=2:5")
+        assert response.status_code == 200
+        frames = np.load(io.BytesIO(response.data))
+        assert frames.shape == (3, 360, 480, 3)
+
+        # the name of a file can not be used twice
+        response = client.post(
+            "/api/files/virtual",
+            data={"file": h5_file.id, "name": "all.h5"},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 400
+
+
+def test_create_virtual_dataset_invalid(client, app):
+    """
+    Tests that only h5 files the user has access to can be combined
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+        h5_file = upload_h5_video(client)
+        video = upload_raw_video(client)
+
+        response = client.post(
+            "/api/files/virtual",
+            data={"file": [h5_file.id, video.id], "name": "all.h5"},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 400
+
+        client.set_cookie("session-id", SESSION_TOKEN_2)
+        response = client.post(
+            "/api/files/virtual",
+            data={"file": h5_file.id, "name": "other.h5"},
+            content_type="multipart/form-data",
+        )
+        assert response.status_code == 401
@@ -0,0 +1,121 @@
+"""Streaming multipart upload unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+import io
+from werkzeug.datastructures import FileStorage, MultiDict
+from werkzeug.test import encode_multipart
+from rest_api.lib.streaming_upload_utils import iter_parts
+from . import pytest, client, app, delete_db_records, File
+from .test_file_storage import (
+    init_storage_test_envionment,
+    interactor,
+    create_test_file,
+    EMAIL_1,
+    SESSION_TOKEN_1,
+    TEST_STRING,
+    VIDEO_PATH,
+    wait_for_upload,
+)
+
+
+def encode_parts(parts):
+    """Encode a list of (name, value or FileStorage) as multipart body in the given order."""
+    boundary, body = encode_multipart(MultiDict(parts))
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def post_streamed(client, parts):
+    """Upload the parts of a multipart body with the streaming mode."""
+    body, content_type = encode_parts(parts)
+    return client.post(
+        "/api/files/upload?stream=true", data=body, content_type=content_type
+    )
+
+
+def test_iter_parts():
+    """
+    Tests reading the fields and files of a multipart body in order, skipping unread files
+    """
+    body, content_type = encode_parts(
+        [
+            ("format", "none"),
+            ("skipped", FileStorage(io.BytesIO(b"x" * 3_000_000), "skipped")),
+            ("read", FileStorage(io.BytesIO(b"data"), "read.txt")),
+        ]
+    )
+    boundary = content_type.rsplit("=", 1)[-1]
+
+    parts = []
+    for name, filename, data in iter_parts(io.BytesIO(body), boundary):
+        if name == "read":
+            data = b"".join(data)
+        parts.append((name, filename, data if name != "skipped" else None))
+    assert parts == [
+        ("format", None, "none"),
+        ("skipped", "skipped", None),
+        ("read", "read.txt", b"data"),
+    ]
+
+    # a body that ends in the middle of a part is malformed
+    with pytest.raises(ValueError):
+        list(iter_parts(io.BytesIO(body[:-100]), boundary))
+
+
+def test_streamed_upload(client, app):
+    """
+    Tests streaming an mp4 that is converted next to a file that is stored as it is
+    """
+    with open(VIDEO_PATH, "rb") as vid, app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+
+        response = post_streamed(
+            client,
+            [
+                ("format", "h5"),
+                ("vid.mp4", FileStorage(vid, "vid.mp4")),
+                ("file.txt", FileStorage(create_test_file(), "file.txt")),
+            ],
+        )
+        wait_for_upload(response)
+
+        dir_content = interactor.get_dir_content()
+        assert "/vid.h5" in dir_content
+        assert "/file.txt" in dir_content
+        assert interactor.get_file("file.txt").content == TEST_STRING.encode()
+
+        assert File.query.filter_by(index="/vid.h5").first().width == 480
+        txt_file = File.query.filter_by(index="/file.txt").first()
+        assert [t.name for t in txt_file.tags] == [EMAIL_1]
+
+
+def test_streamed_upload_rejected(client, app):
+    """
+    Tests that the files streamed to dCache are deleted when the upload is rejected
+    """
+    with app.app_context():
+        client.set_cookie("session-id", SESSION_TOKEN_1)
+
+        # the form fields have to come before the files
+        response = post_streamed(
+            client,
+            [
+                ("file.txt", FileStorage(create_test_file(), "file.txt")),
+                ("format", "none"),
+            ],
+        )
+        assert response.status_code == 400
+
+        # a broken video is only noticed once it is stored
+        response = post_streamed(
+            client,
+            [
+                ("format", "none"),
+                ("vid.mp4", FileStorage(create_test_file(), "vid.mp4")),
+            ],
+        )
+        assert response.status_code == 400
+
+        assert not interactor.get_dir_content()
+        assert File.query.count() == 0
@@ -3,6 +3,7 @@
 # # pylint: disable=unused-import
 # # pylint: disable=redefined-outer-name
 import io
+import os
 from . import (
     Task,
     Tag,
@@ -384,6 +385,52 @@ def test_create_new_task_parameters_and_tags(client, app):
         )
 
 
+def test_create_task_converts_input_format(client, app):
+    """Test that an mp4 input is converted to the requested format before it is staged."""
+    with app.app_context():
+        set_user_role(client, "Data Engineer")
+        video_path = os.path.join(os.path.dirname(__file__), "assets/testvid.mp4")
+        with open(video_path, "rb") as vid:
+            interactor.upload_file("vid.mp4", vid)
+        user_tag = Tag(name="admin@gmail.com", type="user")
+        db.session.add(File(index="/vid.mp4", type="file", tags=[user_tag]))
+        task_image = Image(
+            name="visiontransformer",
+            sylabs_path="library/visiontransformer",
+            parameters=[],
+        )
+        data_eng = Role.query.filter_by(name="Data Engineer").first()
+        task_image.roles.append(data_eng)
+        db.session.add(task_image)
+        db.session.commit()
+
+        response = client.post(
+            "/api/tasks",
+            json={
+                "name": "task_1",
+                "image": "visiontransformer",
+                "input": "/vid.mp4",
+                "parameters": [],
+                "tags": [],
+                "format": "h5",
+            },
+        )
+
+        assert response.status_code == 200
+        # the conversion is stored so later tasks can reuse it
+        converted = File.query.filter_by(index="/vid.h5").first()
+        assert converted is not None
+        assert converted.tags == [user_tag]
+
+        stored_task = db.session.query(Task).filter_by(name="task_1").first()
+        dir_content = interactor.get_dir_content_recursive(
+            "/projects/imagen/input_data_" + stored_task.token_id
+        )
+        assert dir_content == [
+            "/projects/imagen/input_data_" + stored_task.token_id + "/vid.h5"
+        ]
+
+
 def test_create_task_invalid_parameters(client, app):
     """Test unsuccessful creation of a new task as the parameters given don't match the parameters of the image."""
     with app.app_context():
@@ -0,0 +1,85 @@
+"""Thumbnail generation and cache unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+import threading
+import time
+from rest_api.file_converter import FileConverter
+from rest_api.thumbnailer import (
+    Thumbnailer,
+    decode_image,
+    h5_contact_sheet,
+    image_thumbnail,
+    sample_indices,
+    THUMBNAIL_SIZE,
+)
+from .test_file_converter import create_test_video
+
+
+def test_image_thumbnail_keeps_aspect_ratio():
+    """
+    Tests that a thumbnail fits in the thumbnail size
+    """
+    frames = FileConverter(processes=1).mp4_to_jpeg(
+        create_test_video(1, gop_size=1, width=640, height=360)
+    )
+
+    thumbnail = decode_image(image_thumbnail(frames[0]))
+
+    assert thumbnail.shape == (144, THUMBNAIL_SIZE, 3)
+
+
+def test_h5_contact_sheet():
+    """
+    Tests creating a contact sheet of frames sampled from an h5 conversion
+    """
+    converter = FileConverter(processes=1)
+    h5_file = converter.jpeg_to_h5(converter.mp4_to_jpeg(create_test_video(30, gop_size=10)))
+
+    sheet = decode_image(h5_contact_sheet(h5_file))
+
+    assert max(sheet.shape[:2]) <= THUMBNAIL_SIZE
+    assert sample_indices(30) == [0, 4, 7, 11, 14, 18, 22, 25, 29]
+    assert sample_indices(2) == [0, 1]
+
+
+def test_thumbnailer_generates_once():
+    """
+    Tests that concurrent requests for a thumbnail share one generation
+    """
+    thumbnailer = Thumbnailer()
+    generations = []
+
+    def generate():
+        generations.append(1)
+        time.sleep(0.1)
+        return b"thumbnail"
+
+    threads = [
+        threading.Thread(target=thumbnailer.get, args=("key", generate)) for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(generations) == 1
+    assert thumbnailer.get("key", generate)[0] == b"thumbnail"
+    assert len(generations) == 1
+
+
+def test_thumbnailer_evicts_least_recently_used():
+    """
+    Tests that the cache stays within its size by evicting the least recently used thumbnails
+    """
+    thumbnailer = Thumbnailer(max_bytes=3000)
+
+    for key in ["a", "b", "c"]:
+        thumbnailer.get(key, lambda: b"x" * 1000)
+    # mark a as recently used
+    thumbnailer.get("a", lambda: b"x" * 1000)
+    thumbnailer.get("d", lambda: b"x" * 1000)
+
+    assert list(thumbnailer.thumbnails) == ["c", "a", "d"]
+    assert thumbnailer.cached_bytes == 3000
@@ -0,0 +1,374 @@
+"""Upload progress registry unit tests."""
+
+# pylint: disable=unused-import
+# pylint: disable=redefined-outer-name
+
+import json
+import threading
+import io
+import time
+from datetime import datetime, timedelta
+from werkzeug.datastructures import FileStorage, MultiDict
+from rest_api.conversion_scheduler import ConversionScheduler
+from rest_api.routes.files import file_upload_endpoint, file_upload_status_endpoint
+from rest_api.upload_progress import LOST_MESSAGE, ProgressRegistry
+from . import (
+    pytest,
+    app,
+    client,
+    delete_db_records,
+    db,
+    Role,
+    Session,
+    Tag,
+    User,
+    UploadProgress,
+)
+
+
+def add_users(*uids):
+    """Add users the progress can belong to."""
+    for uid in uids:
+        db.session.add(User(email=f"user{uid}@example.com", password_hash="", id=uid))
+    db.session.commit()
+
+
+def add_session(client, uid):
+    """Log the client in as a user."""
+    db.session.add(
+        Session(
+            session_token="token",
+            user_id=uid,
+            expiration_datetime=datetime.now() + timedelta(hours=1),
+        )
+    )
+    db.session.commit()
+    client.set_cookie("session-id", "token")
+
+
+def test_directory_reported_after_last_file(app):
+    """
+    Tests that a directory is done once all its files are, and the progress is dropped once read
+    """
+    with app.app_context():
+        add_users(1)
+        progress = ProgressRegistry()
+        progress.add_files(1, [("dir/a", "dir/"), ("dir/b", "dir/"), ("file", "file")])
+        assert UploadProgress.query.count() == 2
+
+        assert not progress.remove_file(1, "dir/a")
+        assert progress.remove_file(1, "file")
+        progress.add_dropped(1, "file", 3)
+        progress.finish(1, ["file"])
+        assert progress.pop_finished(1) == [("file", None, 3, None)]
+
+        assert progress.remove_file(1, "dir/b")
+        progress.finish(1, ["dir/"])
+        assert progress.pop_finished(1) == [("dir/", None, None, None)]
+        # everything is reported, so there is nothing to wait for
+        assert progress.wait(1, None) is None
+
+
+def test_wait_blocks_until_update(app):
+    """
+    Tests that a stream sleeps until the progress of its user changes, or the timeout passes,
+    also when the change is made by another registry, like the one of another replica
+    """
+    with app.app_context():
+        add_users(1, 2)
+        progress = ProgressRegistry()
+        other_replica = ProgressRegistry()
+        other_replica.add_files(1, [("file", "file")])
+        version = progress.wait(1, None)
+
+        # nothing changed, so the wait times out with the same version
+        start = time.monotonic()
+        assert progress.wait(1, version, timeout=0.2) == version
+        assert time.monotonic() - start >= 0.2
+
+        def finish():
+            time.sleep(0.1)
+            with app.app_context():
+                other_replica.remove_file(1, "file")
+                other_replica.finish(1, ["file"])
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        assert progress.wait(1, version, timeout=5) != version
+        thread.join()
+        assert progress.pop_finished(1) == [("file", None, None, None)]
+        # the other user is not affected
+        assert progress.wait(2, None) is None
+
+
+def test_directory_files_counted(app):
+    """
+    Tests that a file added again is counted once, and a removed file only once
+    """
+    with app.app_context():
+        add_users(1)
+        progress = ProgressRegistry()
+        progress.add_files(1, [("dir/a", "dir/"), ("dir/b", "dir/")])
+        progress.add_files(1, [("dir/a", "dir/")])
+
+        assert not progress.remove_file(1, "dir/a")
+        assert not progress.remove_file(1, "dir/a")
+        assert progress.remove_file(1, "dir/b")
+
+
+def test_failed_upload(app):
+    """
+    Tests that the items of a failed upload are reported with the error
+    """
+    with app.app_context():
+        add_users(1)
+        progress = ProgressRegistry()
+        progress.add_files(1, [("dir/a", "dir/"), ("dir/b", "dir/"), ("other", "other")])
+        progress.remove_file(1, "dir/a")
+
+        progress.fail(1, {"dir/"}, "The upload failed.")
+        assert progress.pop_finished(1) == [("dir/", "The upload failed.", None, None)]
+        # the upload of the other item goes on
+        assert progress.remove_file(1, "other")
+
+
+def test_queue_positions(app):
+    """
+    Tests that the positions of waiting conversions are stored, with 0 once they started
+    """
+    with app.app_context():
+        add_users(1)
+        progress = ProgressRegistry()
+        progress.add_files(1, [("a", "a"), ("b", "b")], job_id="job")
+
+        progress.set_positions({(1, "a"): 1, (1, "b"): 2})
+        assert progress.get_positions(1) == {
+            "a": {"position": 1, "job_id": "job"},
+            "b": {"position": 2, "job_id": "job"},
+        }
+        progress.set_positions({(1, "b"): 1})
+        assert progress.get_positions(1) == {
+            "a": {"position": 0, "job_id": "job"},
+            "b": {"position": 1, "job_id": "job"},
+        }
+
+
+def test_transfer_progress(app):
+    """
+    Tests that the bytes and frames of an item are reported with the throughput and time left,
+    at most a few times per second
+    """
+    with app.app_context():
+        add_users(1)
+        progress = ProgressRegistry()
+        progress.add_files(
+            1, [("dir/a", "dir/"), ("dir/b", "dir/")], {"dir/": (100, 10)}, "job"
+        )
+        assert not progress.get_transfers(1)
+
+        # the first transfer is reported right away, without a throughput yet
+        progress.add_transfer(1, "dir/", 40)
+        assert progress.get_transfers(1) == {
+            "dir/": {
+                "bytes": 40,
+                "total_bytes": 100,
+                "frames": 0,
+                "total_frames": 10,
+                "bytes_per_second": None,
+                "frames_per_second": None,
+                "eta": None,
+                "job_id": "job",
+            }
+        }
+        # the next one waits for the rate limit
+        progress.add_transfer(1, "dir/", 5, "frames")
+        assert progress.get_transfers(1)["dir/"]["frames"] == 0
+
+        time.sleep(0.3)
+        progress.add_transfer(1, "dir/", 10)
+        transfer = progress.get_transfers(1)["dir/"]
+        assert (transfer["bytes"], transfer["frames"]) == (50, 5)
+        assert transfer["bytes_per_second"] > 0
+        assert transfer["frames_per_second"] > 0
+        # the slower of the bytes and frames decides the time left
+        assert transfer["eta"] == pytest.approx(
+            max(50 / transfer["bytes_per_second"], 5 / transfer["frames_per_second"])
+        )
+
+        progress.finish(1, ["dir/"])
+        assert not progress.get_transfers(1)
+
+
+def test_progress_events(client, app):
+    """
+    Tests that the status stream sends the progress of an item before it is done
+    """
+    progress = file_upload_endpoint.progress
+    with app.app_context():
+        add_users(1)
+        add_session(client, 1)
+        progress.add_files(1, [("video.mp4", "video.mp4")], {"video.mp4": (10, None)}, "job")
+        progress.add_transfer(1, "video.mp4", 4)
+
+        def finish():
+            time.sleep(0.5)
+            with app.app_context():
+                progress.remove_file(1, "video.mp4")
+                progress.finish(1, ["video.mp4"])
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        response = client.get("/api/files/statusstream/1", buffered=True)
+        thread.join()
+
+        events = response.get_data(as_text=True).split("\n\n")
+        assert events[0].startswith("event: progress\ndata: ")
+        report = json.loads(events[0].split("data: ", 1)[1])
+        assert (report["path"], report["bytes"], report["total_bytes"]) == ("video.mp4", 4, 10)
+        # the client can tell which upload the item belongs to
+        assert report["job_id"] == "job"
+        assert "data: video.mp4" in events
+
+
+def test_changes_read_at_heartbeat(client, app, monkeypatch):
+    """
+    Tests that the status stream reads the progress at every heartbeat,
+    so it sees changes whose notification it did not get
+    """
+    monkeypatch.setattr(file_upload_status_endpoint, "UPLOAD_HEARTBEAT_SECONDS", 0.2)
+    with app.app_context():
+        add_users(1)
+        add_session(client, 1)
+        file_upload_endpoint.progress.add_files(1, [("file", "file")])
+
+        def finish():
+            time.sleep(0.5)
+            with app.app_context():
+                # like a replica that lost its notification
+                UploadProgress.query.update({UploadProgress.done: True})
+                db.session.commit()
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        response = client.get("/api/files/statusstream/1")
+        events = []
+        # give up after a few seconds of heartbeats instead of waiting forever
+        for event in response.response:
+            events.append(event.decode().strip())
+            if events[-1] == "data: file" or len(events) > 20:
+                break
+        response.close()
+        thread.join()
+
+        assert ": heartbeat" in events
+        assert events[-1] == "data: file"
+
+
+def test_abandoned_progress_evicted(app):
+    """
+    Tests that items nobody reads are dropped after the TTL, unless they are still uploading
+    """
+    with app.app_context():
+        add_users(1, 2, 3)
+        progress = ProgressRegistry(ttl=60)
+        progress.add_files(1, [("done", "done")])
+        progress.finish(1, ["done"])
+        progress.add_files(2, [("uploading", "uploading")])
+        UploadProgress.query.update({UploadProgress.updated: datetime.now() - timedelta(hours=1)})
+        db.session.commit()
+
+        progress.add_files(3, [("new", "new")])
+        assert {row.user_id for row in UploadProgress.query.all()} == {2, 3}
+
+
+def test_scheduler_reports_changes():
+    """
+    Tests that the scheduler reports when its waiting conversions change
+    """
+    changes = []
+    scheduler = ConversionScheduler(
+        workers=1, on_change=lambda: changes.append(scheduler.get_all_positions())
+    )
+    assert scheduler.run(1, 1, 1, lambda: "done", label="video") == "done"
+    # once queued and once started
+    assert changes == [{(1, "video"): 1}, {}]
+
+
+def test_upload_frame_totals(app):
+    """
+    Tests that the total frames of a video are only reported when every decoded frame is kept
+    """
+    with app.app_context():
+        add_users(1)
+        user = db.session.get(User, 1)
+        db.session.add(Tag(name=user.email, type="user"))
+        db.session.commit()
+        files = [("vid.mp4", FileStorage(io.BytesIO(b"video"), "vid.mp4", "vid.mp4"))]
+
+        for form, total_frames in (
+            ({"format": "h5"}, 3),
+            ({"format": "h5", "frames": "keyframes"}, None),
+            ({"format": "h5", "dedup_distance": 4}, None),
+        ):
+            job = file_upload_endpoint.UploadJob(files, MultiDict(form), user)
+            job.media = {"vid.mp4": {"frame_count": 3}}
+            assert job.get_totals() == {"vid.mp4": (5, total_frames)}
+
+
+def test_lost_upload_failed(app):
+    """
+    Tests that the items of an upload whose process stopped are failed,
+    while those of processes that still run are kept
+    """
+    with app.app_context():
+        add_users(1)
+        progress = ProgressRegistry()
+        progress.add_files(1, [("running", "running")])
+        # an item of a process that holds no lock anymore, and one from before the locks
+        db.session.add(UploadProgress(user_id=1, item="lost", owner=1))
+        db.session.add(UploadProgress(user_id=1, item="old"))
+        db.session.commit()
+
+        ProgressRegistry().fail_lost()
+
+        assert sorted(progress.pop_finished(1)) == [
+            ("lost", LOST_MESSAGE, None, None),
+            ("old", LOST_MESSAGE, None, None),
+        ]
+        assert UploadProgress.query.filter_by(item="running", done=False).count() == 1
+
+
+def test_upload_jobs_not_queued(client, app, monkeypatch):
+    """
+    Tests that upload jobs are not queued behind the jobs that are running,
+    so a small upload is not held back by a bulk import of another user
+    """
+    jobs = []
+    # passed once the test and every job wait at it at the same time
+    all_running = threading.Barrier(9, timeout=10)
+
+    def process(_job):
+        all_running.wait()
+
+    monkeypatch.setattr(file_upload_endpoint.UploadJob, "process", process)
+    with app.app_context():
+        add_users(1)
+        # uploading needs a role and the user tag
+        user = db.session.get(User, 1)
+        user.roles.append(Role.query.filter_by(name="Data Engineer").first())
+        db.session.add(Tag(name=user.email, type="user"))
+        add_session(client, 1)
+
+        for i in range(8):
+            response = client.post(
+                "/api/files/upload",
+                data={f"file_{i}": (io.BytesIO(b"data"), f"file_{i}"), "format": "none"},
+                content_type="multipart/form-data",
+            )
+            assert response.status_code == 202
+            jobs.append(file_upload_endpoint.upload_jobs[response.json["job_id"]])
+
+        # every job runs while the others have not finished
+        all_running.wait()
+        for job in jobs:
+            job.result(timeout=10)